@@ -0,0 +1,116 @@
+import dataclasses
+import re
+import threading
+from collections import deque
+from typing import Callable, Iterable
+
+from app import model, util
+from app.config import settings
+
+# CityJSON city object types (plus extensions, starting with '+'). Other objects with a "type"
+# (geometries, semantic surfaces, textures, etc.) use different values
+CITY_OBJECT_TYPES = frozenset((
+    'Bridge', 'BridgePart', 'BridgeInstallation', 'BridgeConstructiveElement', 'BridgeRoom', 'BridgeFurniture',
+    'Building', 'BuildingPart', 'BuildingInstallation', 'BuildingConstructiveElement', 'BuildingFurniture',
+    'BuildingStorey', 'BuildingRoom', 'BuildingUnit', 'CityFurniture', 'CityObjectGroup', 'GenericCityObject',
+    'LandUse', 'OtherConstruction', 'PlantCover', 'SolitaryVegetationObject', 'TINRelief', 'TransportSquare',
+    'Railway', 'Road', 'Tunnel', 'TunnelPart', 'TunnelInstallation', 'TunnelConstructiveElement',
+    'TunnelHollowSpace', 'TunnelFurniture', 'WaterBody', 'Waterway',
+))
+CITYJSON_TYPE_RE = re.compile(r'"type"\s*:\s*"([^"]+)"')
+CITYJSON_VERTICES_RE = re.compile(r'"vertices"\s*:\s*\[')
+CITYJSON_VERTICES_END_RE = re.compile(r'\]\s*\]')
+CITYGML_MEMBER_RE = re.compile(r'<(?:[\w-]+:)?cityObjectMember\b')
+CITYGML_POS_RE = re.compile(r'<(?:[\w-]+:)?(?:posList|pos)\b[^>]*>([^<]*)<')
+
+
+@dataclasses.dataclass(slots=True)
+class JobCost:
+    bytes: int = 0
+    city_objects: int = 0
+    vertices: int = 0
+
+    def __add__(self, other: 'JobCost') -> 'JobCost':
+        return JobCost(self.bytes + other.bytes, self.city_objects + other.city_objects,
+                       self.vertices + other.vertices)
+
+    def __sub__(self, other: 'JobCost') -> 'JobCost':
+        return JobCost(self.bytes - other.bytes, self.city_objects - other.city_objects,
+                       self.vertices - other.vertices)
+
+    def exceeds(self, limits: 'JobCost') -> list[str]:
+        # Names of the dimensions above a (non-zero) limit
+        return [field.name for field in dataclasses.fields(self)
+                if getattr(limits, field.name) and getattr(self, field.name) > getattr(limits, field.name)]
+
+
+def scan(data: str) -> JobCost:
+    # Cheap estimate of the size of a CityJSON or CityGML document, without parsing it
+    if util.is_xml(data):
+        vertices = sum(len(m.group(1).split()) for m in CITYGML_POS_RE.finditer(data)) // 3
+        return JobCost(len(data), len(CITYGML_MEMBER_RE.findall(data)), vertices)
+    city_objects = sum(1 for m in CITYJSON_TYPE_RE.finditer(data)
+                       if m.group(1) in CITY_OBJECT_TYPES or m.group(1).startswith('+'))
+    vertices = 0
+    if m := CITYJSON_VERTICES_RE.search(data):
+        end = CITYJSON_VERTICES_END_RE.search(data, m.end())
+        if end and data[m.end():end.start() + 1].strip() != ']':
+            vertices = data.count('[', m.end(), end.start() + 1)
+    return JobCost(len(data), city_objects, vertices)
+
+
+def estimate(city_files: Iterable[model.InputFile]) -> JobCost:
+    return sum((scan(city_file.data_str) for city_file in city_files), JobCost())
+
+
+def job_limits() -> JobCost:
+    return JobCost(settings.max_job_bytes, settings.max_job_city_objects, settings.max_job_vertices)
+
+
+def node_budget() -> JobCost:
+    return JobCost(settings.admission_budget_bytes, settings.admission_budget_city_objects,
+                   settings.admission_budget_vertices)
+
+
+class AdmissionController:
+    # Runs work (jobs and datasets) in its own threads as long as the total cost of the running work fits
+    # in the node budget. Work that does not fit is queued (in order) until enough running work finishes.
+    # Work that exceeds the budget on its own is run when nothing else is running
+
+    def __init__(self):
+        self.running = JobCost()
+        self.running_count = 0
+        self.queue: deque[tuple[JobCost, Callable[[], None]]] = deque()
+        self._lock = threading.Lock()
+
+    def _fits(self, cost: JobCost) -> bool:
+        return not self.running_count or not (self.running + cost).exceeds(node_budget())
+
+    @property
+    def is_full(self) -> bool:
+        return bool(settings.admission_max_queued) and len(self.queue) >= settings.admission_max_queued
+
+    def submit(self, cost: JobCost, fn: Callable[[], None]):
+        with self._lock:
+            if self.queue or not self._fits(cost):
+                self.queue.append((cost, fn))
+                return
+            self._start(cost, fn)
+
+    def _start(self, cost: JobCost, fn: Callable[[], None]):
+        self.running += cost
+        self.running_count += 1
+        threading.Thread(target=self._run, args=(cost, fn), daemon=True).start()
+
+    def _run(self, cost: JobCost, fn: Callable[[], None]):
+        try:
+            fn()
+        finally:
+            with self._lock:
+                self.running -= cost
+                self.running_count -= 1
+                while self.queue and self._fits(self.queue[0][0]):
+                    self._start(*self.queue.popleft())
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,531 @@
+import math
+import re
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Any
+from xml.etree import ElementTree
+
+import orjson
+
+from app import limits
+from app.config import settings
+
+CITYGML_MODULES = {
+    'core', 'building', 'transportation', 'landuse', 'generics', 'construction',
+}
+CITYGML_NAMESPACE = re.compile(r'^http://www\.opengis\.net/citygml/(?:(\w+)/)?([23])\.0$')
+GML_NAMESPACES = {'http://www.opengis.net/gml', 'http://www.opengis.net/gml/3.2'}
+GML_ID = ('{http://www.opengis.net/gml}id', '{http://www.opengis.net/gml/3.2}id')
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+
+CITY_OBJECT_TYPES = {'Building', 'BuildingPart', 'Road', 'LandUse'}
+SEMANTIC_SURFACE_PROPERTIES = {'boundedBy', 'boundary', 'trafficArea', 'auxiliaryTrafficArea'}
+SEMANTIC_SURFACE_TYPES = {
+    'RoofSurface', 'GroundSurface', 'WallSurface', 'ClosureSurface', 'OuterCeilingSurface', 'OuterFloorSurface',
+    'TrafficArea', 'AuxiliaryTrafficArea',
+}
+BUILDING_PART_PROPERTIES = {'consistsOfBuildingPart', 'buildingPart'}
+LOD_GEOMETRY_PROPERTY = re.compile(r'^lod([12])(Solid|MultiSurface)$')
+IGNORED_PROPERTIES = {'boundedBy', 'description', 'metaDataProperty'}
+INT_ATTRIBUTES = {'storeysAboveGround', 'storeysBelowGround', 'yearOfConstruction', 'yearOfDemolition'}
+FLOAT_ATTRIBUTES = {'measuredHeight'}
+GENERIC_ATTRIBUTE_TYPES = {
+    'stringAttribute': str, 'StringAttribute': str,
+    'intAttribute': int, 'IntAttribute': int,
+    'doubleAttribute': float, 'DoubleAttribute': float,
+    'measureAttribute': float, 'MeasureAttribute': float,
+    'dateAttribute': str, 'DateAttribute': str,
+    'uriAttribute': str, 'UriAttribute': str,
+}
+
+VERTEX_SCALE = 0.001
+
+
+class UnsupportedCityGML(Exception):
+    pass
+
+
+def _split_tag(elem: ElementTree.Element) -> tuple[str | None, str]:
+    # Returns ('gml' | CityGML module | None, local name)
+    tag = elem.tag
+    if not isinstance(tag, str) or tag[0] != '{':
+        return None, tag
+    ns, local_name = tag[1:].split('}', 1)
+    if ns in GML_NAMESPACES:
+        return 'gml', local_name
+    m = CITYGML_NAMESPACE.match(ns)
+    if m and (m.group(1) or 'core') in CITYGML_MODULES:
+        return m.group(1) or 'core', local_name
+    return None, local_name
+
+
+def _gml_id(elem: ElementTree.Element) -> str | None:
+    for attr in GML_ID:
+        if attr in elem.attrib:
+            return elem.attrib[attr]
+    return None
+
+
+def _epsg_uri(srs_name: str | None) -> str | None:
+    m = re.search(r'EPSG(?:/0/|::?)(\d+)', srs_name or '')
+    return f"https://www.opengis.net/def/crs/EPSG/0/{m.group(1)}" if m else None
+
+
+class CityJSONBuilder:
+
+    def __init__(self):
+        self.vertices: dict[tuple[int, int, int], int] = {}
+        self.translate: tuple[float, float, float] | None = None
+        self.reference_system: str | None = None
+        self.min = [math.inf] * 3
+        self.max = [-math.inf] * 3
+
+    def add_vertex(self, x: float, y: float, z: float) -> int:
+        if self.translate is None:
+            self.translate = (math.floor(x), math.floor(y), math.floor(z))
+        key = (round((x - self.translate[0]) / VERTEX_SCALE),
+               round((y - self.translate[1]) / VERTEX_SCALE),
+               round((z - self.translate[2]) / VERTEX_SCALE))
+        idx = self.vertices.get(key)
+        if idx is None:
+            idx = self.vertices[key] = len(self.vertices)
+            for i in range(3):
+                self.min[i] = min(self.min[i], key[i])
+                self.max[i] = max(self.max[i], key[i])
+        return idx
+
+    def ring(self, linear_ring: ElementTree.Element) -> list[int]:
+        coords = []
+        for child in linear_ring:
+            module, name = _split_tag(child)
+            if module != 'gml':
+                raise UnsupportedCityGML(f"Unsupported ring member {child.tag}")
+            if name == 'posList':
+                dim = int(child.get('srsDimension') or linear_ring.get('srsDimension') or 3)
+                if dim != 3:
+                    raise UnsupportedCityGML(f"Unsupported coordinate dimension {dim}")
+                values = [float(v) for v in (child.text or '').split()]
+                coords.extend(values[i:i + 3] for i in range(0, len(values) - 2, 3))
+            elif name == 'pos':
+                values = [float(v) for v in (child.text or '').split()]
+                if len(values) != 3:
+                    raise UnsupportedCityGML(f"Unsupported coordinate dimension {len(values)}")
+                coords.append(values)
+            else:
+                raise UnsupportedCityGML(f"Unsupported ring member gml:{name}")
+        if len(coords) > 1 and coords[0] == coords[-1]:
+            coords.pop()
+        return [self.add_vertex(*c) for c in coords]
+
+    def polygon(self, polygon: ElementTree.Element) -> list[list[int]]:
+        rings = []
+        for child in polygon:
+            module, name = _split_tag(child)
+            if module == 'gml' and name in ('exterior', 'interior'):
+                if len(child) != 1 or _split_tag(child[0]) != ('gml', 'LinearRing'):
+                    raise UnsupportedCityGML('Unsupported polygon ring')
+                ring = self.ring(child[0])
+                if name == 'exterior':
+                    rings.insert(0, ring)
+                else:
+                    rings.append(ring)
+            elif module == 'gml' and name in IGNORED_PROPERTIES | {'name'}:
+                continue
+            else:
+                raise UnsupportedCityGML(f"Unsupported polygon member {child.tag}")
+        return rings
+
+    def extent(self) -> list[float]:
+        if not self.vertices:
+            return []
+        return [self.translate[i % 3] + (self.min if i < 3 else self.max)[i % 3] * VERTEX_SCALE for i in range(6)]
+
+
+class ObjectConverter:
+    # Converts a single top-level city object (and its building parts), resolving xlinks to
+    # polygons defined within the same object
+
+    def __init__(self, builder: CityJSONBuilder):
+        self.builder = builder
+        self.polygons: dict[str, list[list[int]]] = {}
+        self.polygon_semantics: dict[str, int] = {}
+        self.referenced: set[str] = set()
+
+    def _polygon(self, elem: ElementTree.Element) -> list[list[int]]:
+        rings = self.builder.polygon(elem)
+        polygon_id = _gml_id(elem)
+        if polygon_id:
+            self.polygons[polygon_id] = rings
+        return rings
+
+    def _surfaces(self, elem: ElementTree.Element) -> list[tuple[list[list[int]], str | None]]:
+        # Flattens a (multi/composite) surface into (polygon, gml:id) pairs
+        module, name = _split_tag(elem)
+        if module != 'gml':
+            raise UnsupportedCityGML(f"Unsupported surface {elem.tag}")
+        if name == 'Polygon':
+            return [(self._polygon(elem), _gml_id(elem))]
+        if name in ('MultiSurface', 'CompositeSurface', 'Shell'):
+            result = []
+            for member in elem:
+                member_module, member_name = _split_tag(member)
+                if member_module != 'gml':
+                    raise UnsupportedCityGML(f"Unsupported surface member {member.tag}")
+                if member_name in IGNORED_PROPERTIES | {'name'}:
+                    continue
+                if member_name not in ('surfaceMember', 'surfaceMembers'):
+                    raise UnsupportedCityGML(f"Unsupported surface member gml:{member_name}")
+                href = member.get(XLINK_HREF)
+                if href:
+                    result.append((None, href.lstrip('#')))
+                for surface in member:
+                    result.extend(self._surfaces(surface))
+            return result
+        raise UnsupportedCityGML(f"Unsupported surface gml:{name}")
+
+    def _resolve(self, surfaces: list[tuple[list[list[int]] | None, str | None]]) -> list[list[list[int]]]:
+        resolved = []
+        for rings, polygon_id in surfaces:
+            if rings is None:
+                self.referenced.add(polygon_id)
+                rings = self.polygons.get(polygon_id)
+                if rings is None:
+                    raise UnsupportedCityGML(f"Unresolved xlink to #{polygon_id}")
+            resolved.append(rings)
+        return resolved
+
+    def _semantic_surface(self, elem: ElementTree.Element, semantic_surfaces: list[dict],
+                          lod_surfaces: dict[int, list]):
+        module, name = _split_tag(elem)
+        if name not in SEMANTIC_SURFACE_TYPES:
+            raise UnsupportedCityGML(f"Unsupported boundary surface {elem.tag}")
+        surface_idx = len(semantic_surfaces)
+        semantic_surfaces.append({'type': name})
+        for child in elem:
+            child_module, child_name = _split_tag(child)
+            m = LOD_GEOMETRY_PROPERTY.match(child_name)
+            if m and m.group(2) == 'MultiSurface' and len(child) == 1:
+                lod = int(m.group(1))
+                for rings, polygon_id in self._surfaces(child[0]):
+                    if polygon_id:
+                        self.polygon_semantics[polygon_id] = surface_idx
+                    # Polygons referenced with xlinks are part of another geometry
+                    if rings is not None:
+                        lod_surfaces.setdefault(lod, []).append((rings, surface_idx, polygon_id))
+            elif child_module == 'gml' or len(child) == 0:
+                continue
+            else:
+                raise UnsupportedCityGML(f"Unsupported boundary surface property {child.tag}")
+
+    def convert(self, elem: ElementTree.Element, parent_id: str | None = None) -> list[tuple[str, dict]]:
+        module, object_type = _split_tag(elem)
+        if module is None or object_type not in CITY_OBJECT_TYPES:
+            raise UnsupportedCityGML(f"Unsupported city object {elem.tag}")
+
+        object_id = _gml_id(elem) or f"UUID_{uuid.uuid4()}"
+        city_object: dict[str, Any] = {'type': object_type}
+        attributes = {}
+        geometry_properties = []
+        semantic_surfaces = []
+        lod_surfaces: dict[int, list] = {}
+        parts = []
+
+        for child in elem:
+            child_module, child_name = _split_tag(child)
+            if child_module is None:
+                raise UnsupportedCityGML(f"Unsupported property {child.tag}")
+            if child_module == 'gml':
+                if child_name == 'name' and child.text:
+                    _set_attribute(attributes, 'name', child.text.strip())
+                elif child_name not in IGNORED_PROPERTIES:
+                    raise UnsupportedCityGML(f"Unsupported property gml:{child_name}")
+            elif child_name in SEMANTIC_SURFACE_PROPERTIES:
+                for surface in child:
+                    self._semantic_surface(surface, semantic_surfaces, lod_surfaces)
+            elif m := LOD_GEOMETRY_PROPERTY.match(child_name):
+                if len(child) != 1:
+                    raise UnsupportedCityGML(f"Unsupported geometry property {child.tag}")
+                geometry_properties.append((int(m.group(1)), m.group(2), child[0]))
+            elif child_name in BUILDING_PART_PROPERTIES:
+                parts.extend(child)
+            elif child_module == 'generics' or child_name == 'genericAttribute':
+                self._generic_attribute(child, attributes)
+            elif len(child) == 0:
+                value = (child.text or '').strip()
+                if child_name in INT_ATTRIBUTES:
+                    value = int(value)
+                elif child_name in FLOAT_ATTRIBUTES:
+                    value = float(value)
+                _set_attribute(attributes, child_name, value)
+            else:
+                raise UnsupportedCityGML(f"Unsupported property {child.tag}")
+
+        geometries = []
+        for lod, geometry_type, geometry_elem in geometry_properties:
+            geometries.append(self._geometry(lod, geometry_type, geometry_elem, semantic_surfaces))
+
+        # Boundary surfaces that are not part of any other geometry of their LoD become a MultiSurface
+        for lod, surfaces in sorted(lod_surfaces.items()):
+            pending = [(rings, idx) for rings, idx, polygon_id in surfaces if polygon_id not in self.referenced]
+            if pending:
+                geometries.append(self._with_semantics({
+                    'type': 'MultiSurface',
+                    'lod': str(lod),
+                    'boundaries': [rings for rings, _ in pending],
+                }, semantic_surfaces, [idx for _, idx in pending]))
+
+        if attributes:
+            city_object['attributes'] = attributes
+        if geometries:
+            city_object['geometry'] = geometries
+        if parent_id:
+            city_object['parents'] = [parent_id]
+
+        part_objects = []
+        for part in parts:
+            part_objects.extend(ObjectConverter(self.builder).convert(part, object_id))
+        children = [part_id for part_id, part in part_objects if part.get('parents') == [object_id]]
+        if children:
+            city_object['children'] = children
+
+        return [(object_id, city_object)] + part_objects
+
+    @staticmethod
+    def _with_semantics(geometry: dict, semantic_surfaces: list[dict], values: list[int | None]) -> dict:
+        if any(v is not None for v in values):
+            geometry['semantics'] = {
+                'surfaces': semantic_surfaces,
+                'values': [values] if geometry['type'] == 'Solid' else values,
+            }
+        return geometry
+
+    def _geometry(self, lod: int, geometry_type: str, elem: ElementTree.Element,
+                  semantic_surfaces: list[dict]) -> dict:
+        module, name = _split_tag(elem)
+        if geometry_type == 'Solid':
+            if (module, name) != ('gml', 'Solid'):
+                raise UnsupportedCityGML(f"Unsupported solid {elem.tag}")
+            surfaces = []
+            for child in elem:
+                child_module, child_name = _split_tag(child)
+                if child_module == 'gml' and child_name == 'exterior' and len(child) == 1:
+                    surfaces = self._surfaces(child[0])
+                elif child_module == 'gml' and child_name in IGNORED_PROPERTIES | {'name'}:
+                    continue
+                else:
+                    raise UnsupportedCityGML(f"Unsupported solid member {child.tag}")
+            boundaries = [self._resolve(surfaces)]
+        else:
+            surfaces = self._surfaces(elem)
+            boundaries = self._resolve(surfaces)
+
+        values = [self.polygon_semantics.get(polygon_id) for _, polygon_id in surfaces]
+        return self._with_semantics({
+            'type': geometry_type,
+            'lod': str(lod),
+            'boundaries': boundaries,
+        }, semantic_surfaces, values)
+
+    @staticmethod
+    def _generic_attribute(elem: ElementTree.Element, attributes: dict):
+        # CityGML 2.0: <gen:stringAttribute name="..."><gen:value>...</gen:value></gen:stringAttribute>
+        # CityGML 3.0: <core:genericAttribute><gen:StringAttribute><gen:name/><gen:value/>...
+        if len(elem) == 1 and _split_tag(elem[0])[1] in GENERIC_ATTRIBUTE_TYPES:
+            elem = elem[0]
+        value_type = GENERIC_ATTRIBUTE_TYPES.get(_split_tag(elem)[1])
+        if value_type is None:
+            raise UnsupportedCityGML(f"Unsupported generic attribute {elem.tag}")
+        name = elem.get('name')
+        value = None
+        for child in elem:
+            child_name = _split_tag(child)[1]
+            if child_name == 'name':
+                name = (child.text or '').strip()
+            elif child_name == 'value':
+                value = value_type((child.text or '').strip())
+        if not name:
+            raise UnsupportedCityGML('Generic attribute without a name')
+        _set_attribute(attributes, name, value)
+
+
+def _set_attribute(attributes: dict, name: str, value: Any):
+    # Repeated properties (e.g., several bldg:function) are left to citygml-tools
+    if name in attributes:
+        raise UnsupportedCityGML(f"Repeated attribute {name}")
+    attributes[name] = value
+
+
+def convert(input_path: str | Path, output_path: str | Path):
+    try:
+        _convert(input_path, output_path)
+    except (UnsupportedCityGML, MemoryError):
+        raise
+    except Exception as e:
+        # Malformed values (e.g., an empty bldg:storeysAboveGround), XML errors, etc. are left to citygml-tools
+        raise UnsupportedCityGML(f"{e.__class__.__name__}: {e}") from e
+
+
+def _convert(input_path: str | Path, output_path: str | Path):
+    # Streams city objects to the output file as soon as they are parsed; only the
+    # vertex index is kept in memory
+    builder = CityJSONBuilder()
+    root = None
+    depth = 0
+    first = True
+    with open(output_path, 'wb') as out:
+        out.write(b'{"type":"CityJSON","version":"2.0","CityObjects":{')
+        for event, elem in ElementTree.iterparse(str(input_path), events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                    if _split_tag(elem) != ('core', 'CityModel'):
+                        raise UnsupportedCityGML(f"Unsupported root element {elem.tag}")
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth != 1:
+                continue
+
+            module, name = _split_tag(elem)
+            if module == 'gml' and name == 'boundedBy':
+                envelope = elem.find('*')
+                if envelope is not None:
+                    builder.reference_system = _epsg_uri(envelope.get('srsName'))
+                    lower = envelope.find('*')
+                    if lower is not None and lower.text and builder.translate is None:
+                        coords = [float(c) for c in lower.text.split()]
+                        if len(coords) == 3:
+                            builder.translate = tuple(math.floor(c) for c in coords)
+            elif module == 'core' and name == 'cityObjectMember':
+                for city_object_elem in elem:
+                    for object_id, city_object in ObjectConverter(builder).convert(city_object_elem):
+                        out.write((b'' if first else b',') + orjson.dumps(object_id) + b':'
+                                  + orjson.dumps(city_object))
+                        first = False
+            elif not (module == 'gml' and name in IGNORED_PROPERTIES | {'name'}):
+                raise UnsupportedCityGML(f"Unsupported CityModel member {elem.tag}")
+            root.clear()
+
+        out.write(b'},"vertices":')
+        out.write(orjson.dumps(list(builder.vertices)))
+        out.write(b',"transform":')
+        out.write(orjson.dumps({
+            'scale': [VERTEX_SCALE] * 3,
+            'translate': list(builder.translate or (0, 0, 0)),
+        }))
+        metadata = {}
+        if builder.reference_system:
+            metadata['referenceSystem'] = builder.reference_system
+        if builder.vertices:
+            metadata['geographicalExtent'] = builder.extent()
+        out.write(b',"metadata":')
+        out.write(orjson.dumps(metadata))
+        out.write(b'}')
+
+
+def convert_with_citygml_tools(input_path: Path) -> Path:
+    subprocess_result = limits.run(
+        'citygml-tools',
+        [
+            settings.citygml_tools,
+            'to-cityjson',
+            str(input_path),
+        ],
+        jvm=True,
+        capture_output=True,
+        text=True,
+    )
+    if subprocess_result.returncode:
+        errors = subprocess_result.stderr
+        errors += '\n'.join(line
+                            for line in subprocess_result.stdout.splitlines()
+                            if 'ERROR]' in line)
+        raise Exception(errors)
+    return input_path.with_suffix('.json')
+
+
+def _normalized_geometry(doc: dict, geometry: dict) -> tuple:
+    # Geometry as comparable values: real coordinates (rounded to mm) and rings rotated to start at their
+    # lowest vertex, as vertex order and deduplication may differ between converters
+    scale = doc.get('transform', {}).get('scale', [1, 1, 1])
+    translate = doc.get('transform', {}).get('translate', [0, 0, 0])
+    vertices = doc.get('vertices') or []
+
+    def coords(i):
+        return tuple(round(vertices[i][k] * scale[k] + translate[k], 3) for k in range(3))
+
+    def normalize(b):
+        if isinstance(b, list) and b and isinstance(b[0], int):
+            ring = [coords(i) for i in b]
+            start = ring.index(min(ring))
+            return tuple(ring[start:] + ring[:start])
+        return tuple(normalize(x) for x in b)
+
+    semantics = geometry.get('semantics') or {}
+    surface_types = [s.get('type') for s in semantics.get('surfaces') or ()]
+
+    def semantic_types(v):
+        if isinstance(v, list):
+            return tuple(semantic_types(x) for x in v)
+        return surface_types[v] if v is not None else None
+
+    return (geometry.get('type'), str(geometry.get('lod')), normalize(geometry.get('boundaries') or []),
+            semantic_types(semantics.get('values') or []))
+
+
+def compare(native: dict, reference: dict) -> list[str]:
+    differences = []
+    native_objects = native.get('CityObjects') or {}
+    reference_objects = reference.get('CityObjects') or {}
+    for object_id in sorted(native_objects.keys() ^ reference_objects.keys()):
+        differences.append(f"{object_id}: only in {'native' if object_id in native_objects else 'reference'} output")
+    for object_id in sorted(native_objects.keys() & reference_objects.keys()):
+        a, b = native_objects[object_id], reference_objects[object_id]
+        for key in ('type', 'attributes', 'parents', 'children'):
+            if a.get(key) != b.get(key):
+                differences.append(f"{object_id}: {key} differs: {a.get(key)!r} != {b.get(key)!r}")
+        geometries_a = sorted(_normalized_geometry(native, g) for g in a.get('geometry') or ())
+        geometries_b = sorted(_normalized_geometry(reference, g) for g in b.get('geometry') or ())
+        if geometries_a != geometries_b:
+            differences.append(f"{object_id}: geometry differs")
+    return differences
+
+
+def _main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert CityGML to CityJSON, optionally comparing the output '
+                                                 'with that of citygml-tools')
+    parser.add_argument('input', nargs='+', help='CityGML input files')
+    parser.add_argument('--compare', action='store_true', help='Compare with citygml-tools output')
+    args = parser.parse_args()
+
+    failed = False
+    for input_fn in args.input:
+        input_path = Path(input_fn)
+        if not args.compare:
+            convert(input_path, input_path.with_suffix('.json'))
+            continue
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_input = Path(tmp_dir, input_path.name)
+            tmp_input.write_bytes(input_path.read_bytes())
+            native_path = Path(tmp_dir, 'native.json')
+            try:
+                convert(tmp_input, native_path)
+            except UnsupportedCityGML as e:
+                print(f"{input_fn}: not supported by the native converter ({e})")
+                continue
+            reference_path = convert_with_citygml_tools(tmp_input)
+            differences = compare(orjson.loads(native_path.read_bytes()), orjson.loads(reference_path.read_bytes()))
+        for difference in differences:
+            print(f"{input_fn}: {difference}")
+        if not differences:
+            print(f"{input_fn}: OK")
+        failed = failed or bool(differences)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,24 @@
+from pathlib import Path
+from urllib.parse import quote
+
+import orjson
+
+
+def file_base_iri(file_idx: int) -> str:
+    return f"urn:city-validator:input-files/{file_idx}/"
+
+
+def city_object_iri(file_idx: int, object_id: str) -> str:
+    # Same as the "#city-objects-\(.key | @uri)" fragments generated by data/cityjson-uplift.yml
+    return f"{file_base_iri(file_idx)}#city-objects-{quote(object_id, safe='')}"
+
+
+def load(path: str | Path) -> dict:
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def city_object_types(path: str | Path, file_idx: int) -> dict[str, str]:
+    city_objects = load(path).get('CityObjects') or {}
+    return {city_object_iri(file_idx, object_id): city_object.get('type')
+            for object_id, city_object in city_objects.items()}
@@ -0,0 +1,134 @@
+from collections import deque
+from pathlib import Path
+from typing import Any, Iterable, Mapping, TYPE_CHECKING
+
+import numpy as np
+
+from app import cityjson
+
+if TYPE_CHECKING:
+    from app.profiles import Profile, CompletenessCheck
+
+
+def _flatten(attributes: dict[str, Any]) -> dict[str, Any]:
+    # Attribute names can use dots to reach into nested objects (e.g., "address.street"), unless an attribute
+    # has that name
+    flat = dict(attributes)
+    pending = [(name + '.', value) for name, value in attributes.items() if isinstance(value, dict)]
+    while pending:
+        prefix, values = pending.pop()
+        for name, value in values.items():
+            flat.setdefault(prefix + name, value)
+            if isinstance(value, dict):
+                pending.append((prefix + name + '.', value))
+    return flat
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class AttributeColumn:
+
+    def __init__(self, size: int, rows: list[int], numbers: list[float]):
+        # rows: objects with a (non-null) value, numbers: their value, or NaN if it is not a number
+        rows = np.asarray(rows, dtype=np.intp)
+        self.present = np.zeros(size, dtype=bool)
+        self.present[rows] = True
+        self.numbers = np.full(size, np.nan)
+        self.numbers[rows] = numbers
+
+    def __len__(self):
+        return len(self.present)
+
+
+class AttributeTable:
+    # Attributes of the city objects, grouped by city object type, stored by column (one per attribute and
+    # type) as the documents are added, so that metrics are computed on arrays instead of per object
+
+    def __init__(self):
+        # Number of objects of each type
+        self.sizes: dict[str, int] = {}
+        # Rows (within their type) of the objects with a value for an attribute, and their numeric values
+        self._values: dict[tuple[str, str], tuple[list[int], list[float]]] = {}
+        self._columns: dict[tuple[str, str], AttributeColumn] = {}
+
+    def add(self, doc: dict[str, Any]):
+        for city_object in (doc.get('CityObjects') or {}).values():
+            object_type = city_object.get('type') or ''
+            row = self.sizes.get(object_type, 0)
+            self.sizes[object_type] = row + 1
+            for attribute, value in _flatten(city_object.get('attributes') or {}).items():
+                if value is None:
+                    continue
+                rows, numbers = self._values.setdefault((object_type, attribute), ([], []))
+                rows.append(row)
+                numbers.append(value if _is_number(value) else np.nan)
+        self._columns.clear()
+
+    def column(self, object_type: str, attribute: str) -> AttributeColumn:
+        column = self._columns.get((object_type, attribute))
+        if column is None:
+            rows, numbers = self._values.get((object_type, attribute), ([], []))
+            column = self._columns[(object_type, attribute)] = AttributeColumn(self.sizes.get(object_type, 0),
+                                                                               rows, numbers)
+        return column
+
+    @classmethod
+    def load(cls, paths: Iterable[Path]) -> 'AttributeTable':
+        table = cls()
+        for path in paths:
+            table.add(cityjson.load(path))
+        return table
+
+
+def evaluate(check: 'CompletenessCheck', table: AttributeTable) -> dict[str, Any]:
+    column = table.column(check.cityObjectType, check.attribute)
+    total = len(column)
+    present = int(np.count_nonzero(column.present))
+    numbers = column.numbers[~np.isnan(column.numbers)]
+    result = {
+        'cityObjectType': check.cityObjectType,
+        'attribute': check.attribute,
+        'objectCount': total,
+        'presentCount': present,
+        'nullCount': total - present,
+        'completeness': present / total if total else None,
+        'numericCount': len(numbers),
+    }
+    if len(numbers):
+        result['min'] = float(numbers.min())
+        result['max'] = float(numbers.max())
+        result['mean'] = float(numbers.mean())
+    conforms = True
+    if check.minCompleteness is not None:
+        result['minCompleteness'] = check.minCompleteness
+        conforms = not total or present / total >= check.minCompleteness
+    if check.minValue is not None or check.maxValue is not None:
+        in_range = np.ones(len(numbers), dtype=bool)
+        if check.minValue is not None:
+            result['minValue'] = check.minValue
+            in_range &= numbers >= check.minValue
+        if check.maxValue is not None:
+            result['maxValue'] = check.maxValue
+            in_range &= numbers <= check.maxValue
+        # Values that are present but not numbers cannot be in range either
+        result['outOfRangeCount'] = int(np.count_nonzero(~in_range)) + present - len(numbers)
+        conforms = conforms and not result['outOfRangeCount']
+    result['conforms'] = conforms
+    return result
+
+
+def profile_checks(profile: 'Profile', profiles_by_uri: Mapping[str, 'Profile']) -> list['CompletenessCheck']:
+    # Checks of a profile and of those it is a profile of
+    checks = []
+    seen = set()
+    pending = deque([profile])
+    while pending:
+        profile = pending.popleft()
+        if profile.uri in seen:
+            continue
+        seen.add(profile.uri)
+        checks.extend(check for check in profile.completeness if check not in checks)
+        pending.extend(profiles_by_uri[uri] for uri in profile.profileOf if uri in profiles_by_uri)
+    return checks
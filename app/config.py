@@ -6,7 +6,43 @@ class Settings(BaseSettings):
     python3: str = 'python3'
     val3dity: str = '/opt/val3dity/val3dity'
     citygml_tools: str = '/opt/citygml-tools/citygml-tools'
+    native_citygml: bool = True
+    native_uplift: bool = True
     temp_dir: str = './tmp'
+    catalogue_snapshot: bool = True
+    job_retention_bytes: int = 5 * 1024 ** 3
+    job_ttl: int = 24 * 60 * 60
+    dataset_retention_bytes: int = 5 * 1024 ** 3
+    dataset_ttl: int = 24 * 60 * 60
+    shard_min_bytes: int = 512 * 1024 ** 2
+    shard_tiles: int = 4
+    rdf_store: str = 'memory'
+    max_job_bytes: int = 0
+    max_job_city_objects: int = 0
+    max_job_vertices: int = 0
+    admission_budget_bytes: int = 0
+    admission_budget_city_objects: int = 0
+    admission_budget_vertices: int = 0
+    admission_max_queued: int = 0
+    subprocess_memory_limit: int = 0
+    subprocess_cpu_limit: int = 0
+    subprocess_open_files_limit: int = 0
+    job_queue: str = ''
+    job_queue_token: str = ''
+    job_lease_time: int = 60
+    job_heartbeat_interval: int = 15
+    job_max_attempts: int = 3
+    job_queue_poll_interval: float = 1.0
+    webhook_outbox_size: int = 1000
+    webhook_max_attempts: int = 5
+    webhook_retry_delay: float = 1.0
+    webhook_timeout: float = 10.0
+    webhook_workers: int = 4
+    webhook_idle_timeout: float = 60.0
+    fail_fast: bool = False
+    shacl_processes: int = 1
+    shacl_max_results: int = 0
+    shacl_aggregate_results: bool = False
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8')
 
@@ -0,0 +1,374 @@
+import dataclasses
+import datetime
+import logging
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+from app import model, util, cityjson, citygml, delta, limits, profiling, tiling, uplift, val3dity
+from app.admission import JobCost, estimate
+from app.config import settings
+from app.janitor import janitor
+
+logger = logging.getLogger('uvicorn.error')
+
+
+@dataclasses.dataclass(slots=True)
+class FileResult:
+    index: int
+    path: Path
+    is_cityjson: True
+    name: str
+    val3dity_report_path: Path | None = None
+    val3dity_validity: bool = True
+    features_overview: list[dict[str, Any]] | None = None
+    uplift_path: Path | None = None
+    delta: dict[str, Any] | None = None
+
+    @property
+    def valid(self) -> bool | None:
+        # None if val3dity was not run on the file
+        return self.val3dity_validity if self.val3dity_report_path else None
+
+
+class Dataset:
+
+    def __init__(self, dataset_id: str, city_files: list[model.InputFile], wd: Path | None = None,
+                 base: 'Dataset | None' = None, cost: JobCost | None = None):
+        self.created = datetime.datetime.now(datetime.timezone.utc)
+        self.started = None
+        self.finished = None
+        self.last_used = self.created
+
+        self.dataset_id = dataset_id
+        self.status = model.StatusCode.accepted
+        self.errors = []
+        self.ready = threading.Event()
+        self.base = base
+        # Jobs that use the dataset and have not finished yet; the dataset is not evicted while there are any
+        self.pins = 0
+        self._pins_lock = threading.Lock()
+        self.cost = cost or estimate(city_files)
+
+        # Datasets prepared as part of a job share the job's workdir
+        self.wd = wd or Path(settings.temp_dir, 'datasets', dataset_id[0:2], dataset_id)
+        self.wd.mkdir(exist_ok=wd is not None, parents=True)
+        self.data_file = self.wd / 'city-data.ttl'
+
+        self.val3dity_result = True
+        self.city_files: list[FileResult] = []
+        self.size = 0
+
+        for i, city_file in enumerate(city_files):
+            output_fn = self.wd / f"input_city.{i}.json"
+            is_cityjson = True
+            if util.is_xml(city_file.data_str):
+                # Convert to CityJSON
+                output_fn = output_fn.with_suffix('.gml')
+                is_cityjson = False
+
+            city_file.write_to(output_fn)
+            self.size += len(city_file.data_str)
+            self.city_files.append(FileResult(
+                index=i,
+                path=output_fn,
+                name=city_file.name,
+                is_cityjson=is_cityjson,
+            ))
+
+    def convert(self):
+        # 1. Convert to CityJSON
+        for city_file in self.city_files:
+            if not city_file.is_cityjson:
+                with profiling.stage('convert', file=city_file.index):
+                    self._convert_to_cityjson(city_file)
+
+    def prepare(self, geometry: bool = True, rdf: bool = True, fail_fast: bool = False):
+        # geometry: run val3dity, rdf: uplift into data_file. Jobs only run the stages their profiles need.
+        # With fail_fast, every file is validated before any is uplifted, and nothing is uplifted if any
+        # of them is not valid
+        self.convert()
+
+        # 2. Run val3dity and uplift, only for new or changed objects if there is a base dataset
+        if self.base:
+            self.base.ready.wait()
+            self.base.last_used = datetime.datetime.now(datetime.timezone.utc)
+        if fail_fast and geometry and rdf:
+            self._prepare_files(geometry=True, rdf=False)
+            geometry, rdf = False, self.val3dity_result
+        self._prepare_files(geometry, rdf)
+        self.base = None
+
+        # 3. Concatenate TTL files
+        if rdf:
+            util.concat_files([city_file.uplift_path for city_file in self.city_files], self.data_file)
+
+    def _prepare_files(self, geometry: bool, rdf: bool):
+        if not (geometry or rdf):
+            return
+        for city_file in self.city_files:
+            base_file = self._base_file(city_file, geometry, rdf)
+            if base_file:
+                with profiling.stage('delta', file=city_file.index):
+                    self._prepare_delta(city_file, base_file, geometry, rdf)
+            elif settings.shard_tiles > 1 and city_file.path.stat().st_size >= settings.shard_min_bytes:
+                with profiling.stage('sharded', file=city_file.index):
+                    self._prepare_sharded(city_file, geometry, rdf)
+            else:
+                path = city_file.path
+                if geometry:
+                    report_fn = path.with_name(path.stem + '-val3dity.json')
+                    with profiling.stage('val3dity', file=city_file.index):
+                        self._set_val3dity_report(city_file, report_fn, self._run_val3dity(path, report_fn))
+                if rdf:
+                    with profiling.stage('uplift', file=city_file.index):
+                        city_file.uplift_path = self._uplift(path, city_file.index)
+            self.val3dity_result = self.val3dity_result and city_file.val3dity_validity
+
+    def pin(self):
+        with self._pins_lock:
+            self.pins += 1
+            self.last_used = datetime.datetime.now(datetime.timezone.utc)
+
+    def unpin(self):
+        with self._pins_lock:
+            self.pins -= 1
+            self.last_used = datetime.datetime.now(datetime.timezone.utc)
+
+    def prepare_sync(self):
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.status = model.StatusCode.running
+        try:
+            self.prepare()
+            self.status = model.StatusCode.successful
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.errors.append(e)
+            self.status = model.StatusCode.failed
+        finally:
+            self.finished = datetime.datetime.now(datetime.timezone.utc)
+            self.ready.set()
+
+    @staticmethod
+    def _convert_to_cityjson(city_file: FileResult):
+        output_fn = city_file.path.with_suffix('.json')
+        try:
+            if not settings.native_citygml:
+                raise citygml.UnsupportedCityGML('Native CityGML conversion is disabled')
+            citygml.convert(city_file.path, output_fn)
+        except citygml.UnsupportedCityGML as e:
+            logger.info(f"Converting input file {city_file.index} with citygml-tools: {e}")
+            try:
+                citygml.convert_with_citygml_tools(city_file.path)
+            except Exception as e:
+                raise Exception(f"Error converting input file {city_file.index} to CityJSON: {e}")
+        city_file.path.unlink()
+        city_file.path = output_fn
+        city_file.is_cityjson = True
+
+    def _base_file(self, city_file: FileResult, geometry: bool = True, rdf: bool = True) -> FileResult | None:
+        if not self.base or self.base.status != model.StatusCode.successful:
+            return None
+        if city_file.index >= len(self.base.city_files):
+            return None
+        base_file = self.base.city_files[city_file.index]
+        if not base_file.path.is_file():
+            return None
+        if geometry and not (base_file.val3dity_report_path and base_file.val3dity_report_path.is_file()):
+            return None
+        if rdf and not (base_file.uplift_path and base_file.uplift_path.is_file()):
+            return None
+        return base_file
+
+    def _prepare_delta(self, city_file: FileResult, base_file: FileResult, geometry: bool = True, rdf: bool = True):
+        path = city_file.path
+        doc = cityjson.load(path)
+        base_doc = cityjson.load(base_file.path)
+        hashes = delta.object_hashes(doc)
+        base_hashes = delta.object_hashes(base_doc)
+        rechecked = [object_id for object_id, h in hashes.items() if base_hashes.get(object_id) != h]
+        reused = [object_id for object_id, h in hashes.items() if base_hashes.get(object_id) == h]
+
+        # Only the changed objects and the vertices they reference are checked again, the vertices of the
+        # unchanged objects are copied from the base dataset along with their triples
+        delta_tile = tiling.objects_tile(doc, rechecked)
+        delta_path = path.with_name(path.stem + '-delta.json')
+
+        # 1. val3dity for changed objects, merged with the base report for the rest
+        if geometry:
+            with open(delta_path, 'wb') as f:
+                f.write(orjson.dumps(delta_tile.to_cityjson(doc)))
+            delta_report = self._run_val3dity(delta_path, delta_path.with_name(delta_path.stem + '-val3dity.json'))
+            with open(base_file.val3dity_report_path, 'rb') as f:
+                base_report = orjson.loads(f.read())
+            reused_ids = set(reused)
+            report = val3dity.merge_reports(
+                [delta_report],
+                features=(f for f in base_report.get('features') or () if f.get('id') in reused_ids),
+                object_order={object_id: i for i, object_id in enumerate(hashes)})
+            report_fn = path.with_name(path.stem + '-val3dity.json')
+            with open(report_fn, 'wb') as f:
+                f.write(orjson.dumps(report))
+            self._set_val3dity_report(city_file, report_fn, report)
+
+        # 2. Uplift changed objects and the rest of the document (without the objects and their vertices), and
+        # copy the triples for the unchanged objects from the base dataset
+        if rdf:
+            rdf_path = path.with_name(path.stem + '-delta-rdf.json')
+            with open(rdf_path, 'wb') as f:
+                f.write(orjson.dumps(delta_tile.to_cityjson(doc, tiling.UPLIFT_TILE_MEMBERS)))
+            delta_ttl = self._uplift(rdf_path, city_file.index, delta_tile.vertices)
+            skeleton = tiling.skeleton(doc, [delta_tile, tiling.objects_tile(doc, reused)])
+            skeleton_path = path.with_name(path.stem + '-delta-skeleton.json')
+            with open(skeleton_path, 'wb') as f:
+                f.write(orjson.dumps(skeleton.to_cityjson(doc)))
+            skeleton_ttl = self._uplift(skeleton_path, city_file.index, skeleton.vertices)
+            reused_ttl = path.with_name(path.stem + '-reused.ttl')
+            delta.reuse_triples(base_file.uplift_path, base_doc, doc, city_file.index, reused).serialize(reused_ttl)
+            city_file.uplift_path = path.with_name(path.stem + '-uplift.ttl')
+            util.concat_files([delta_ttl, skeleton_ttl, reused_ttl], city_file.uplift_path)
+
+        city_file.delta = {
+            'baseDataset': self.base.dataset_id,
+            'recheckedObjects': rechecked,
+            'removedObjects': [object_id for object_id in base_hashes if object_id not in hashes],
+            'reusedObjects': len(reused),
+        }
+
+    def _prepare_sharded(self, city_file: FileResult, geometry: bool = True, rdf: bool = True):
+        # Large files are split into spatial tiles that are validated and uplifted in parallel
+        path = city_file.path
+        doc = cityjson.load(path)
+        tiles, skeleton = tiling.split(doc, settings.shard_tiles)
+
+        def process_tile(tile_path: Path, tile: tiling.Tile) -> tuple[dict[str, Any] | None, Path | None]:
+            report = ttl_file = None
+            if geometry:
+                with open(tile_path, 'wb') as f:
+                    f.write(orjson.dumps(tile.to_cityjson(doc)))
+                report = self._run_val3dity(tile_path, tile_path.with_name(tile_path.stem + '-val3dity.json'))
+            if rdf:
+                rdf_path = tile_path.with_name(tile_path.stem + '-rdf.json')
+                with open(rdf_path, 'wb') as f:
+                    f.write(orjson.dumps(tile.to_cityjson(doc, tiling.UPLIFT_TILE_MEMBERS)))
+                ttl_file = self._uplift(rdf_path, city_file.index, tile.vertices)
+            return report, ttl_file
+
+        def process_skeleton(skeleton_path: Path) -> Path:
+            with open(skeleton_path, 'wb') as f:
+                f.write(orjson.dumps(skeleton.to_cityjson(doc)))
+            return self._uplift(skeleton_path, city_file.index, skeleton.vertices)
+
+        with ThreadPoolExecutor(max_workers=settings.shard_tiles) as executor:
+            skeleton_future = None
+            if rdf:
+                skeleton_future = executor.submit(process_skeleton, path.with_name(path.stem + '-skeleton.json'))
+            tile_futures = [executor.submit(process_tile, path.with_name(f"{path.stem}-tile-{t}.json"), tile)
+                            for t, tile in enumerate(tiles)]
+            tile_results = [future.result() for future in tile_futures]
+            if skeleton_future:
+                ttl_files = [skeleton_future.result()] + [ttl_file for _, ttl_file in tile_results]
+
+        if geometry:
+            report = val3dity.merge_reports([report for report, _ in tile_results],
+                                            object_order={object_id: i
+                                                          for i, object_id in enumerate(doc['CityObjects'])})
+            if 'input_file' in report:
+                report['input_file'] = str(path)
+            report_fn = path.with_name(path.stem + '-val3dity.json')
+            with open(report_fn, 'wb') as f:
+                f.write(orjson.dumps(report))
+            self._set_val3dity_report(city_file, report_fn, report)
+
+        if rdf:
+            city_file.uplift_path = path.with_name(path.stem + '-uplift.ttl')
+            util.concat_files(ttl_files, city_file.uplift_path)
+
+        for tile_file in [*path.parent.glob(f"{path.stem}-tile-*"), *path.parent.glob(f"{path.stem}-skeleton*")]:
+            tile_file.unlink()
+
+    @staticmethod
+    def _set_val3dity_report(city_file: FileResult, report_fn: Path, val3dity_report: dict[str, Any]):
+        city_file.val3dity_report_path = report_fn
+        city_file.val3dity_validity = val3dity_report.get('validity', True)
+        city_file.features_overview = val3dity_report.get('features_overview')
+
+    @staticmethod
+    def _run_val3dity(path: Path, report_fn: Path) -> dict[str, Any]:
+        limits.run(
+            'val3dity',
+            [
+                settings.val3dity,
+                '--report',
+                str(report_fn),
+                str(path),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        ).check_returncode()
+        with open(report_fn, 'rb') as f:
+            return orjson.loads(f.read())
+
+    @staticmethod
+    def _uplift(path: Path, file_idx: int, vertex_map: list[int] | None = None) -> Path:
+        # vertex_map: index in the full document of each vertex of a tile (see _prepare_sharded())
+        ttl_file = path.with_name(path.stem + '-uplift.ttl')
+        try:
+            if not settings.native_uplift:
+                raise uplift.UnsupportedCityJSON('Native uplift is disabled')
+            uplift.convert(path, ttl_file, file_idx, vertex_map)
+        except uplift.UnsupportedCityJSON as e:
+            logger.info(f"Uplifting input file {file_idx} with ogc-na: {e}")
+            uplift.uplift_with_ogc_na(path, ttl_file, file_idx)
+            if vertex_map is not None:
+                tiling.remap_uplift(ttl_file, vertex_map, file_idx, ttl_file)
+        return ttl_file
+
+
+class DatasetStore:
+
+    def __init__(self):
+        self.datasets: dict[str, Dataset] = {}
+        self._lock = threading.Lock()
+        janitor.add_sweep(self.evict)
+
+    def create_dataset(self, city_files: list[model.InputFile], base: Dataset | None = None,
+                       cost: JobCost | None = None) -> Dataset:
+        dataset_id = str(uuid.uuid4())
+        dataset = Dataset(dataset_id, city_files, base=base, cost=cost)
+        with self._lock:
+            self.datasets[dataset_id] = dataset
+
+        self.evict()
+
+        return dataset
+
+    def run_dataset(self, dataset: Dataset):
+        dataset.prepare_sync()
+        dataset.size = util.dir_size(dataset.wd)
+
+    def evict(self):
+        # Datasets expire when they have not been used by any job for dataset_ttl seconds
+        now = datetime.datetime.now(datetime.timezone.utc)
+        ttl = datetime.timedelta(seconds=settings.dataset_ttl)
+        with self._lock:
+            total_size = sum(dataset.size for dataset in self.datasets.values())
+            for dataset_id, dataset in sorted(self.datasets.items(), key=lambda e: e[1].last_used):
+                if not dataset.ready.is_set() or dataset.pins:
+                    continue
+                if total_size > settings.dataset_retention_bytes or now - dataset.last_used > ttl:
+                    del self.datasets[dataset_id]
+                    total_size -= dataset.size
+                    janitor.remove(dataset.wd)
+
+    def get_dataset(self, dataset_id) -> Dataset | None:
+        return self.datasets.get(dataset_id)
+
+
+dataset_store = DatasetStore()
@@ -0,0 +1,95 @@
+import hashlib
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TYPE_CHECKING
+
+import orjson
+
+from app.cityjson import file_base_iri, city_object_iri
+
+if TYPE_CHECKING:
+    from rdflib import Graph
+
+CITY = 'http://example.com/vocab/city/'
+
+
+def _map_boundaries(boundaries, fn):
+    if isinstance(boundaries, list):
+        return [_map_boundaries(b, fn) for b in boundaries]
+    return fn(boundaries)
+
+
+def _iter_boundaries(boundaries) -> Iterator[int]:
+    if isinstance(boundaries, list):
+        for b in boundaries:
+            yield from _iter_boundaries(b)
+    else:
+        yield boundaries
+
+
+def object_vertex_indices(city_object: dict[str, Any]) -> list[int]:
+    return [i for geometry in city_object.get('geometry') or () for i in _iter_boundaries(geometry.get('boundaries'))
+            if isinstance(i, int)]
+
+
+def object_hashes(doc: dict[str, Any]) -> dict[str, str]:
+    # Objects are hashed with their vertex coordinates instead of their vertex indices, so that
+    # changes in other objects (which usually shift the vertices list) do not change the hash
+    vertices = doc.get('vertices') or []
+    transform = orjson.dumps(doc.get('transform'), option=orjson.OPT_SORT_KEYS)
+    hashes = {}
+    for object_id, city_object in (doc.get('CityObjects') or {}).items():
+        resolved = dict(city_object)
+        if city_object.get('geometry'):
+            resolved['geometry'] = [
+                {**geometry, 'boundaries': _map_boundaries(geometry.get('boundaries'),
+                                                           lambda i: vertices[i] if isinstance(i, int) else i)}
+                for geometry in city_object['geometry']
+            ]
+        h = hashlib.sha256(transform)
+        h.update(orjson.dumps(resolved, option=orjson.OPT_SORT_KEYS))
+        hashes[object_id] = h.hexdigest()
+    return hashes
+
+
+def reuse_triples(base_ttl: Path, base_doc: dict[str, Any], doc: dict[str, Any],
+                  file_idx: int, object_ids: Iterable[str]) -> 'Graph':
+    # Copies the uplifted triples of unchanged objects, and of the vertices they reference, from a previous
+    # run, renumbering the vertices to their position in the new document
+    from rdflib import Graph, URIRef, BNode
+    from app.rdfstore import get_backend
+    backend = get_backend()
+    base_graph = backend.load(backend.graph(), base_ttl)
+    base_objects = base_doc.get('CityObjects') or {}
+    objects = doc.get('CityObjects') or {}
+    city = URIRef(f"{file_base_iri(file_idx)}#city")
+    vertex_prefix = f"{file_base_iri(file_idx)}#vertices-"
+    has_vertex = URIRef(f"{CITY}hasVertex")
+
+    reused = Graph()
+    reused_vertices = set()
+    for object_id in object_ids:
+        vertex_map = dict(zip(object_vertex_indices(base_objects[object_id]),
+                              object_vertex_indices(objects[object_id])))
+        for base_idx, idx in vertex_map.items():
+            if idx not in reused_vertices:
+                reused_vertices.add(idx)
+                vertex = URIRef(f"{vertex_prefix}{idx}")
+                reused.add((city, has_vertex, vertex))
+                for _, p, o in base_graph.triples((URIRef(f"{vertex_prefix}{base_idx}"), None, None)):
+                    reused.add((vertex, p, o))
+        node = URIRef(city_object_iri(file_idx, object_id))
+        reused.add((city, URIRef(f"{CITY}hasObject"), node))
+        pending, seen = [node], {node}
+        while pending:
+            s = pending.pop()
+            for _, p, o in base_graph.triples((s, None, None)):
+                if isinstance(o, BNode):
+                    if o not in seen:
+                        seen.add(o)
+                        pending.append(o)
+                elif isinstance(o, URIRef) and o.startswith(vertex_prefix):
+                    idx = o[len(vertex_prefix):]
+                    if idx.isdigit():
+                        o = URIRef(f"{vertex_prefix}{vertex_map.get(int(idx), idx)}")
+                reused.add((s, p, o))
+    return reused
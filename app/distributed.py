@@ -0,0 +1,210 @@
+import dataclasses
+import datetime
+import io
+import logging
+import tarfile
+import threading
+
+import orjson
+
+from app import model, profiling
+from app.config import settings
+from app.datasets import Dataset
+from app.jobs import Job, job_executor
+from app.taskqueue import TaskState, SqliteQueue, TcpQueue, open_queue
+
+logger = logging.getLogger('uvicorn.error')
+
+# Member of the result archives with the job summary; the rest are report files
+RESULT_SUMMARY = 'job.json'
+
+
+def _timestamp(value: datetime.datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+
+def _datetime(value: str | None) -> datetime.datetime | None:
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def job_payload(job: Job) -> bytes:
+    return orjson.dumps({
+        'jobId': job.job_id,
+        'profiles': [profile.get_id() for profile in job.profiles],
+        'parameters': job.parameters or {},
+        'profiling': job.profiling,
+        'failFast': job.fail_fast,
+        'cityFiles': [{'name': city_file.name, 'data_str': city_file.path.read_text()}
+                      for city_file in job.dataset.city_files],
+    })
+
+
+def pack_result(job: Job) -> bytes:
+    # Summary and report files of a job run by a worker, to be unpacked in the job workdir of the coordinator
+    summary = {
+        'status': job.status.value,
+        'started': _timestamp(job.started),
+        'finished': _timestamp(job.finished),
+        'errors': [str(e) for e in job.errors],
+        'warnings': job.warnings,
+        'val3dityResult': job.val3dity_result,
+        'skippedStages': job.skipped_stages,
+        'profiles': {
+            profile_id: {
+                'conforms': report.conforms,
+                'summary': report.summary,
+                'completeness': report.completeness,
+            } for profile_id, report in job.shacl_reports.items()
+        },
+        'cityFiles': [{
+            'index': city_file.index,
+            'val3dityReport': city_file.val3dity_report_path.name if city_file.val3dity_report_path else None,
+            'val3dityValidity': city_file.val3dity_validity,
+            'featuresOverview': city_file.features_overview,
+            'delta': city_file.delta,
+        } for city_file in job.city_files],
+    }
+    paths = [path for report in job.shacl_reports.values()
+             for path in (report.store.header_path, report.store.results_path)]
+    paths.extend(city_file.val3dity_report_path for city_file in job.city_files if city_file.val3dity_report_path)
+    if job.profile_path:
+        paths.extend((job.profile_path, job.profile_path.with_name(profiling.STACKS_FILE)))
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        data = orjson.dumps(summary)
+        info = tarfile.TarInfo(RESULT_SUMMARY)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+        for path in paths:
+            if path.is_file():
+                tar.add(path, arcname=path.name)
+    return buf.getvalue()
+
+
+def apply_result(job: Job, result: bytes):
+    with tarfile.open(fileobj=io.BytesIO(result), mode='r:gz') as tar:
+        summary = orjson.loads(tar.extractfile(RESULT_SUMMARY).read())
+        tar.extractall(job.wd, members=[m for m in tar.getmembers() if m.name != RESULT_SUMMARY], filter='data')
+
+    job.status = model.StatusCode(summary['status'])
+    job.started = _datetime(summary['started']) or job.started
+    job.finished = _datetime(summary['finished'])
+    job.errors.extend(Exception(error) for error in summary['errors'])
+    job.warnings.extend(summary['warnings'])
+    job.val3dity_result = summary['val3dityResult']
+    job.skipped_stages = summary.get('skippedStages', [])
+    if (job.wd / profiling.PROFILE_FILE).is_file():
+        job.profile_path = job.wd / profiling.PROFILE_FILE
+    for profile_id, profile_result in summary['profiles'].items():
+        report = job.shacl_reports.get(profile_id)
+        if report:
+            report.conforms = profile_result['conforms']
+            report.summary = profile_result['summary']
+            report.completeness = profile_result['completeness']
+    file_results = {file_result['index']: file_result for file_result in summary['cityFiles']}
+    for i, city_file in enumerate(job.city_files):
+        file_result = file_results.get(city_file.index)
+        if file_result:
+            job.city_files[i] = dataclasses.replace(
+                city_file,
+                val3dity_report_path=job.wd / file_result['val3dityReport'] if file_result['val3dityReport'] else None,
+                val3dity_validity=file_result['val3dityValidity'],
+                features_overview=file_result['featuresOverview'],
+                delta=file_result['delta'],
+            )
+
+
+class RemoteJobRunner:
+    # Coordinator side of the distributed mode: jobs are put in the job queue to be run by workers
+    # (see app.worker), and their results are collected from the queue into the job workdirs
+
+    def __init__(self):
+        self.queue: SqliteQueue | TcpQueue | None = None
+        self.pending: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def accepts(self, dataset: Dataset | None, base_dataset: Dataset | None) -> bool:
+        # Whether jobs with these inputs are run by workers. Datasets (and base datasets) that are reused are only
+        # available on this node
+        return self.queue is not None and dataset is None and base_dataset is None
+
+    @property
+    def is_full(self) -> bool:
+        # Jobs waiting for a worker count against admission_max_queued, like those waiting to run on this node
+        with self._lock:
+            queued = sum(1 for job in self.pending.values() if job.status == model.StatusCode.accepted)
+        return bool(settings.admission_max_queued) and queued >= settings.admission_max_queued
+
+    def start(self):
+        if not settings.job_queue or self._thread:
+            return
+        self.queue = open_queue(settings.job_queue, settings.job_queue_token)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='remote-jobs', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self.queue:
+            self.queue.close()
+            self.queue = None
+
+    def submit(self, job: Job):
+        try:
+            self.queue.put(job.job_id, job_payload(job), settings.job_max_attempts)
+        except Exception as e:
+            logger.error(f'Error queueing job {job.job_id}: {e}')
+            self._fail(job, e)
+            return
+        with self._lock:
+            self.pending[job.job_id] = job
+
+    def _fail(self, job: Job, error: Exception):
+        job.errors.append(error)
+        job.status = model.StatusCode.failed
+        job.finished = job.finished or datetime.datetime.now(datetime.timezone.utc)
+        job_executor.finish_job(job)
+
+    def _run(self):
+        while not self._stop.wait(settings.job_queue_poll_interval):
+            try:
+                self._poll()
+            except Exception as e:
+                logger.error(f'Error collecting remote job results: {e}')
+
+    def _poll(self):
+        with self._lock:
+            pending = dict(self.pending)
+        if not pending:
+            return
+        statuses = self.queue.states(list(pending))
+        for job_id, job in pending.items():
+            status = statuses.get(job_id)
+            if status and status.state in (TaskState.queued, TaskState.leased):
+                if status.state == TaskState.leased and job.status == model.StatusCode.accepted:
+                    job.status = model.StatusCode.running
+                    job.started = datetime.datetime.now(datetime.timezone.utc)
+                    job_executor.job_updated(job)
+                continue
+
+            with self._lock:
+                del self.pending[job_id]
+            try:
+                if status and status.state == TaskState.done:
+                    apply_result(job, self.queue.result(job_id))
+                else:
+                    raise Exception(status.error if status and status.error else 'Job was lost from the queue')
+            except Exception as e:
+                self._fail(job, e)
+            else:
+                job_executor.finish_job(job)
+            self.queue.delete(job_id)
+
+
+remote_jobs = RemoteJobRunner()
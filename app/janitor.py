@@ -0,0 +1,63 @@
+import logging
+import queue
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger('uvicorn.error')
+
+JANITOR_INTERVAL = 60
+
+
+class Janitor:
+
+    def __init__(self, interval: float = JANITOR_INTERVAL):
+        self._sweeps: list[Callable[[], None]] = []
+        self._interval = interval
+        self._queue: queue.Queue[Path | None] = queue.Queue()
+        self._thread: threading.Thread | None = None
+
+    def add_sweep(self, sweep: Callable[[], None]):
+        self._sweeps.append(sweep)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='janitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def remove(self, path: Path):
+        self._queue.put(path)
+
+    def _run(self):
+        next_sweep = time.monotonic() + self._interval
+        while True:
+            try:
+                path = self._queue.get(timeout=max(0., next_sweep - time.monotonic()))
+                if path is None:
+                    break
+                try:
+                    shutil.rmtree(path, ignore_errors=True)
+                except Exception as e:
+                    logger.error(f'Error removing {path}: {e}')
+            except queue.Empty:
+                pass
+            if time.monotonic() >= next_sweep:
+                # An error in a sweep must not stop the thread, or nothing would be removed anymore
+                for sweep in self._sweeps:
+                    try:
+                        sweep()
+                    except Exception as e:
+                        logger.error(f'Error in janitor sweep {getattr(sweep, "__qualname__", sweep)}: {e}')
+                next_sweep = time.monotonic() + self._interval
+
+
+janitor = Janitor()
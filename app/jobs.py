@@ -1,71 +1,58 @@
+import contextlib
 import dataclasses
 import datetime
-import json
-import re
-import sys
-from collections import deque
+import logging
+import threading
 from pathlib import Path
-from typing import List, Any
+from typing import List, Any, Callable, TYPE_CHECKING
 
-from pyld import jsonld
-from rdflib import Graph, BNode, RDF, Namespace, DCTERMS, Literal
+import orjson
 
-from app import model, util
+from app import model, util, cityjson, completeness, planning, profiling
+from app.admission import JobCost
+from app.datasets import Dataset, FileResult
+from app.janitor import janitor
+from app.limits import ResourceLimitExceeded
+from app.results import ShaclReportStore
+from app.shacl import ShaclReportBuilder, ShapesCache, CompiledShapes
 from app.profiles import Profile, ProfileLoader
 from app.config import settings
 import uuid
-import shutil
-import subprocess
-
-MAX_JOBS = 100
-
-SHACL_RESULT_FRAME = json.loads('''
-{
-    "@context": {
-        "shacl": "http://www.w3.org/ns/shacl#",
-        "@vocab": "http://www.w3.org/ns/shacl#",
-        "result": {
-            "@container": "@set"
-        },
-        "focusNode": {
-            "@type": "@id"
-        },
-        "resultPath": {
-            "@type": "@id",
-            "@container": "@set"
-        },
-        "resultSeverity": {
-            "@type": "@id"
-        }
-    },
-    "@type": "http://www.w3.org/ns/shacl#ValidationReport"
-}
-''')
 
-SD = Namespace('https://w3id.org/okn/o/sd#')
+if TYPE_CHECKING:
+    from rdflib import Graph
+
+logger = logging.getLogger('uvicorn.error')
 
+SD = 'https://w3id.org/okn/o/sd#'
 
-@dataclasses.dataclass
-class FileResult:
-    index: int
-    path: Path
-    is_cityjson: True
-    input_file: model.InputFile
-    val3dity_report: Any = None
+
+@dataclasses.dataclass(slots=True)
+class ProfileReport:
+    profile_id: str
+    store: ShaclReportStore
+    # None if the shapes were not evaluated (see app.planning)
+    conforms: bool | None = True
+    summary: dict[str, Any] | None = None
+    completeness: list[dict[str, Any]] | None = None
 
     @property
-    def valid(self):
-        if not self.val3dity_report:
-            return True
-        return self.val3dity_report.get('validity', True)
+    def completeness_conforms(self) -> bool:
+        return all(check['conforms'] for check in self.completeness or ())
 
 
 class Job:
 
-    def __init__(self, job_id: str, city_files: list[model.InputFile],
-                 profiles: List[Profile],
+    def __init__(self, job_id: str, profiles: List[Profile],
+                 city_files: list[model.InputFile] | None = None,
+                 dataset: Dataset | None = None,
                  parameters: dict[str, str | int | float | bool] = None,
-                 profile_loader: ProfileLoader | None = None):
+                 profile_loader: ProfileLoader | None = None,
+                 base_dataset: Dataset | None = None,
+                 cost: JobCost | None = None,
+                 wd: Path | None = None,
+                 profiling: bool = False,
+                 fail_fast: bool = False):
 
         self.created = datetime.datetime.now(datetime.timezone.utc)
         self.started = None
@@ -75,182 +62,219 @@ class Job:
         self.status = model.StatusCode.accepted
         self.errors = []
         self.warnings = []
-        self.wd = Path(settings.temp_dir, self.job_id[0:2], self.job_id)
+        self.wd = wd or Path(settings.temp_dir, self.job_id[0:2], self.job_id)
         self.wd.mkdir(exist_ok=False, parents=True)
 
         self.profile_loader = profile_loader
 
-        self.val3dity_result = True
-        self.shacl_result = True
-        self.shacl_report = ''
+        # None if val3dity was not run (see app.planning)
+        self.val3dity_result: bool | None = None
+        self.shacl_reports = {
+            profile.get_id(): ProfileReport(profile_id=profile.get_id(),
+                                            store=ShaclReportStore(self.wd / f"shacl-report-{i}"))
+            for i, profile in enumerate(profiles)
+        }
 
         self.profiles = profiles
         self.parameters = parameters
-        self.city_files: list[FileResult] = []
-
-        for i, city_file in enumerate(city_files):
-            output_fn = self.wd / f"input_city.{i}.json"
-            is_cityjson = True
-            if util.is_xml(city_file.data_str):
-                # Convert to CityJSON
-                output_fn = output_fn.with_suffix('.gml')
-                is_cityjson = False
-
-            city_file.write_to(output_fn)
-            self.city_files.append(FileResult(
-                index=i,
-                path=output_fn,
-                input_file=city_file,
-                is_cityjson=is_cityjson,
-            ))
-
-    def clean(self):
-        shutil.rmtree(self.wd)
+        self.profiling = profiling
+        self.profile_path: Path | None = None
+        self.fail_fast = fail_fast
+        self.skipped_stages: list[dict[str, Any]] = []
+        # Called when the job starts running (see JobExecutor.job_updated)
+        self.on_update: Callable[['Job'], None] | None = None
+
+        # Datasets used by the job are kept until it finishes, even while it waits to be run
+        self._pinned = [d for d in (dataset, base_dataset) if d]
+        for pinned in self._pinned:
+            pinned.pin()
+
+        if dataset:
+            # Reuse an already prepared (or being prepared) dataset
+            self.dataset = dataset
+            self.owns_dataset = False
+            dataset.last_used = self.created
+            self.city_files: list[FileResult] = []
+            self.size = 0
+        else:
+            self.dataset = Dataset(job_id, city_files, wd=self.wd, base=base_dataset, cost=cost)
+            self.owns_dataset = True
+            self.city_files = self.dataset.city_files
+            self.size = self.dataset.size
+        self.cost = self.dataset.cost
+
+    @property
+    def process_id(self):
+        return ','.join(p.get_id() for p in self.profiles)
+
+    @property
+    def shacl_result(self):
+        return all(report.conforms is not False for report in self.shacl_reports.values())
+
+    @property
+    def completeness_result(self):
+        return all(report.completeness_conforms for report in self.shacl_reports.values())
+
+    def _use_dataset(self) -> Path:
+        # Link the dataset artifacts into the workdir, so that results outlive the dataset
+        dataset = self.dataset
+        dataset.ready.wait()
+        if dataset.status != model.StatusCode.successful:
+            raise Exception(f"Dataset {dataset.dataset_id} could not be prepared: "
+                            + '; '.join(str(e) for e in dataset.errors))
+        dataset.last_used = datetime.datetime.now(datetime.timezone.utc)
+        for city_file in dataset.city_files:
+            path = util.link_or_copy(city_file.path, self.wd / city_file.path.name)
+            report_path = None
+            if city_file.val3dity_report_path:
+                report_path = util.link_or_copy(city_file.val3dity_report_path,
+                                                self.wd / city_file.val3dity_report_path.name)
+            self.city_files.append(dataclasses.replace(city_file, path=path, val3dity_report_path=report_path))
+        return util.link_or_copy(dataset.data_file, self.wd / dataset.data_file.name)
+
+    def _data_graph(self, data_graphs: dict[str, 'Graph'], shapes: CompiledShapes, shapes_cache: ShapesCache,
+                    data_file: Path) -> 'Graph':
+        # Spatial functions are rdflib custom functions, which other stores do not evaluate
+        from rdflib import BNode, RDF, DCTERMS, Literal, URIRef
+        from app.rdfstore import MemoryBackend, get_backend
+        backend = get_backend(MemoryBackend.name if shapes.uses_spatial else None)
+        data_graph = data_graphs.get(backend.name)
+        if data_graph is None:
+            with profiling.stage('load', store=backend.name):
+                data_graph = data_graphs[backend.name] = backend.load(shapes_cache.data_graph(backend), data_file)
+            for k, v in (self.parameters or {}).items():
+                param_node = BNode()
+                data_graph.add((param_node, RDF.type, URIRef(f'{SD}Parameter')))
+                data_graph.add((param_node, DCTERMS.identifier, Literal(k)))
+                data_graph.add((param_node, URIRef(f'{SD}hasFixedValue'), Literal(v)))
+        return data_graph
+
+    def _validate_profile(self, shapes: CompiledShapes, data_graph: 'Graph', report: ProfileReport):
+        with profiling.stage('shacl', profile=report.profile_id):
+            conforms, report_graph = shapes.validate(data_graph, settings.shacl_processes)
+        report.conforms = conforms
+        with profiling.stage('report', profile=report.profile_id):
+            self._write_report(report_graph, report)
+
+    def _write_report(self, report_graph: 'Graph', report: ProfileReport):
+        focus_node_types = None
+        if settings.shacl_aggregate_results and not report.conforms:
+            focus_node_types = {}
+            for city_file in self.city_files:
+                focus_node_types.update(cityjson.city_object_types(city_file.path, city_file.index))
+        shacl_report = ShaclReportBuilder(orjson.loads(report_graph.serialize(format='json-ld')),
+                                          max_results=settings.shacl_max_results,
+                                          aggregate=settings.shacl_aggregate_results,
+                                          focus_node_types=focus_node_types).build()
+        report.summary = report.store.write(shacl_report)
 
     def execute_sync(self):
+        profiler = profiling.JobProfiler() if self.profiling else None
+        try:
+            with profiling.activate(profiler):
+                self._execute()
+        finally:
+            for pinned in self._pinned:
+                pinned.unpin()
+            self._pinned = []
+        if profiler:
+            self.profile_path = profiler.write(self.wd)
+
+    def _execute(self):
 
         self.started = datetime.datetime.now(datetime.timezone.utc)
 
         self.status = model.StatusCode.running
-
-        loaded_profile_uris = set()
-        pending_profiles = deque(self.profiles)
+        if self.on_update:
+            self.on_update(self)
 
         try:
-            # 1. Fetch SHACL rules
-            shacl_graph = Graph()
-            while pending_profiles:
-                profile = pending_profiles.popleft()
-                if profile.uri in loaded_profile_uris:
-                    continue
-                for resource in profile.resources:
-                    for artifact in resource.artifacts:
-                        public_id = 'urn:check:shacl/doc' if not re.match(r'^https?://', artifact) else artifact
-                        shacl_graph.parse(artifact, publicID=public_id)
-                for profile_of_uri in profile.profileOf:
-                    if profile_of_uri in loaded_profile_uris or profile_of_uri in ('urn:chek:profiles/chek',
-                                                                                   'chekp:chek'):
-                        continue
-                    profile_of = None
-                    if self.profile_loader:
-                        profile_of = self.profile_loader.profiles_by_uri.get(profile_of_uri)
-                    if profile_of:
-                        pending_profiles.append(profile_of)
+            # 1. Fetch SHACL rules, compiled once per version of the profile catalogue
+            shapes_cache = self.profile_loader.shapes_cache if self.profile_loader else ShapesCache('', {})
+            profile_shapes = {}
+            with profiling.stage('shapes'):
+                for profile in self.profiles:
+                    shapes = shapes_cache.get(profile)
+                    for warning in shapes.warnings:
+                        if warning not in self.warnings:
+                            self.warnings.append(warning)
+                    profile_shapes[profile.get_id()] = shapes
+
+            # 2. Plan the stages needed by the profiles
+            profiles_by_uri = self.profile_loader.profiles_by_uri if self.profile_loader else {}
+            plan = planning.plan(self.profiles, profile_shapes, profiles_by_uri, self.fail_fast)
+            self.skipped_stages = plan.skipped
+
+            # 3. Convert to CityJSON, or wait for the reused dataset
+            if self.owns_dataset:
+                self.dataset.convert()
+                data_file = self.dataset.data_file
+            else:
+                with profiling.stage('dataset'):
+                    data_file = self._use_dataset()
+
+            # 4. Completeness metrics (cheap, on a columnar table of the city object attributes) go first
+            if plan.completeness:
+                with profiling.stage('completeness'):
+                    table = completeness.AttributeTable.load(city_file.path
+                                                             for city_file in self.dataset.city_files)
+                    for profile_id, checks in plan.completeness.items():
+                        self.shacl_reports[profile_id].completeness = [completeness.evaluate(check, table)
+                                                                       for check in checks]
+            blocked = plan.fail_fast and not self.completeness_result
+
+            # 5. Run val3dity and uplift, if needed (reused datasets already have them)
+            geometry = plan.geometry and (not blocked or not self.owns_dataset)
+            rdf = plan.uplift and not blocked
+            if self.owns_dataset and (geometry or rdf):
+                with profiling.stage('dataset'):
+                    # With fail_fast, nothing is uplifted if the geometry is not valid
+                    self.dataset.prepare(geometry, rdf, plan.fail_fast)
+            if geometry:
+                self.val3dity_result = self.dataset.val3dity_result
+                blocked = blocked or (plan.fail_fast and not self.val3dity_result)
+            else:
+                self.val3dity_result = None
+                if plan.geometry:
+                    plan.skip(planning.GEOMETRY, planning.FAIL_FAST)
+
+            # 6. Load data and bind variables, once for every RDF store used (see _data_graph())
+            from rdflib import Graph
+            data_graphs: dict[str, 'Graph'] = {}
+
+            # 7. Spatial index, if any of the shapes to evaluate use spatial functions
+            spatial_index = contextlib.nullcontext()
+            if rdf and not blocked and any(profile_shapes[profile_id].uses_spatial for profile_id in plan.shacl):
+                from app import spatial
+                spatial.register_functions()
+                with profiling.stage('spatial-index'):
+                    spatial_index = spatial.activate(spatial.load_or_build(
+                        self.dataset.wd / 'spatial-index.npz',
+                        [(city_file.index, city_file.path) for city_file in self.dataset.city_files]))
+
+            # 8. SHACL, for every profile on the same data graph
+            with spatial_index:
+                for profile_id, report in self.shacl_reports.items():
+                    shapes = profile_shapes[profile_id]
+                    if not shapes.has_shapes:
+                        # Nothing to evaluate, the report is the same for any data
+                        self._validate_profile(shapes, Graph(), report)
+                    elif profile_id in plan.shacl and not blocked:
+                        data_graph = self._data_graph(data_graphs, shapes, shapes_cache, data_file)
+                        self._validate_profile(shapes, data_graph, report)
+                        blocked = plan.fail_fast and not report.conforms
                     else:
-                        self.warnings.append({
-                            'type': 'ProfileNotFound',
-                            'uri': profile_of_uri,
-                            'message': f"Profile {profile_of_uri} not found",
-                        })
-                loaded_profile_uris.add(profile.uri)
-
-            shacl_filename = self.wd / "shacl.ttl"
-            shacl_graph.serialize(shacl_filename)
-
-            # 2. Convert to CityJSON
-            for city_file in self.city_files:
-                if not city_file.is_cityjson:
-                    subprocess_result = subprocess.run(
-                        [
-                            settings.citygml_tools,
-                            'to-cityjson',
-                            str(city_file.path),
-                        ],
-                        capture_output=True,
-                        text=True,
-                    )
-                    if subprocess_result.returncode:
-                        errors = subprocess_result.stderr
-                        errors += '\n'.join(line
-                                            for line in subprocess_result.stdout.splitlines()
-                                            if 'ERROR]' in line)
-                        raise Exception(f"Error converting input file {city_file.index} to CityJSON: {errors}")
-                    city_file.path = city_file.path.with_suffix('.json')
-                    city_file.is_cityjson = True
-
-            # 3. Run validation
-            ttl_files = []
-            for city_file in self.city_files:
-                path = city_file.path
-                # 3.1 val3dity
-                report_fn = path.with_name(path.stem + '-val3dity.json')
-                subprocess.run(
-                    [
-                        settings.val3dity,
-                        '--report',
-                        str(report_fn),
-                        str(path),
-                    ],
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                ).check_returncode()
-                with open(report_fn) as f:
-                    val3dity_report = json.load(f)
-                self.val3dity_result = self.val3dity_result and val3dity_report['validity']
-                city_file.val3dity_report = val3dity_report
-
-                # 3.2 Uplift
-                ttl_file = path.with_name(path.stem + '-uplift.ttl')
-                subprocess_result = subprocess.run(
-                    [
-                        'python3',
-                        '-m',
-                        'ogc.na.ingest_json',
-                        '--transform-arg',
-                        f'file_idx={city_file.index}',
-                        '--no-provenance',
-                        '--ttl',
-                        '--ttl-file',
-                        str(ttl_file),
-                        '--context',
-                        './data/cityjson-uplift.yml',
-                        str(path),
-                    ],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                )
-                if subprocess_result.returncode:
-                    print(subprocess_result.stdout, file=sys.stderr)
-                    raise Exception(f"Error converting input file {city_file.index} to RDF")
-
-                ttl_files.append(ttl_file)
-
-            # 4. Append variables
-            if self.parameters:
-                param_g = Graph()
-                param_g.bind('sd', SD)
-                for k, v in self.parameters.items():
-                    param_node = BNode()
-                    param_g.add((param_node, RDF.type, SD.Parameter))
-                    param_g.add((param_node, DCTERMS.identifier, Literal(k)))
-                    param_g.add((param_node, SD.hasFixedValue, Literal(v)))
-                param_ttl_file = self.wd / 'shacl-params.ttl'
-                param_g.serialize(param_ttl_file)
-                ttl_files.append(param_ttl_file)
-
-            # 5. Concatenate TTL files
-            output_ttl_file = self.wd / 'city.ttl'
-            util.concat_files(ttl_files, output_ttl_file)
-
-            # 5. SHACL
-            shacl_output = output_ttl_file.with_name('city-shacl-result.json')
-            shacl_process = subprocess.run([
-                'pyshacl',
-                '-s',
-                str(shacl_filename),
-                '-f',
-                'json-ld',
-                '-o',
-                str(shacl_output),
-                str(output_ttl_file),
-            ])
-            self.shacl_result = shacl_process.returncode == 0
-            with open(shacl_output) as f:
-                self.shacl_report = jsonld.frame(json.load(f), SHACL_RESULT_FRAME)
+                        if profile_id in plan.shacl:
+                            plan.skip(planning.SHACL, planning.FAIL_FAST, profile_id)
+                        report.conforms = None
+                        report.summary = report.store.write({'conforms': None})
 
             self.status = model.StatusCode.successful
 
+        except MemoryError:
+            self.errors.append(ResourceLimitExceeded('Out of memory while validating the input data'))
+            self.status = model.StatusCode.failed
+
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -262,29 +286,123 @@ class Job:
 
     @property
     def valid(self):
-        return len(self.errors) == 0 and self.shacl_result and self.val3dity_result
+        return (len(self.errors) == 0 and self.shacl_result and self.val3dity_result is not False
+                and self.completeness_result)
+
+
+class JobSummary:
+    # Slim, in-memory record of a finished job; reports and artifacts stay in the workdir
+    __slots__ = ('job_id', 'process_id', 'status', 'created', 'started', 'finished', 'errors', 'warnings',
+                 'val3dity_result', 'shacl_result', 'completeness_result', 'shacl_reports', 'city_files', 'wd',
+                 'size', 'profile_path', 'skipped_stages')
+
+    def __init__(self, job: Job):
+        self.job_id = job.job_id
+        self.process_id = job.process_id
+        self.status = job.status
+        self.created = job.created
+        self.started = job.started
+        self.finished = job.finished
+        self.errors = [str(e) for e in job.errors]
+        self.warnings = job.warnings
+        self.val3dity_result = job.val3dity_result
+        self.shacl_result = job.shacl_result
+        self.completeness_result = job.completeness_result
+        self.skipped_stages = job.skipped_stages
+        self.shacl_reports = job.shacl_reports
+        self.city_files = tuple(job.city_files)
+        self.wd = job.wd
+        self.profile_path = job.profile_path
+        self.size = util.dir_size(job.wd)
+
+    @property
+    def valid(self):
+        return (len(self.errors) == 0 and self.shacl_result and self.val3dity_result is not False
+                and self.completeness_result)
+
+
+def status_info(job: Job | JobSummary) -> model.StatusInfo:
+    return model.StatusInfo(
+        processID=job.process_id,
+        jobID=job.job_id,
+        status=job.status,
+        message='; '.join(str(e) for e in job.errors) or None,
+        type=model.Type.process,
+        created=job.created,
+        started=job.started,
+        finished=job.finished,
+    )
 
 
 class JobExecutor:
 
     def __init__(self):
-        self.jobs: dict[str, Job] = {}
-
-    def create_job(self, city_files: list[model.InputFile],
-                   profiles: List[Profile],
+        self.jobs: dict[str, Job | JobSummary] = {}
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[Job | JobSummary], None]] = []
+        janitor.add_sweep(self.evict)
+
+    def add_listener(self, listener: Callable[[Job | JobSummary], None]):
+        # Listeners are called when jobs start running and when they finish
+        self._listeners.append(listener)
+
+    def job_updated(self, job: Job | JobSummary):
+        for listener in self._listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.error(f'Error notifying update of job {job.job_id}: {e}')
+
+    def create_job(self, profiles: List[Profile],
+                   city_files: list[model.InputFile] | None = None,
+                   dataset: Dataset | None = None,
                    parameters: dict[str, str | int | float | bool] = None,
-                   profile_loader: ProfileLoader | None = None):
+                   profile_loader: ProfileLoader | None = None,
+                   base_dataset: Dataset | None = None,
+                   cost: JobCost | None = None,
+                   profiling: bool = False,
+                   fail_fast: bool = False):
         job_id = str(uuid.uuid4())
-        job = Job(job_id, city_files, profiles=profiles, parameters=parameters, profile_loader=profile_loader)
-        self.jobs[job_id] = job
+        job = Job(job_id, profiles=profiles, city_files=city_files, dataset=dataset,
+                  parameters=parameters, profile_loader=profile_loader, base_dataset=base_dataset, cost=cost,
+                  profiling=profiling, fail_fast=fail_fast)
+        job.on_update = self.job_updated
+        with self._lock:
+            self.jobs[job_id] = job
 
-        # Remove old jobs
-        while len(self.jobs) >= MAX_JOBS:
-            self.jobs.pop(next(iter(self.jobs))).clean()
+        self.evict()
 
         return job
 
-    def get_job(self, job_id) -> Job | None:
+    def run_job(self, job: Job):
+        job.execute_sync()
+        self.finish_job(job)
+
+    def finish_job(self, job: Job):
+        summary = JobSummary(job)
+        with self._lock:
+            if job.job_id in self.jobs:
+                self.jobs[job.job_id] = summary
+            else:
+                janitor.remove(job.wd)
+        self.job_updated(summary)
+
+    def evict(self):
+        # Jobs are kept in creation order; finished jobs are evicted when expired or
+        # when the retained data exceeds the budget, oldest first
+        now = datetime.datetime.now(datetime.timezone.utc)
+        ttl = datetime.timedelta(seconds=settings.job_ttl)
+        with self._lock:
+            total_size = sum(job.size for job in self.jobs.values())
+            for job_id, job in list(self.jobs.items()):
+                if not isinstance(job, JobSummary):
+                    continue
+                if total_size > settings.job_retention_bytes or now - job.finished > ttl:
+                    del self.jobs[job_id]
+                    total_size -= job.size
+                    janitor.remove(job.wd)
+
+    def get_job(self, job_id) -> Job | JobSummary | None:
         return self.jobs.get(job_id)
 
 
@@ -0,0 +1,82 @@
+import os
+import signal
+import subprocess
+from typing import Any
+
+from app.config import settings
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Output of processes that ran out of memory (Python, C++, Java)
+OUT_OF_MEMORY_MARKERS = ('MemoryError', 'bad_alloc', 'Cannot allocate memory', 'OutOfMemoryError',
+                         'Could not reserve enough space')
+
+
+class ResourceLimitExceeded(Exception):
+    pass
+
+
+def _rlimits(jvm: bool) -> list[tuple[int, int]]:
+    # The JVM reserves much more address space than it uses, so the memory limit is applied to its heap
+    # instead (see run())
+    configured = ((resource.RLIMIT_AS, 0 if jvm else settings.subprocess_memory_limit),
+                  (resource.RLIMIT_CPU, settings.subprocess_cpu_limit),
+                  (resource.RLIMIT_NOFILE, settings.subprocess_open_files_limit))
+    return [(limit, value) for limit, value in configured if value]
+
+
+def _limits_enabled() -> bool:
+    # prlimit() is only available on Linux
+    return hasattr(resource, 'prlimit') and bool(settings.subprocess_memory_limit or settings.subprocess_cpu_limit
+                                                  or settings.subprocess_open_files_limit)
+
+
+def run(name: str, args: list[str], jvm: bool = False, **kwargs: Any) -> subprocess.CompletedProcess:
+    # subprocess.run() with the configured memory, CPU time and open files limits. Raises
+    # ResourceLimitExceeded (instead of returning) if the process seems to have been stopped by one of them.
+    # jvm: the process is a Java program, whose maximum heap size is set to the memory limit
+    if not _limits_enabled():
+        return subprocess.run(args, **kwargs)
+
+    if jvm and settings.subprocess_memory_limit:
+        env = dict(kwargs.pop('env', None) or os.environ)
+        env['JAVA_TOOL_OPTIONS'] = ' '.join(filter(None, (
+            env.get('JAVA_TOOL_OPTIONS'), f"-Xmx{settings.subprocess_memory_limit // 1024 ** 2}m")))
+        kwargs['env'] = env
+    if kwargs.pop('capture_output', False):
+        kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+
+    # The limits are set on the running child with prlimit(), since preexec_fn is not safe in a threaded
+    # server (the child could deadlock before exec)
+    with subprocess.Popen(args, **kwargs) as process:
+        try:
+            for limit, value in _rlimits(jvm):
+                resource.prlimit(process.pid, limit, (value, value))
+        except ProcessLookupError:
+            # Already finished
+            pass
+        except BaseException:
+            process.kill()
+            raise
+        try:
+            stdout, stderr = process.communicate()
+        except BaseException:
+            process.kill()
+            raise
+    result = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+    if not result.returncode:
+        return result
+
+    if settings.subprocess_cpu_limit and result.returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+        raise ResourceLimitExceeded(f"{name} exceeded the CPU time limit of {settings.subprocess_cpu_limit} s")
+    if settings.subprocess_memory_limit:
+        output = ''.join(o if isinstance(o, str) else o.decode(errors='replace')
+                         for o in (result.stdout, result.stderr) if o)
+        if result.returncode in (-signal.SIGABRT, -signal.SIGSEGV) \
+                or any(marker in output for marker in OUT_OF_MEMORY_MARKERS):
+            raise ResourceLimitExceeded(f"{name} ran out of memory (limit of "
+                                        f"{settings.subprocess_memory_limit // 1024 ** 2} MiB)")
+    return result
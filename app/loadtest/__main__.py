@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import httpx
+import orjson
+
+from app.loadtest.standins import write_standins
+
+# Same as CHECK_RESULTS_TIME_MS in CheckForm.vue
+DEFAULT_POLL_INTERVAL = 1.0
+ACTIVE_STATUSES = ('accepted', 'running')
+MEMORY_SAMPLE_INTERVAL = 0.1
+
+
+@dataclasses.dataclass(slots=True)
+class JobRecord:
+    status: str
+    latency: float
+    queue_wait: float | None = None
+    run_time: float | None = None
+    polls: int = 0
+
+
+class Stats:
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.jobs: list[JobRecord] = []
+        self.failed_sessions = 0
+
+    async def request(self, name: str, coro) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            response = await coro
+        except httpx.HTTPError:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            raise
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            response.raise_for_status()
+        return response
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def summarize(values: list[float]) -> dict[str, Any]:
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+def _parse_time(value: str | None) -> datetime.datetime | None:
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+
+
+async def session(client: httpx.AsyncClient, stats: Stats, process_id: str, body: bytes, poll_interval: float):
+    # Submits a job and polls its status until it finishes, then fetches the SHACL report (as CheckForm.vue does)
+    start = time.perf_counter()
+    polls = 0
+    try:
+        response = await stats.request('execution', client.post(
+            f'/processes/{process_id}/execution', content=body,
+            headers={'Content-Type': 'application/json', 'Accept': 'application/json'}))
+        status_info = response.json()
+        job_id = status_info['jobID']
+        while status_info['status'] in ACTIVE_STATUSES:
+            await asyncio.sleep(poll_interval)
+            response = await stats.request('status', client.get(f'/jobs/{job_id}',
+                                                                 headers={'Accept': 'application/json'}))
+            status_info = response.json()
+            polls += 1
+        if status_info['status'] == 'successful':
+            response = await stats.request('results', client.get(f'/jobs/{job_id}/results?fields=shaclReport',
+                                                                  headers={'Accept': 'application/json'}))
+            response.read()
+    except (httpx.HTTPError, KeyError, ValueError):
+        stats.failed_sessions += 1
+        return
+
+    created = _parse_time(status_info.get('created'))
+    started = _parse_time(status_info.get('started'))
+    finished = _parse_time(status_info.get('finished'))
+    stats.jobs.append(JobRecord(
+        status=status_info['status'],
+        latency=time.perf_counter() - start,
+        queue_wait=(started - created).total_seconds() if created and started else None,
+        run_time=(finished - started).total_seconds() if started and finished else None,
+        polls=polls,
+    ))
+
+
+async def closed_loop(client, stats, process_id, body, args):
+    # A fixed number of clients, each submitting a new job as soon as the previous one finishes
+    deadline = time.perf_counter() + args.duration
+    remaining = [args.jobs] if args.jobs else None
+
+    async def user():
+        while time.perf_counter() < deadline:
+            if remaining is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            await session(client, stats, process_id, body, args.poll_interval)
+
+    await asyncio.gather(*(user() for _ in range(args.concurrency)))
+
+
+async def open_loop(client, stats, process_id, body, args):
+    # Jobs arrive at a given rate (Poisson arrivals), regardless of how fast they are processed
+    deadline = time.perf_counter() + args.duration
+    rnd = random.Random(args.seed)
+    tasks = []
+    while time.perf_counter() < deadline and (not args.jobs or len(tasks) < args.jobs):
+        tasks.append(asyncio.create_task(session(client, stats, process_id, body, args.poll_interval)))
+        await asyncio.sleep(rnd.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+
+
+def _process_tree(pid: int) -> list[int]:
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        for children in Path(f'/proc/{current}/task').glob('*/children'):
+            try:
+                pending.extend(int(child) for child in children.read_text().split())
+            except OSError:
+                pass
+    return pids
+
+
+def _status_kb(pid: int, field: str) -> int:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+async def sample_memory(pid: int, peak: dict[str, int]):
+    # Resident memory of the server and of its subprocesses (val3dity, uplift, etc.), Linux only
+    while True:
+        tree_rss = sum(_status_kb(p, 'VmRSS') for p in _process_tree(pid))
+        peak['treeRssKb'] = max(peak.get('treeRssKb', 0), tree_rss)
+        peak['serverHwmKb'] = max(peak.get('serverHwmKb', 0), _status_kb(pid, 'VmHWM'))
+        await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+
+def start_server(args, work_dir: Path) -> tuple[subprocess.Popen, str]:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    standins = write_standins(work_dir / 'bin')
+    env = {
+        **os.environ,
+        'VAL3DITY': str(standins['val3dity']),
+        'CITYGML_TOOLS': str(standins['citygml_tools']),
+        'TEMP_DIR': str(work_dir / 'tmp'),
+        'LOADTEST_VAL3DITY_LATENCY': str(args.val3dity_latency),
+        'LOADTEST_VAL3DITY_LATENCY_PER_OBJECT': str(args.val3dity_latency_per_object),
+        'LOADTEST_VAL3DITY_INVALID': str(args.val3dity_invalid),
+        'LOADTEST_VAL3DITY_MEMORY_MB': str(args.val3dity_memory),
+        'LOADTEST_CITYGML_TOOLS_LATENCY': str(args.citygml_tools_latency),
+    }
+    if args.no_native_citygml:
+        env['NATIVE_CITYGML'] = 'false'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', *(['--workers', str(args.workers)] if args.workers > 1 else [])],
+        cwd=Path(__file__).resolve().parents[2],
+        env=env,
+    )
+    return server, f'http://127.0.0.1:{port}'
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen | None, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while True:
+        if server and server.poll() is not None:
+            raise RuntimeError(f'Server exited with code {server.returncode}')
+        try:
+            response = await client.get('/processes', headers={'Accept': 'application/json'})
+            if response.status_code == 200:
+                return response.json()
+        except httpx.HTTPError:
+            pass
+        if time.perf_counter() > deadline:
+            raise RuntimeError('Timed out waiting for the server')
+        await asyncio.sleep(0.1)
+
+
+def build_body(args) -> bytes:
+    city_files = [{'name': Path(fn).name, 'data_str': Path(fn).read_text()} for fn in args.file]
+    inputs: dict[str, Any] = {'cityFiles': city_files}
+    for param in args.param:
+        k, v = param.split('=', 1)
+        inputs[k] = v
+    return orjson.dumps({'inputs': inputs})
+
+
+async def run(args) -> dict[str, Any]:
+    body = build_body(args)
+    server = None
+    with tempfile.TemporaryDirectory(prefix='chek-loadtest-') as tmp_dir:
+        if args.url:
+            base_url = args.url
+        else:
+            server, base_url = start_server(args, Path(tmp_dir))
+        try:
+            limits = httpx.Limits(max_connections=args.max_connections)
+            async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+                processes = await wait_ready(client, server)
+                process_id = args.profile or processes['processes'][0]['id']
+
+                stats = Stats()
+                memory: dict[str, int] = {}
+                sampler = asyncio.create_task(sample_memory(server.pid, memory)) if server else None
+                start = time.perf_counter()
+                if args.mode == 'open':
+                    await open_loop(client, stats, process_id, body, args)
+                else:
+                    await closed_loop(client, stats, process_id, body, args)
+                elapsed = time.perf_counter() - start
+                if sampler:
+                    sampler.cancel()
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    jobs_by_status = {}
+    for job in stats.jobs:
+        jobs_by_status[job.status] = jobs_by_status.get(job.status, 0) + 1
+    return {
+        'mode': args.mode,
+        'process': process_id,
+        'elapsed': elapsed,
+        'jobs': {
+            'completed': len(stats.jobs),
+            'byStatus': jobs_by_status,
+            'failedSessions': stats.failed_sessions,
+            'throughput': len(stats.jobs) / elapsed if elapsed else None,
+            'latency': summarize([j.latency for j in stats.jobs]),
+            'queueWait': summarize([j.queue_wait for j in stats.jobs if j.queue_wait is not None]),
+            'runTime': summarize([j.run_time for j in stats.jobs if j.run_time is not None]),
+            'polls': summarize([j.polls for j in stats.jobs]),
+        },
+        'requests': {
+            name: {
+                **summarize(latencies),
+                'errors': stats.errors.get(name, 0),
+                'throughput': len(latencies) / elapsed if elapsed else None,
+            } for name, latencies in stats.latencies.items()
+        },
+        'memory': memory or None,
+    }
+
+
+def print_report(report: dict[str, Any]):
+    def fmt(v, unit='s'):
+        return '-' if v is None else f'{v * 1000:.1f}ms' if unit == 's' else f'{v:.2f}'
+
+    jobs = report['jobs']
+    print(f"{report['mode']}-loop run of {report['process']} for {report['elapsed']:.1f}s")
+    print(f"jobs: {jobs['completed']} {jobs['byStatus']}, {jobs['failedSessions']} failed sessions, "
+          f"{fmt(jobs['throughput'], '')} jobs/s")
+    print(f"{'':<14}{'count':>8}{'rps':>10}{'err':>6}{'p50':>12}{'p90':>12}{'p99':>12}{'max':>12}")
+    rows = [(name, r) for name, r in report['requests'].items()]
+    rows += [(f'job {k}', {**jobs[k], 'throughput': None, 'errors': None}) for k in ('latency', 'queueWait', 'runTime')]
+    for name, r in rows:
+        print(f"{name:<14}{r['count']:>8}{fmt(r['throughput'], ''):>10}{'' if r['errors'] is None else r['errors']:>6}"
+              f"{fmt(r['p50']):>12}{fmt(r['p90']):>12}{fmt(r['p99']):>12}{fmt(r['max']):>12}")
+    if report['memory']:
+        print(f"memory high-water mark: server {report['memory']['serverHwmKb'] / 1024:.1f} MiB, "
+              f"server and subprocesses {report['memory']['treeRssKb'] / 1024:.1f} MiB")
+
+
+def _main():
+    parser = argparse.ArgumentParser(description='Load test the service API, starting it locally with stand-ins '
+                                                 'for val3dity and citygml-tools')
+    parser.add_argument('file', nargs='+', help='CityJSON or CityGML files submitted with every job')
+    parser.add_argument('--profile', help='Profile (process) id. Defaults to the first one')
+    parser.add_argument('--param', action='append', default=[], help='Profile parameter, as name=value')
+    parser.add_argument('--mode', choices=('closed', 'open'), default='closed',
+                        help='closed: fixed number of concurrent clients; open: fixed job arrival rate')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of clients (closed loop)')
+    parser.add_argument('--rate', type=float, default=1.0, help='Jobs per second (open loop)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds during which new jobs are submitted')
+    parser.add_argument('--jobs', type=int, default=0, help='Maximum number of jobs (0 for no limit)')
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds between job status requests')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for open loop arrivals')
+    parser.add_argument('--timeout', type=float, default=300, help='HTTP request timeout')
+    parser.add_argument('--max-connections', type=int, default=100, help='Maximum concurrent HTTP connections')
+    parser.add_argument('--url', help='Test an already running service instead of starting one')
+    parser.add_argument('--workers', type=int, default=1, help='Number of server worker processes')
+    parser.add_argument('--val3dity-latency', type=float, default=0.5, help='Seconds per val3dity run')
+    parser.add_argument('--val3dity-latency-per-object', type=float, default=0.0,
+                        help='Additional seconds per city object for each val3dity run')
+    parser.add_argument('--val3dity-invalid', type=float, default=0.0,
+                        help='Fraction of city objects reported as invalid by val3dity')
+    parser.add_argument('--val3dity-memory', type=float, default=0.0, help='MiB allocated by each val3dity run')
+    parser.add_argument('--citygml-tools-latency', type=float, default=2.0,
+                        help='Seconds per citygml-tools conversion')
+    parser.add_argument('--no-native-citygml', action='store_true',
+                        help='Convert CityGML with (the stand-in for) citygml-tools')
+    parser.add_argument('--json', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, 'wb') as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+
+
+if __name__ == '__main__':
+    _main()
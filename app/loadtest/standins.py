@@ -0,0 +1,119 @@
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import orjson
+
+# Stand-ins for the val3dity and citygml-tools executables, with the same command line and outputs
+# (as far as the service uses them). Their behaviour is configured with environment variables, which
+# the service passes on to them:
+#   LOADTEST_VAL3DITY_LATENCY: seconds per run (default 0)
+#   LOADTEST_VAL3DITY_LATENCY_PER_OBJECT: additional seconds per city object (default 0)
+#   LOADTEST_VAL3DITY_INVALID: fraction of city objects reported as invalid (default 0)
+#   LOADTEST_VAL3DITY_MEMORY_MB: memory allocated while "validating" (default 0)
+#   LOADTEST_CITYGML_TOOLS_LATENCY: seconds per conversion (default 0)
+
+STANDIN_SCRIPT = '''#!{python}
+import sys
+sys.path.insert(0, {root!r})
+from app.loadtest.standins import {function}
+{function}(sys.argv[1:])
+'''
+
+INVALID_ERRORS = [
+    (203, 'NON_PLANAR_POLYGON_DISTANCE_PLANE'),
+    (302, 'SHELL_NOT_CLOSED'),
+    (104, 'RING_SELF_INTERSECTION'),
+]
+
+
+def _env_float(name: str) -> float:
+    return float(os.environ.get(name) or 0)
+
+
+def _simulate(latency: float, memory_mb: float = 0):
+    ballast = bytearray(int(memory_mb * 1024 * 1024)) if memory_mb else None
+    if ballast:
+        # Touch every page so that the memory is actually resident
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1
+    if latency > 0:
+        time.sleep(latency)
+    del ballast
+
+
+def val3dity(args: list[str]):
+    report_fn = args[args.index('--report') + 1]
+    input_fn = args[-1]
+    with open(input_fn, 'rb') as f:
+        doc = orjson.loads(f.read())
+    city_objects = doc.get('CityObjects') or {}
+
+    _simulate(_env_float('LOADTEST_VAL3DITY_LATENCY')
+              + _env_float('LOADTEST_VAL3DITY_LATENCY_PER_OBJECT') * len(city_objects),
+              _env_float('LOADTEST_VAL3DITY_MEMORY_MB'))
+
+    invalid_ratio = _env_float('LOADTEST_VAL3DITY_INVALID')
+    features = []
+    for object_id, city_object in city_objects.items():
+        # Seeded by the object id, so that the same objects are always (in)valid
+        rnd = random.Random(object_id)
+        errors = []
+        if city_object.get('geometry') and rnd.random() < invalid_ratio:
+            code, description = rnd.choice(INVALID_ERRORS)
+            errors.append({'code': code, 'description': description, 'id': '', 'info': ''})
+        features.append({
+            'id': object_id,
+            'type': city_object.get('type'),
+            'validity': not errors,
+            'errors': errors,
+            'primitives': [],
+        })
+    totals, valid = {}, {}
+    for feature in features:
+        totals[feature['type']] = totals.get(feature['type'], 0) + 1
+        valid[feature['type']] = valid.get(feature['type'], 0) + feature['validity']
+    report = {
+        'type': 'val3dity_report',
+        'val3dity_version': 'stand-in',
+        'input_file': input_fn,
+        'input_file_type': 'CityJSON',
+        'validity': all(f['validity'] for f in features),
+        'all_errors': sorted(set(e['code'] for f in features for e in f['errors'])),
+        'dataset_errors': [],
+        'features_overview': [{'type': t, 'total': n, 'valid': valid[t]} for t, n in totals.items()],
+        'features': features,
+    }
+    with open(report_fn, 'wb') as f:
+        f.write(orjson.dumps(report))
+
+
+def citygml_tools(args: list[str]):
+    from app import citygml
+    if args[0] != 'to-cityjson':
+        print(f"[ERROR] Unsupported command {args[0]}")
+        sys.exit(1)
+    input_path = Path(args[-1])
+    _simulate(_env_float('LOADTEST_CITYGML_TOOLS_LATENCY'))
+    output_path = input_path.with_suffix('.json')
+    try:
+        citygml.convert(input_path, output_path)
+    except citygml.UnsupportedCityGML:
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps({'type': 'CityJSON', 'version': '2.0', 'transform': {
+                'scale': [0.001, 0.001, 0.001], 'translate': [0, 0, 0]}, 'CityObjects': {}, 'vertices': []}))
+
+
+def write_standins(directory: Path) -> dict[str, Path]:
+    # Writes executables for the stand-ins, returning their paths by setting name
+    directory.mkdir(parents=True, exist_ok=True)
+    root = str(Path(__file__).resolve().parents[2])
+    paths = {}
+    for setting, function in (('val3dity', 'val3dity'), ('citygml_tools', 'citygml_tools')):
+        path = directory / function.replace('_', '-')
+        path.write_text(STANDIN_SCRIPT.format(python=sys.executable, root=root, function=function))
+        path.chmod(0o755)
+        paths[setting] = path
+    return paths
@@ -1,21 +1,33 @@
+import functools
 import logging
 from contextlib import asynccontextmanager
-from typing import Annotated, Union
+from pathlib import Path
+from typing import Annotated, Any, Union
 
-from fastapi import FastAPI, Request, HTTPException, Response, BackgroundTasks, Header
+from fastapi import FastAPI, Request, HTTPException, Response, Header, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 
-from app import model, util
+from app import admission, model, profiling, results, util
+from app.admission import admission_controller
 from app.config import settings
-from app.jobs import job_executor
-from app.profiles import ProfileLoader, ProfileList
+from app.datasets import dataset_store, Dataset, FileResult
+from app.distributed import remote_jobs, RemoteJobRunner
+from app.janitor import janitor
+from app.jobs import job_executor, status_info, JobSummary, ProfileReport
+from app.profiles import ProfileLoader, ProfileList, COMMON_INPUTS
+from app.webhooks import dispatcher
 
 MEDIA_TEXT_HTML = 'text/html'
 MEDIA_APPLICATION_JSON = 'application/json'
 MEDIA_ANY = '*/*'
 
+RESULT_EXTRA_FIELDS = {'shaclReport', 'val3dityReport'}
+DEFAULT_RESULTS_LIMIT = 100
+MAX_RESULTS_LIMIT = 10000
+ADMISSION_RETRY_AFTER = 60
+
 app_metadata = {
     'title': 'CHEK data completeness service',
     'description': 'TBD',
@@ -25,8 +37,15 @@ app_metadata = {
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.profile_loader = ProfileLoader(settings.data_source)
+    app.profile_loader = ProfileLoader(settings.data_source,
+                                       Path(settings.temp_dir, 'catalogue') if settings.catalogue_snapshot else None)
+    janitor.start()
+    remote_jobs.start()
+    dispatcher.start()
     yield
+    remote_jobs.stop()
+    dispatcher.stop()
+    janitor.stop()
     app.profile_loader.close()
 
 
@@ -93,18 +112,25 @@ def conformance() -> model.ConfClasses:
     ])
 
 
-@app.get('/processes')
-def list_processes() -> model.ProcessList:
-    return model.ProcessList(
-        processes=[profile.to_process_summary() for profile in app.profile_loader.profiles.values()],
-        links=[],
-    )
+def cached_response(content: util.CachedContent, if_none_match: str | None) -> Response:
+    headers = {
+        'ETag': content.etag,
+        'Cache-Control': 'no-cache',
+    }
+    if util.etag_matches(if_none_match, content.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content.content, media_type=MEDIA_APPLICATION_JSON, headers=headers)
+
 
+@app.get('/processes', response_model=model.ProcessList)
+def list_processes(if_none_match: Annotated[str | None, Header()] = None) -> Response:
+    return cached_response(app.profile_loader.process_list_content, if_none_match)
 
-@app.get('/processes/{process_id}')
-def view_process(process_id: str) -> model.Process:
-    profile = app.profile_loader.profiles.get(process_id)
-    if not profile:
+
+@app.get('/processes/{process_id}', response_model=model.Process)
+def view_process(process_id: str, if_none_match: Annotated[str | None, Header()] = None) -> Response:
+    content = app.profile_loader.process_content.get(process_id)
+    if not content:
         raise HTTPException(
             status_code=404,
             detail=model.Exception(
@@ -113,17 +139,58 @@ def view_process(process_id: str) -> model.Process:
                 title='Process not found',
             ).model_dump(exclude_none=True))
 
-    process_description = profile.to_process_description()
+    return cached_response(content, if_none_match)
+
 
-    return process_description.model_dump(by_alias=True, exclude_unset=True)
+def invalid_parameter(title: str, detail: str | None = None) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=model.Exception(
+            type='InvalidParameterValue',
+            status=400,
+            title=title,
+            detail=detail,
+        ).model_dump(exclude_none=True))
+
+
+def get_input_dataset(dataset_id: str, input_name: str) -> Dataset:
+    dataset = dataset_store.get_dataset(dataset_id)
+    if not dataset:
+        raise invalid_parameter(f'Invalid value for input "{input_name}"', f"Dataset {dataset_id} not found")
+    return dataset
+
+
+def check_admission(cost: admission.JobCost, queue: admission.AdmissionController | RemoteJobRunner):
+    # queue: where the job will wait to be run
+    exceeded = cost.exceeds(admission.job_limits())
+    if exceeded:
+        raise HTTPException(
+            status_code=413,
+            detail=model.Exception(
+                type='InputTooLarge',
+                status=413,
+                title='Input too large',
+                detail=f"Input exceeds the maximum {', '.join(e.replace('_', ' ') for e in exceeded)} per job",
+            ).model_dump(exclude_none=True))
+    if queue.is_full:
+        raise HTTPException(
+            status_code=503,
+            headers={'Retry-After': str(ADMISSION_RETRY_AFTER)},
+            detail=model.Exception(
+                type='ServerBusy',
+                status=503,
+                title='Too many queued jobs',
+            ).model_dump(exclude_none=True))
 
 
 @app.post('/processes/{process_id}/execution', status_code=201)
-def process_execution(process_id: str, data: model.ValidationExecute, req: Request, resp: Response,
-                      background_tasks: BackgroundTasks) -> model.StatusInfo:
-    profile = app.profile_loader.profiles.get(process_id)
+def process_execution(process_id: str, data: model.ValidationExecute, req: Request,
+                      resp: Response, profiling: bool = False,
+                      fail_fast: Annotated[bool | None, Query(alias='failFast')] = None) -> model.StatusInfo:
+    # Several comma-separated profiles can be validated against the same data in a single job
+    profiles = [app.profile_loader.profiles.get(p.strip()) for p in process_id.split(',')]
 
-    if not profile:
+    if not all(profiles):
         raise HTTPException(
             status_code=404,
             detail=model.Exception(
@@ -132,18 +199,54 @@ def process_execution(process_id: str, data: model.ValidationExecute, req: Reque
                 title='Process not found',
             ).model_dump(exclude_none=True))
 
-    parameters = {k: v for k, v in data.inputs.model_dump().items() if k != 'cityFiles'}
-    job = job_executor.create_job(city_files=data.inputs.cityFiles,
-                                  profiles=[profile],
+    if bool(data.inputs.cityFiles) == bool(data.inputs.dataset):
+        raise invalid_parameter('Invalid inputs', 'Exactly one of "cityFiles" or "dataset" must be provided')
+
+    dataset = None
+    if data.inputs.dataset:
+        if data.inputs.baseDataset:
+            raise invalid_parameter('Invalid inputs', '"baseDataset" can only be used along with "cityFiles"')
+        dataset = get_input_dataset(data.inputs.dataset, 'dataset')
+
+    base_dataset = None
+    if data.inputs.baseDataset:
+        base_dataset = get_input_dataset(data.inputs.baseDataset, 'baseDataset')
+
+    subscriber = data.subscriber
+    if subscriber:
+        for uri in (subscriber.successUri, subscriber.inProgressUri, subscriber.failedUri):
+            if uri and uri.scheme not in ('http', 'https'):
+                raise invalid_parameter('Invalid subscriber', f'Unsupported callback URI {uri}')
+
+    # Jobs run by workers (in the distributed mode) are subject to the same job limits, and to the same limit of
+    # queued jobs, but not to the node budget, since they do not run on this node
+    remote = remote_jobs.accepts(dataset, base_dataset)
+    cost = dataset.cost if dataset else admission.estimate(data.inputs.cityFiles)
+    check_admission(cost, remote_jobs if remote else admission_controller)
+
+    parameters = {k: v for k, v in data.inputs.model_dump().items() if k not in COMMON_INPUTS}
+    job = job_executor.create_job(profiles=profiles,
+                                  city_files=data.inputs.cityFiles,
+                                  dataset=dataset,
                                   parameters=parameters,
-                                  profile_loader=app.profile_loader)
+                                  profile_loader=app.profile_loader,
+                                  base_dataset=base_dataset,
+                                  cost=cost,
+                                  profiling=profiling,
+                                  fail_fast=settings.fail_fast if fail_fast is None else fail_fast)
     job_id = job.job_id
-    background_tasks.add_task(job.execute_sync)
+    if subscriber:
+        dispatcher.subscribe(job_id, subscriber, str(req.url_for('view_job', job_id=job_id)),
+                             str(req.url_for('job_results', job_id=job_id)))
+    if remote:
+        remote_jobs.submit(job)
+    else:
+        admission_controller.submit(job.cost, functools.partial(job_executor.run_job, job))
 
     resp.headers['Location'] = str(req.url_for('view_job', job_id=job_id))
     resp.headers['Preference-Applied'] = 'async-execute'
     return model.StatusInfo(
-        processID=process_id,
+        processID=job.process_id,
         jobID=job_id,
         status=job.status,
         type=model.Type.process,
@@ -153,6 +256,49 @@ def process_execution(process_id: str, data: model.ValidationExecute, req: Reque
     )
 
 
+def dataset_info(dataset: Dataset, req: Request) -> model.DatasetInfo:
+    return model.DatasetInfo(
+        datasetID=dataset.dataset_id,
+        status=dataset.status,
+        message='; '.join(str(e) for e in dataset.errors) or None,
+        created=dataset.created,
+        started=dataset.started,
+        finished=dataset.finished,
+        files=[file_result_summary(f) for f in dataset.city_files] if dataset.ready.is_set() else [],
+        links=[
+            model.Link(rel='self',
+                       href=str(req.url_for('view_dataset', dataset_id=dataset.dataset_id)),
+                       type=MEDIA_APPLICATION_JSON),
+        ],
+    )
+
+
+@app.post('/datasets', status_code=201)
+def create_dataset(data: model.DatasetInputs, req: Request, resp: Response) -> model.DatasetInfo:
+    base = get_input_dataset(data.baseDataset, 'baseDataset') if data.baseDataset else None
+    cost = admission.estimate(data.cityFiles)
+    check_admission(cost, admission_controller)
+    dataset = dataset_store.create_dataset(data.cityFiles, base=base, cost=cost)
+    admission_controller.submit(dataset.cost, functools.partial(dataset_store.run_dataset, dataset))
+
+    resp.headers['Location'] = str(req.url_for('view_dataset', dataset_id=dataset.dataset_id))
+    return dataset_info(dataset, req)
+
+
+@app.get('/datasets/{dataset_id}')
+def view_dataset(dataset_id: str, req: Request) -> model.DatasetInfo:
+    dataset = dataset_store.get_dataset(dataset_id)
+    if not dataset:
+        raise HTTPException(
+            status_code=404,
+            detail=model.Exception(
+                type='NotFound',
+                status=404,
+                title='Dataset not found',
+            ).model_dump(exclude_none=True))
+    return dataset_info(dataset, req)
+
+
 @app.get('/jobs/{job_id}')
 def view_job(job_id: str) -> model.StatusInfo:
     job = job_executor.get_job(job_id)
@@ -164,19 +310,10 @@ def view_job(job_id: str) -> model.StatusInfo:
                 status=404,
                 title='Job not found',
             ).model_dump(exclude_none=True))
-    return model.StatusInfo(
-        processID=','.join(p.get_id() for p in job.profiles),
-        jobID=job_id,
-        status=job.status,
-        type=model.Type.process,
-        created=job.created,
-        started=job.started,
-        finished=job.finished,
-    )
+    return status_info(job)
 
 
-@app.get('/jobs/{job_id}/results')
-def job_results(job_id: str):
+def get_finished_job(job_id: str) -> JobSummary:
     job = job_executor.get_job(job_id)
     if not job:
         raise HTTPException(
@@ -196,32 +333,173 @@ def job_results(job_id: str):
                 title='Result not ready',
             ).model_dump(exclude_none=True))
 
+    return job
+
+
+def get_successful_job(job_id: str) -> JobSummary:
+    job = get_finished_job(job_id)
+    if job.errors:
+        raise HTTPException(
+            status_code=404,
+            detail=model.Exception(
+                type="http://www.opengis.net/def/exceptions/ogcapi-processes-1/1.0/no-such-job",
+                status=404,
+                title='Job failed and has no results',
+            ).model_dump(exclude_none=True))
+    return job
+
+
+def file_result_summary(file_result: FileResult) -> dict[str, Any]:
+    summary = {
+        'fileIndex': file_result.index,
+        'name': file_result.name,
+        'valid': file_result.valid,
+        'featuresOverview': file_result.features_overview,
+    }
+    if file_result.delta:
+        summary['delta'] = file_result.delta
+    return summary
+
+
+@app.get('/jobs/{job_id}/results')
+def job_results(job_id: str, req: Request, fields: str | None = None):
+    job = get_finished_job(job_id)
+
     if job.errors:
         return {
             'valid': False,
             'errors': [str(e) for e in job.errors],
         }
+
+    include_fields = set(f.strip() for f in fields.split(',')) if fields else set()
+    unknown_fields = include_fields - RESULT_EXTRA_FIELDS
+    if unknown_fields:
+        raise HTTPException(
+            status_code=400,
+            detail=model.Exception(
+                type='InvalidParameterValue',
+                status=400,
+                title='Invalid value for parameter "fields"',
+                detail=f"Unknown fields: {', '.join(sorted(unknown_fields))}",
+            ).model_dump(exclude_none=True))
+
+    shacl_results_href = str(req.url_for('job_shacl_results', job_id=job_id))
+    result = {
+        'valid': job.valid,
+        'val3dityResult': job.val3dity_result,
+        'shaclResult': job.shacl_result,
+        'links': [
+            model.Link(rel='results',
+                       href=shacl_results_href,
+                       type=MEDIA_APPLICATION_JSON,
+                       title='SHACL validation results').model_dump(exclude_none=True),
+        ],
+    }
+    if job.warnings:
+        result['warnings'] = job.warnings
+    if job.skipped_stages:
+        result['skippedStages'] = job.skipped_stages
+
+    extra = []
+    profile_reports = list(job.shacl_reports.values())
+    if any(report.completeness for report in profile_reports):
+        result['completenessResult'] = job.completeness_result
+    if len(profile_reports) == 1:
+        result['shaclSummary'] = profile_reports[0].summary
+        if profile_reports[0].completeness:
+            result['completeness'] = profile_reports[0].completeness
+        if 'shaclReport' in include_fields:
+            extra.append(('shaclReport', profile_reports[0].store.iter_json()))
     else:
-        result = {
-            'valid': job.valid,
-            'val3dityResult': job.val3dity_result,
-            'shaclResult': job.shacl_result,
-            'shaclReport': job.shacl_report,
-            'fileValidation': [
-                {
-                    'fileIndex': file_result.index,
-                    'name': file_result.input_file.name,
-                    'valid': file_result.valid,
-                    'val3dityReport': file_result.val3dity_report,
-                }
-                for file_result in job.city_files
-            ],
-        }
-        if job.warnings:
-            result['warnings'] = job.warnings
-        return result
+        def profile_result(report: ProfileReport):
+            summary = {
+                'profile': report.profile_id,
+                'shaclResult': report.conforms,
+                'shaclSummary': report.summary,
+                'href': f"{shacl_results_href}?profile={report.profile_id}",
+            }
+            if report.completeness:
+                summary['completeness'] = report.completeness
+            if 'shaclReport' in include_fields:
+                return results.iter_object_with(summary, [('shaclReport', report.store.iter_json())])
+            return results.iter_object_with(summary, ())
+
+        extra.append(('profileResults', results.iter_array(profile_result(r) for r in profile_reports)))
+
+    def file_validation(file_result: FileResult):
+        summary = file_result_summary(file_result)
+        summary['href'] = str(req.url_for('job_file_results', job_id=job_id, file_index=file_result.index))
+        if 'val3dityReport' in include_fields and file_result.val3dity_report_path:
+            return results.iter_object_with(summary, [
+                ('val3dityReport', results.iter_file(file_result.val3dity_report_path)),
+            ])
+        return results.iter_object_with(summary, ())
+
+    extra.append(('fileValidation', results.iter_array(file_validation(f) for f in job.city_files)))
+
+    return StreamingResponse(results.iter_object_with(result, extra), media_type=MEDIA_APPLICATION_JSON)
+
+
+@app.get('/jobs/{job_id}/results/files/{file_index}')
+def job_file_results(job_id: str, file_index: int):
+    job = get_successful_job(job_id)
+    file_result = job.city_files[file_index] if 0 <= file_index < len(job.city_files) else None
+    if not file_result or not file_result.val3dity_report_path:
+        raise HTTPException(
+            status_code=404,
+            detail=model.Exception(
+                type='NotFound',
+                status=404,
+                title='File not found',
+            ).model_dump(exclude_none=True))
+
+    return StreamingResponse(results.iter_object_with(file_result_summary(file_result), [
+        ('val3dityReport', results.iter_file(file_result.val3dity_report_path)),
+    ]), media_type=MEDIA_APPLICATION_JSON)
+
+
+@app.get('/jobs/{job_id}/results/shacl')
+def job_shacl_results(job_id: str,
+                      offset: Annotated[int, Query(ge=0)] = 0,
+                      limit: Annotated[int, Query(ge=1, le=MAX_RESULTS_LIMIT)] = DEFAULT_RESULTS_LIMIT,
+                      severity: str | None = None,
+                      profile: str | None = None):
+    job = get_successful_job(job_id)
+    if profile:
+        report = job.shacl_reports.get(profile)
+        if not report:
+            raise invalid_parameter('Invalid value for parameter "profile"',
+                                    f"Profile {profile} was not validated in this job")
+    elif len(job.shacl_reports) == 1:
+        report = next(iter(job.shacl_reports.values()))
+    else:
+        raise invalid_parameter('Missing parameter "profile"',
+                                'Job validated several profiles, one of them must be selected')
+    return StreamingResponse(report.store.iter_json(offset=offset, limit=limit,
+                                                    severity=severity, paged=True),
+                             media_type=MEDIA_APPLICATION_JSON)
+
+
+@app.get('/jobs/{job_id}/profile')
+def job_profile(job_id: str, format: str = 'json'):
+    job = get_finished_job(job_id)
+    if not job.profile_path or not job.profile_path.is_file():
+        raise HTTPException(
+            status_code=404,
+            detail=model.Exception(
+                type='NotFound',
+                status=404,
+                title='Job was not profiled',
+                detail='Jobs are only profiled when executed with "profiling=true"',
+            ).model_dump(exclude_none=True))
+    if format == 'folded':
+        return StreamingResponse(results.iter_file(job.profile_path.with_name(profiling.STACKS_FILE)),
+                                 media_type='text/plain')
+    if format != 'json':
+        raise invalid_parameter('Invalid value for parameter "format"', 'Format must be "json" or "folded"')
+    return StreamingResponse(results.iter_file(job.profile_path), media_type=MEDIA_APPLICATION_JSON)
 
 
-@app.get('/profiles')
-def get_profiles() -> ProfileList:
-    return ProfileList(app.profile_loader.profiles.values())
+@app.get('/profiles', response_model=ProfileList)
+def get_profiles(if_none_match: Annotated[str | None, Header()] = None) -> Response:
+    return cached_response(app.profile_loader.profile_list_content, if_none_match)
@@ -302,10 +302,36 @@ class ValidationInputs(Model):
         'extra': 'allow',
     }
 
-    cityFiles: List[InputFile]
+    cityFiles: Optional[List[InputFile]] = None
+    dataset: Optional[str] = None
+    baseDataset: Optional[str] = None
 
 
 class ValidationExecute(Execute):
     inputs: ValidationInputs
     outputs: Optional[Dict[str, Output]] = None
-    response: Optional[Response] = 'raw'
\ No newline at end of file
+    response: Optional[Response] = 'raw'
+
+
+class DatasetInputs(Model):
+    cityFiles: List[InputFile]
+    baseDataset: Optional[str] = None
+
+
+class DatasetFile(Model):
+    fileIndex: int
+    name: str
+    valid: Optional[bool] = None
+    featuresOverview: Optional[List[Dict[str, Any]]] = None
+    delta: Optional[Dict[str, Any]] = None
+
+
+class DatasetInfo(Model):
+    datasetID: str
+    status: StatusCode
+    message: Optional[str] = None
+    created: Optional[datetime] = None
+    started: Optional[datetime] = None
+    finished: Optional[datetime] = None
+    files: List[DatasetFile] = []
+    links: List[Link] = []
\ No newline at end of file
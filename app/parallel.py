@@ -0,0 +1,85 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, TYPE_CHECKING
+
+from app import profiling, rdfstore
+
+if TYPE_CHECKING:
+    from rdflib import Graph
+    from pyshacl.shapes_graph import ShapesGraph
+
+# Shapes, shapes graph and data graph of the validation, in the worker processes
+_state: tuple[list, 'ShapesGraph', 'Graph'] | None = None
+
+
+def can_fork() -> bool:
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def _init_worker(shapes_graph: 'ShapesGraph', data_graph: 'Graph'):
+    # Runs in the forked worker process, which already has the shapes and the loaded data graph
+    global _state
+    # Locks may have been held by other threads (e.g., other jobs) when the process was forked
+    rdfstore._prepare_lock = threading.Lock()
+    _state = (list(shapes_graph.shapes), shapes_graph, data_graph)
+    profiler = profiling.current()
+    if profiler:
+        profiler.shapes, profiler.constraints = {}, {}
+
+
+def _validate_group(indices: list[int]) -> tuple[list[tuple[int, bool, list]], tuple[dict, dict] | None]:
+    shapes, shapes_graph, data_graph = _state
+    sources = {id(shapes_graph.graph): 'shapes', id(data_graph): 'data'}
+    results = []
+    for i in indices:
+        conforms, reports = shapes[i].validate(data_graph)
+        # Report triples reference nodes of the shapes or data graphs as (graph, node), which is sent
+        # back as (graph name, node) to avoid pickling the graphs
+        results.append((i, conforms, [
+            (text, node, [(s, p, (sources[id(o[0])], o[1]) if isinstance(o, tuple) else o) for s, p, o in parts])
+            for text, node, parts in reports
+        ]))
+    timings = None
+    profiler = profiling.current()
+    if profiler:
+        timings = (profiler.shapes, profiler.constraints)
+        profiler.shapes, profiler.constraints = {}, {}
+    return results, timings
+
+
+def validate_shapes(shapes_graph: 'ShapesGraph', data_graph: 'Graph', processes: int) -> tuple[bool, list]:
+    # Evaluates the shapes (each of which is independent from the others) in groups, in processes forked
+    # after the data graph has been loaded. Results are returned in the same order as when the shapes are
+    # evaluated one after another in a single process, so that the validation report is the same
+    from rdflib import BNode
+
+    shapes = list(shapes_graph.shapes)
+    processes = min(processes, len(shapes))
+    groups = [list(range(start, len(shapes), processes)) for start in range(processes)]
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker, initargs=(shapes_graph, data_graph)) as executor:
+        group_results = [future.result() for future in [executor.submit(_validate_group, group)
+                                                        for group in groups]]
+
+    sources = {'shapes': shapes_graph.graph, 'data': data_graph}
+    profiler = profiling.current()
+    shape_results: list[Any] = [None] * len(shapes)
+    for results, timings in group_results:
+        # Blank nodes created in different processes can have the same ids
+        bnodes: dict[BNode, BNode] = {}
+
+        def relabel(term):
+            return bnodes.setdefault(term, BNode()) if isinstance(term, BNode) else term
+
+        for i, conforms, reports in results:
+            shape_results[i] = (conforms, [
+                (text, relabel(node), [(relabel(s), p, (sources[o[0]], o[1]) if isinstance(o, tuple) else relabel(o))
+                                       for s, p, o in parts])
+                for text, node, parts in reports
+            ])
+        if profiler and timings:
+            profiler.merge(*timings)
+
+    conforms = all(shape_conforms for shape_conforms, _ in shape_results)
+    return conforms, [report for _, reports in shape_results for report in reports]
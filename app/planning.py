@@ -0,0 +1,81 @@
+import dataclasses
+from collections import deque
+from typing import Any, Mapping, TYPE_CHECKING
+
+from app import completeness
+
+if TYPE_CHECKING:
+    from app.completeness import CompletenessCheck
+    from app.profiles import Profile
+    from app.shacl import CompiledShapes
+
+# Validation stages that profiles can require with chek:requiresStage
+COMPLETENESS = 'CompletenessValidation'
+GEOMETRY = 'GeometryValidation'
+SHACL = 'ShaclValidation'
+
+# Reasons for skipping a stage
+NOT_REQUIRED = 'NotRequired'
+FAIL_FAST = 'FailFast'
+
+
+def profile_stages(profile: 'Profile', profiles_by_uri: Mapping[str, 'Profile']) -> set[str] | None:
+    # Stages required by a profile and by those it is a profile of, or None (every stage) if none declares them
+    stages = None
+    seen = set()
+    pending = deque([profile])
+    while pending:
+        profile = pending.popleft()
+        if profile.uri in seen:
+            continue
+        seen.add(profile.uri)
+        if profile.stages is not None:
+            stages = (stages or set()).union(profile.stages)
+        pending.extend(profiles_by_uri[uri] for uri in profile.profileOf if uri in profiles_by_uri)
+    return stages
+
+
+@dataclasses.dataclass(slots=True)
+class ExecutionPlan:
+    # Whether val3dity is run, the profiles whose shapes are evaluated (the data is only uplifted if there
+    # are any) and the completeness checks of every profile. With fail_fast, the remaining stages are skipped
+    # once a check fails, cheapest first: completeness, val3dity, SHACL
+    geometry: bool
+    shacl: set[str]
+    completeness: dict[str, list['CompletenessCheck']]
+    fail_fast: bool = False
+    skipped: list[dict[str, Any]] = dataclasses.field(default_factory=list)
+
+    @property
+    def uplift(self) -> bool:
+        return bool(self.shacl)
+
+    def skip(self, stage: str, reason: str, profile_id: str | None = None):
+        skipped = {'stage': stage, 'reason': reason}
+        if profile_id:
+            skipped['profile'] = profile_id
+        self.skipped.append(skipped)
+
+
+def plan(profiles: list['Profile'], profile_shapes: Mapping[str, 'CompiledShapes'],
+         profiles_by_uri: Mapping[str, 'Profile'], fail_fast: bool = False) -> ExecutionPlan:
+    execution_plan = ExecutionPlan(geometry=False, shacl=set(), completeness={}, fail_fast=fail_fast)
+    for profile in profiles:
+        profile_id = profile.get_id()
+        stages = profile_stages(profile, profiles_by_uri)
+        checks = completeness.profile_checks(profile, profiles_by_uri)
+        if checks:
+            if stages is None or COMPLETENESS in stages:
+                execution_plan.completeness[profile_id] = checks
+            else:
+                execution_plan.skip(COMPLETENESS, NOT_REQUIRED, profile_id)
+        # Profiles without shapes do not need the data to be uplifted
+        if profile_shapes[profile_id].has_shapes:
+            if stages is None or SHACL in stages:
+                execution_plan.shacl.add(profile_id)
+            else:
+                execution_plan.skip(SHACL, NOT_REQUIRED, profile_id)
+        execution_plan.geometry = execution_plan.geometry or stages is None or GEOMETRY in stages
+    if not execution_plan.geometry:
+        execution_plan.skip(GEOMETRY, NOT_REQUIRED)
+    return execution_plan
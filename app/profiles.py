@@ -1,25 +1,34 @@
 import json
+import logging
+import os
 import os.path
 import re
+import shutil
+import threading
 from pathlib import Path
 from threading import Timer
-from typing import List
+from typing import Any, List
 from urllib.parse import unquote, urlparse
 
-from pydantic import RootModel, field_serializer, TypeAdapter
-from pyld import jsonld
-from rdflib import Graph
+from pydantic import RootModel, field_serializer, field_validator, TypeAdapter
 
-from app import model
+from app import model, util
+from app.shacl import ShapesCache, artifact_fingerprint
 from app.model import Model
 
+logger = logging.getLogger('uvicorn.error')
+
 RELOAD_TIME = 60 * 5
 
+# Bumped when the layout of the catalogue snapshot (or of the framed profiles) changes
+SNAPSHOT_FORMAT = 4
+SNAPSHOT_FILE = 'catalogue.json'
+
 COMMON_INPUTS = {
     'cityFiles': model.InputDescription(
         title='Input data file',
-        description='Input data file (CityJSON or CityGML)',
-        minOccurs=1,
+        description='Input data file (CityJSON or CityGML). Either cityFiles or dataset is required',
+        minOccurs=0,
         maxOccurs=model.MaxOccurs.unbounded,
         schema=model.Schema(
             type='object',
@@ -38,9 +47,29 @@ COMMON_INPUTS = {
             }
         ),
     ),
+    'dataset': model.InputDescription(
+        title='Dataset',
+        description='Identifier of a previously uploaded dataset, used instead of cityFiles',
+        minOccurs=0,
+        maxOccurs=1,
+        schema=model.Schema(
+            type='string',
+        ),
+    ),
+    'baseDataset': model.InputDescription(
+        title='Base dataset',
+        description='Identifier of a previous version of cityFiles uploaded as a dataset. '
+                    'Only new or modified city objects will be checked again',
+        minOccurs=0,
+        maxOccurs=1,
+        schema=model.Schema(
+            type='string',
+        ),
+    ),
 }
 
 LOAD_PROFILES_SPARQL = '''
+PREFIX chek: <urn:chek:vocab/>
 PREFIX chekp: <urn:chek:profiles/>
 PREFIX dct:  <http://purl.org/dc/terms/>
 PREFIX prof: <http://www.w3.org/ns/dx/prof/>
@@ -70,6 +99,15 @@ CONSTRUCT {
       OPTIONAL { ?param dct:description ?description }
       OPTIONAL { ?param hydra:required ?required }
     }
+    OPTIONAL {
+      ?uri chek:hasCompletenessCheck ?check .
+      ?check chek:cityObjectType ?cityObjectType ;
+        chek:attribute ?attribute .
+      OPTIONAL { ?check chek:minCompleteness ?minCompleteness }
+      OPTIONAL { ?check chek:minValue ?minValue }
+      OPTIONAL { ?check chek:maxValue ?maxValue }
+    }
+    OPTIONAL { ?uri chek:requiresStage ?stage }
   }
 }
 '''
@@ -81,6 +119,7 @@ LOAD_PROFILES_FRAME = json.loads('''
     "sd": "https://w3id.org/okn/o/sd#",
     "dct": "http://purl.org/dc/terms/",
     "hydra": "http://www.w3.org/ns/hydra/core#",
+    "chek": "urn:chek:vocab/",
     "uri": "@id",
     "title": "dct:title",
     "description": "dct:description",
@@ -118,11 +157,29 @@ LOAD_PROFILES_FRAME = json.loads('''
     "role": {
       "@id": "prof:hasRole",
       "@type": "@id"
-    }
+    },
+    "completeness": {
+      "@id": "chek:hasCompletenessCheck",
+      "@container": "@set"
+    },
+    "cityObjectType": "chek:cityObjectType",
+    "attribute": "chek:attribute",
+    "minCompleteness": "chek:minCompleteness",
+    "minValue": "chek:minValue",
+    "maxValue": "chek:maxValue",
+    "stages": {
+      "@id": "chek:requiresStage",
+      "@type": "@vocab",
+      "@container": "@set"
+    },
+    "CompletenessValidation": "chek:CompletenessValidation",
+    "GeometryValidation": "chek:GeometryValidation",
+    "ShaclValidation": "chek:ShaclValidation"
   },
   "@type": "urn:chek:profiles/Profile",
   "resources": {},
   "parameters": {},
+  "completeness": {},
   "@embed": "@never"
 }
 ''')
@@ -148,6 +205,22 @@ class Parameter(Model):
     required: bool = False
 
 
+class CompletenessCheck(Model):
+    cityObjectType: str
+    attribute: str
+    minCompleteness: float | None = None
+    minValue: float | None = None
+    maxValue: float | None = None
+
+    @field_validator('minCompleteness', 'minValue', 'maxValue', mode='before')
+    @classmethod
+    def unwrap_literal(cls, value: Any):
+        # Typed literals (e.g., xsd:decimal) are framed as value objects
+        if isinstance(value, dict):
+            return value.get('@value')
+        return value
+
+
 class Profile(Model):
     uri: str
     title: str | None = None
@@ -157,6 +230,9 @@ class Profile(Model):
     profileOf: list[str] = []
     resources: list[Resource] = []
     parameters: list[Parameter] = []
+    completeness: list[CompletenessCheck] = []
+    # Validation stages required by the profile (see app.planning), all of them if not declared
+    stages: list[str] | None = None
 
     def get_id(self):
         if self.token:
@@ -204,21 +280,35 @@ ProfileList = RootModel[List[Profile]]
 
 class ProfileLoader:
 
-    def __init__(self, source: str):
+    def __init__(self, source: str, snapshot_dir: Path | None = None):
         self.profiles: dict[str, Profile] = {}
         self.profiles_by_uri: dict[str, Profile] = {}
-        self.profile_shacl: dict[str, Graph] = {}
+        self.shapes_cache: ShapesCache | None = None
 
+        self.process_list_content: util.CachedContent | None = None
+        self.process_content: dict[str, util.CachedContent] = {}
+        self.profile_list_content: util.CachedContent | None = None
+
+        self._data_source = source
         self._is_sparql = source.startswith('sparql:')
         self.source = source[len('sparql:') if self._is_sparql else 0:]
 
+        self.snapshot_dir = snapshot_dir
+        self._snapshot_version = None
+        self._snapshot_lock = threading.Lock()
+
         self._reload_timer = None
 
-        self._reload_profiles()
+        if self._load_snapshot():
+            # Serve the snapshot right away and refresh it from the source in the background
+            self._schedule_reload(0)
+        else:
+            self._reload_profiles()
 
     def _reload_profiles(self):
-        self.profiles = {}
-        self.profile_shacl = {}
+        from pyld import jsonld
+        from rdflib import Graph
+
         g = Graph()
         if self._is_sparql:
             g = g.query(LOAD_PROFILES_SPARQL.replace('__SERVICE__', self.source)).graph
@@ -244,18 +334,126 @@ class ProfileLoader:
         else:
             profiles_obj = [profiles_obj]
 
+        self._set_profiles(profiles_obj)
+        if self.snapshot_dir and self._snapshot_version != self.shapes_cache.version:
+            threading.Thread(target=self._write_snapshot, args=(profiles_obj, self.shapes_cache),
+                             daemon=True).start()
+
+        self._schedule_reload()
+
+    def _set_profiles(self, profiles_obj: list[dict[str, Any]], snapshot: dict[str, Any] | None = None):
         profiles = TypeAdapter(List[Profile]).validate_python(profiles_obj)
 
         self.profiles = {profile.get_id(): profile
                          for profile in sorted(profiles, key=lambda x: (x.token, x.uri))}
         self.profiles_by_uri = {profile.uri: profile for profile in profiles}
-
-        self._schedule_reload()
-
-    def _schedule_reload(self):
-        if not self._is_sparql:
-            return
-        timer = Timer(RELOAD_TIME, self._reload_profiles)
+        self._serialize_catalogue()
+
+        # The version covers the SHACL artifacts too, which can change while the catalogue does not
+        known = None
+        if snapshot:
+            # Remote artifacts are not fetched until the catalogue is refreshed from the source
+            known = {artifact: fingerprint for stored in snapshot['shapes'].values()
+                     for artifact, fingerprint in stored['artifacts'].items()}
+        fingerprints = self._artifact_fingerprints(profiles, known)
+        version = util.make_etag((self.profile_list_content.etag
+                                  + json.dumps(fingerprints, sort_keys=True)).encode())
+        if not self.shapes_cache or self.shapes_cache.version != version:
+            # Snapshot shapes are read from the directory of the version they were written for
+            shapes_dir = None
+            if self.snapshot_dir:
+                shapes_dir = self.snapshot_dir / (snapshot['version'] if snapshot else version).strip('"')
+            self.shapes_cache = ShapesCache(version, self.profiles_by_uri, snapshot['shapes'] if snapshot else None,
+                                            shapes_dir, fingerprints)
+
+    @staticmethod
+    def _artifact_fingerprints(profiles: list[Profile], known: dict[str, str | None] | None = None):
+        fingerprints = {}
+        for profile in profiles:
+            for resource in profile.resources:
+                for artifact in resource.artifacts:
+                    if artifact in fingerprints:
+                        continue
+                    if known and re.match(r'^https?://', artifact) and artifact in known:
+                        fingerprints[artifact] = known[artifact]
+                        continue
+                    try:
+                        fingerprints[artifact] = artifact_fingerprint(artifact)
+                    except Exception as e:
+                        # The shapes of the profile will not load either, which is reported then
+                        logger.warning(f'Could not read SHACL artifact {artifact}: {e}')
+                        fingerprints[artifact] = None
+        return fingerprints
+
+    def _load_snapshot(self) -> bool:
+        if not self.snapshot_dir:
+            return False
+        try:
+            with open(self.snapshot_dir / SNAPSHOT_FILE, 'rb') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('source') != self._data_source:
+            return False
+        try:
+            self._set_profiles(snapshot['profiles'], snapshot)
+        except Exception as e:
+            logger.warning(f'Ignoring invalid profile catalogue snapshot: {e}')
+            self.shapes_cache = None
+            return False
+        self._snapshot_version = snapshot['version']
+        return True
+
+    def _write_snapshot(self, profiles_obj: list[dict[str, Any]], shapes_cache: ShapesCache):
+        # Shapes are written to a directory per catalogue version, and the index is replaced atomically
+        # so that a crash while writing never leaves a snapshot pointing to missing shapes
+        with self._snapshot_lock:
+            if self._snapshot_version == shapes_cache.version:
+                return
+            try:
+                version_dir = self.snapshot_dir / shapes_cache.version.strip('"')
+                shapes = shapes_cache.dump(version_dir)
+                snapshot_file = self.snapshot_dir / SNAPSHOT_FILE
+                tmp_file = snapshot_file.with_suffix('.tmp')
+                with open(tmp_file, 'w') as f:
+                    json.dump({
+                        'format': SNAPSHOT_FORMAT,
+                        'source': self._data_source,
+                        'version': shapes_cache.version,
+                        'profiles': profiles_obj,
+                        'shapes': shapes,
+                    }, f)
+                os.replace(tmp_file, snapshot_file)
+                self._snapshot_version = shapes_cache.version
+                for path in self.snapshot_dir.iterdir():
+                    if path.is_dir() and path != version_dir:
+                        shutil.rmtree(path, ignore_errors=True)
+            except Exception as e:
+                logger.warning(f'Could not write profile catalogue snapshot: {e}')
+
+    def _refresh(self):
+        try:
+            self._reload_profiles()
+        except Exception as e:
+            logger.error(f'Error reloading profiles from {self._data_source}: {e}')
+            self._schedule_reload()
+
+    def _serialize_catalogue(self):
+        # Responses for the catalogue endpoints only change when profiles are reloaded
+        self.process_list_content = util.CachedContent.from_model(model.ProcessList(
+            processes=[profile.to_process_summary() for profile in self.profiles.values()],
+            links=[],
+        ))
+        self.process_content = {profile_id: util.CachedContent.from_model(profile.to_process_description())
+                                for profile_id, profile in self.profiles.items()}
+        self.profile_list_content = util.CachedContent.from_model(ProfileList(list(self.profiles.values())))
+
+    def _schedule_reload(self, delay: float | None = None):
+        if delay is None:
+            if not self._is_sparql:
+                return
+            delay = RELOAD_TIME
+        timer = Timer(delay, self._refresh)
         timer.daemon = True
         self._reload_timer = timer
         timer.start()
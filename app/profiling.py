@@ -0,0 +1,196 @@
+import contextlib
+import functools
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterator
+
+import orjson
+
+# Interval (in seconds) between stack samples
+SAMPLE_INTERVAL = 0.005
+PROFILE_FILE = 'profile.json'
+STACKS_FILE = 'profile-stacks.txt'
+
+_active = threading.local()
+
+
+def _folded_stack(frame) -> str:
+    stack = []
+    while frame:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class JobProfiler:
+    # Wall time of the stages of a job and of every SHACL shape and SPARQL constraint, along with
+    # stack samples of the thread running the job (in the "folded" format used by flame graph tools)
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.stages: list[dict[str, Any]] = []
+        self.shapes: dict[tuple, dict[str, Any]] = {}
+        self.constraints: dict[tuple, dict[str, Any]] = {}
+        self.samples = Counter()
+        self._thread_ids: set[int] = set()
+        self._stop = threading.Event()
+        self._sampler: threading.Thread | None = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in tuple(self._thread_ids):
+                frame = frames.get(thread_id)
+                if frame:
+                    self.samples[_folded_stack(frame)] += 1
+
+    def start(self):
+        self._thread_ids.add(threading.get_ident())
+        if not self._sampler:
+            self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        self._thread_ids.discard(threading.get_ident())
+        if self._sampler and not self._thread_ids:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **details: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                'stage': name,
+                **details,
+                'start': round(start - self.started, 6),
+                'duration': round(time.perf_counter() - start, 6),
+            })
+
+    @staticmethod
+    def record(entries: dict[tuple, dict[str, Any]], key: tuple, info: dict[str, Any], elapsed: float,
+               focus_nodes: int | None = None):
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = {**info, 'evaluations': 0, 'duration': 0.}
+            if focus_nodes is not None:
+                entry['focusNodes'] = 0
+        entry['evaluations'] += 1
+        if focus_nodes is not None:
+            entry['focusNodes'] += focus_nodes
+        entry['duration'] += elapsed
+
+    def merge(self, shapes: dict[tuple, dict[str, Any]], constraints: dict[tuple, dict[str, Any]]):
+        # Adds timings recorded in another process (see app.parallel)
+        for entries, other in ((self.shapes, shapes), (self.constraints, constraints)):
+            for key, other_entry in other.items():
+                entry = entries.get(key)
+                if entry is None:
+                    entries[key] = dict(other_entry)
+                    continue
+                for field in ('evaluations', 'duration', 'focusNodes'):
+                    if field in other_entry:
+                        entry[field] = entry.get(field, 0) + other_entry[field]
+
+    def to_json(self) -> dict[str, Any]:
+        def by_duration(entries):
+            return sorted(({**entry, 'duration': round(entry['duration'], 6)} for entry in entries.values()),
+                          key=lambda entry: -entry['duration'])
+
+        return {
+            'duration': round(time.perf_counter() - self.started, 6),
+            'stages': self.stages,
+            # Shape durations include those of the shapes they reference (sh:property, sh:node, etc.)
+            'shapes': by_duration(self.shapes),
+            'sparqlConstraints': by_duration(self.constraints),
+            'sampleInterval': self.interval,
+            'samples': sum(self.samples.values()),
+        }
+
+    def write(self, directory: Path) -> Path:
+        path = directory / PROFILE_FILE
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(self.to_json()))
+        with open(directory / STACKS_FILE, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def current() -> JobProfiler | None:
+    return getattr(_active, 'profiler', None)
+
+
+@contextlib.contextmanager
+def activate(profiler: JobProfiler | None) -> Iterator[JobProfiler | None]:
+    # Profiles the current thread until the context is exited. Does nothing if profiler is None
+    if profiler is None:
+        yield None
+        return
+    _install_shacl_hooks()
+    previous = current()
+    _active.profiler = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _active.profiler = previous
+
+
+def stage(name: str, **details: Any) -> contextlib.AbstractContextManager:
+    profiler = current()
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(name, **details)
+
+
+@functools.cache
+def _install_shacl_hooks():
+    # Times shapes and SPARQL constraints evaluated by pyshacl while a profiler is active in the thread
+    from pyshacl.shape import Shape
+    from pyshacl.constraints.sparql.sparql_based_constraints import SPARQLBasedConstraint
+
+    validate_shape = Shape.validate
+    evaluate_sparql = SPARQLBasedConstraint._evaluate_sparql_constraint
+
+    def shape_info(shape: Shape) -> dict[str, Any]:
+        info = {'shape': str(shape.node)}
+        if shape.is_property_shape:
+            info['path'] = str(shape.path())
+        return info
+
+    @functools.wraps(validate_shape)
+    def timed_validate_shape(self, *args, **kwargs):
+        profiler = current()
+        if profiler is None:
+            return validate_shape(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return validate_shape(self, *args, **kwargs)
+        finally:
+            profiler.record(profiler.shapes, (self.node,), shape_info(self), time.perf_counter() - start)
+
+    @functools.wraps(evaluate_sparql)
+    def timed_evaluate_sparql(self, sparql_constraint, target_graph, f_v_dict):
+        profiler = current()
+        if profiler is None:
+            return evaluate_sparql(self, sparql_constraint, target_graph, f_v_dict)
+        start = time.perf_counter()
+        try:
+            return evaluate_sparql(self, sparql_constraint, target_graph, f_v_dict)
+        finally:
+            profiler.record(profiler.constraints, (self.shape.node, sparql_constraint.node),
+                            {**shape_info(self.shape), 'select': sparql_constraint.select_text},
+                            time.perf_counter() - start, len(f_v_dict))
+
+    Shape.validate = timed_validate_shape
+    SPARQLBasedConstraint._evaluate_sparql_constraint = timed_evaluate_sparql
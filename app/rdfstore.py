@@ -0,0 +1,95 @@
+import threading
+from pathlib import Path
+
+from rdflib import Graph
+from rdflib.graph import DATASET_DEFAULT_GRAPH_ID
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.sparql import Query
+
+from app.config import settings
+
+RDF_FORMATS = {
+    'turtle': 'TURTLE',
+    'ttl': 'TURTLE',
+    'nt': 'N_TRIPLES',
+    'ntriples': 'N_TRIPLES',
+}
+
+# rdflib's SPARQL parser (pyparsing) is not thread-safe
+_prepare_lock = threading.Lock()
+
+
+class PreparedQueryGraph(Graph):
+    # Data graph that parses and algebrises each distinct SPARQL text once, reusing the prepared
+    # query (with fresh initBindings for $this, etc.) on every evaluation
+
+    def __init__(self, queries: dict[str, Query], *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = queries
+
+    def query(self, query_object, *args, **kwargs):
+        if isinstance(query_object, str):
+            prepared = self.queries.get(query_object)
+            if prepared is None:
+                with _prepare_lock:
+                    prepared = self.queries.get(query_object)
+                    if prepared is None:
+                        prepared = self.queries[query_object] = prepareQuery(query_object,
+                                                                             initNs=dict(self.namespaces()))
+            query_object = prepared
+        return super().query(query_object, *args, **kwargs)
+
+
+class MemoryBackend:
+    # rdflib in-memory graphs, evaluating SPARQL in Python
+
+    name = 'memory'
+
+    def graph(self, queries: dict[str, Query] | None = None) -> Graph:
+        return PreparedQueryGraph(queries if queries is not None else {})
+
+    def load(self, graph: Graph, path: Path, format: str = 'turtle') -> Graph:
+        return graph.parse(path, format=format)
+
+
+class OxigraphBackend:
+    # Graphs backed by an embedded pyoxigraph store (through the oxrdflib rdflib store plugin):
+    # files are bulk-loaded by the native parser and SPARQL queries (e.g., from sh:sparql constraints)
+    # are evaluated by the native engine
+
+    name = 'oxigraph'
+
+    def __init__(self):
+        try:
+            import pyoxigraph
+            from oxrdflib import OxigraphStore
+        except ImportError as e:
+            raise RuntimeError("The oxigraph RDF store requires the pyoxigraph and oxrdflib packages") from e
+        self._ox = pyoxigraph
+        self._store_class = OxigraphStore
+
+    def graph(self, queries: dict[str, Query] | None = None) -> Graph:
+        # Queries are passed to the store as text, so there is nothing to prepare
+        return Graph(store=self._store_class(store=self._ox.Store()), identifier=DATASET_DEFAULT_GRAPH_ID)
+
+    def load(self, graph: Graph, path: Path, format: str = 'turtle') -> Graph:
+        graph.store._inner.bulk_load(path=str(path), format=getattr(self._ox.RdfFormat, RDF_FORMATS[format]))
+        return graph
+
+
+BACKENDS = {
+    MemoryBackend.name: MemoryBackend,
+    OxigraphBackend.name: OxigraphBackend,
+}
+
+_backends = {}
+
+
+def get_backend(name: str | None = None) -> MemoryBackend | OxigraphBackend:
+    name = name or settings.rdf_store
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown RDF store '{name}', must be one of {', '.join(BACKENDS)}")
+        backend = _backends[name] = BACKENDS[name]()
+    return backend
@@ -0,0 +1,114 @@
+import itertools
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import orjson
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def severity_name(severity: str | dict | None) -> str | None:
+    if isinstance(severity, dict):
+        severity = severity.get('@id')
+    if not severity:
+        return None
+    return local_name(severity)
+
+
+def local_name(iri: str) -> str:
+    for sep in ('#', '/', ':'):
+        if sep in iri:
+            iri = iri.rsplit(sep, 1)[1]
+    return iri
+
+
+def iter_file(path: Path) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        while chunk := f.read(STREAM_CHUNK_SIZE):
+            yield chunk
+
+
+def iter_array(items: Iterable[Iterable[bytes]]) -> Iterator[bytes]:
+    yield b'['
+    for i, item in enumerate(items):
+        if i:
+            yield b','
+        yield from item
+    yield b']'
+
+
+def iter_object_with(obj: dict[str, Any], extra: Iterable[tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    # Serializes obj, splicing in already-serialized (and possibly streamed) members
+    prefix = orjson.dumps(obj)[:-1]
+    yield prefix
+    first = prefix == b'{'
+    for key, value in extra:
+        yield (b'' if first else b',') + orjson.dumps(key) + b':'
+        yield from value
+        first = False
+    yield b'}'
+
+
+class ShaclReportStore:
+    # The report header (everything but sh:result) and the results are stored separately,
+    # one result per line, so that results can be paged without loading the whole report
+
+    def __init__(self, path: Path):
+        self.header_path = path.with_suffix('.json')
+        self.results_path = path.with_suffix('.jsonl')
+
+    def write(self, report: dict[str, Any]) -> dict[str, Any]:
+        header = {k: v for k, v in report.items() if k != 'result'}
+        severities = Counter()
+        total = 0
+        with open(self.results_path, 'wb') as f:
+            for result in report.get('result', ()):
+                f.write(orjson.dumps(result))
+                f.write(b'\n')
+                severities[severity_name(result.get('resultSeverity'))] += 1
+                total += 1
+        with open(self.header_path, 'wb') as f:
+            f.write(orjson.dumps(header))
+        aggregates = report.get('aggregates') or {}
+        return {
+            'conforms': report.get('conforms', total == 0),
+            'totalResults': report.get('totalResults', total),
+            'resultsBySeverity': aggregates.get('resultSeverity', dict(severities)),
+        }
+
+    def exists(self) -> bool:
+        return self.header_path.is_file() and self.results_path.is_file()
+
+    def iter_results(self, offset: int = 0, limit: int | None = None,
+                     severity: str | None = None) -> Iterator[bytes]:
+        with open(self.results_path, 'rb') as f:
+            lines = (line.rstrip(b'\n') for line in f)
+            if severity:
+                severity = local_name(severity)
+                lines = (line for line in lines
+                         if severity_name(orjson.loads(line).get('resultSeverity')) == severity)
+            yield from itertools.islice(lines, offset, None if limit is None else offset + limit)
+
+    def iter_json(self, offset: int = 0, limit: int | None = None,
+                  severity: str | None = None, paged: bool = False) -> Iterator[bytes]:
+        with open(self.header_path, 'rb') as f:
+            header = orjson.loads(f.read())
+
+        returned = 0
+
+        def results():
+            nonlocal returned
+            yield b'['
+            for line in self.iter_results(offset, limit, severity):
+                yield line if not returned else b',' + line
+                returned += 1
+            yield b']'
+
+        def counts():
+            yield orjson.dumps(returned)
+
+        extra = [('result', results())]
+        if paged:
+            extra.append(('numberReturned', counts()))
+        yield from iter_object_with(header, extra)
@@ -0,0 +1,375 @@
+import functools
+import hashlib
+import json
+import re
+import threading
+from collections import Counter, deque
+from pathlib import Path
+from typing import Any, Iterable, Mapping, TYPE_CHECKING
+from urllib.parse import unquote, urlparse
+
+from app.results import local_name
+
+if TYPE_CHECKING:
+    from rdflib import Graph
+    from rdflib.plugins.sparql.sparql import Query
+    from app.profiles import Profile
+    from app.rdfstore import MemoryBackend, OxigraphBackend
+
+SH = 'http://www.w3.org/ns/shacl#'
+
+SHACL_RESULT_FRAME = json.loads('''
+{
+    "@context": {
+        "shacl": "http://www.w3.org/ns/shacl#",
+        "@vocab": "http://www.w3.org/ns/shacl#",
+        "result": {
+            "@container": "@set"
+        },
+        "focusNode": {
+            "@type": "@id"
+        },
+        "resultPath": {
+            "@type": "@id",
+            "@container": "@set"
+        },
+        "resultSeverity": {
+            "@type": "@id"
+        }
+    },
+    "@type": "http://www.w3.org/ns/shacl#ValidationReport"
+}
+''')
+
+# Expanded IRI -> (term, @type: @id coercion, @set container), as defined in SHACL_RESULT_FRAME
+REPORT_TERMS = {
+    SH + 'result': ('result', False, True),
+    SH + 'focusNode': ('focusNode', True, False),
+    SH + 'resultPath': ('resultPath', True, True),
+    SH + 'resultSeverity': ('resultSeverity', True, False),
+}
+
+
+def _is_bnode(iri: str) -> bool:
+    return iri.startswith('_:')
+
+
+def compact_iri(iri: str, vocab: bool = False) -> str:
+    if iri.startswith(SH):
+        suffix = iri[len(SH):]
+        if vocab and suffix and suffix not in ('shacl', 'result', 'focusNode', 'resultPath', 'resultSeverity'):
+            return suffix
+        return 'shacl:' + suffix
+    return iri
+
+
+class ShaclReportBuilder:
+    # Builds the same document as framing the expanded (flattened) JSON-LD validation report with
+    # SHACL_RESULT_FRAME (JSON-LD 1.1, @embed @once), in a single pass over the report nodes
+
+    def __init__(self, report_graph: list[dict[str, Any]] | dict[str, Any],
+                 max_results: int | None = None,
+                 aggregate: bool = False,
+                 focus_node_types: Mapping[str, str] | None = None):
+        if isinstance(report_graph, dict):
+            report_graph = report_graph.get('@graph', [report_graph])
+        self.max_results = max_results or None
+        self.aggregate = aggregate
+        self.focus_node_types = focus_node_types or {}
+
+        self._labels: dict[str, str] = {}
+        self._nodes: dict[str, dict[str, list]] = {}
+        for node in report_graph:
+            node_id = self._label(node['@id'])
+            target = self._nodes.setdefault(node_id, {})
+            for prop, values in sorted(node.items()):
+                if prop == '@id':
+                    continue
+                if prop != '@type':
+                    for value in values:
+                        self._label_value(value)
+                target.setdefault(prop, []).extend(values)
+
+        self._embedded: set[str] = set()
+        self._bnode_outputs: dict[str, list[dict]] = {}
+
+    def _label(self, node_id: str) -> str:
+        # Blank nodes are relabeled in the same order as the JSON-LD node map algorithm would
+        if not _is_bnode(node_id):
+            return node_id
+        label = self._labels.get(node_id)
+        if label is None:
+            label = self._labels[node_id] = f"_:b{len(self._labels)}"
+        return label
+
+    def _label_value(self, value: dict):
+        if '@id' in value:
+            self._label(value['@id'])
+        elif '@list' in value:
+            for item in value['@list']:
+                self._label_value(item)
+
+    def _ref(self, value: dict) -> str | None:
+        if '@id' in value and len(value) == 1:
+            return self._label(value['@id'])
+        return None
+
+    def _frame_node(self, node_id: str, stack: list[str]) -> dict:
+        output = {'@id': node_id}
+        if _is_bnode(node_id):
+            self._bnode_outputs.setdefault(node_id, []).append(output)
+        if node_id in self._embedded or node_id in stack:
+            return output
+        self._embedded.add(node_id)
+        stack.append(node_id)
+        for prop, values in sorted(self._nodes.get(node_id, {}).items()):
+            if prop == '@type':
+                output['@type'] = values
+                continue
+            output[prop] = [self._frame_value(value, stack) for value in values]
+        stack.pop()
+        return output
+
+    def _frame_value(self, value: dict, stack: list[str]):
+        ref = self._ref(value)
+        if ref is not None:
+            return self._frame_node(ref, stack)
+        if '@list' in value:
+            return {'@list': [self._frame_value(item, stack) for item in value['@list']]}
+        return value
+
+    def _prune(self):
+        for outputs in self._bnode_outputs.values():
+            if len(outputs) == 1:
+                del outputs[0]['@id']
+
+    def _compact_node(self, node: dict) -> dict:
+        output = {}
+        if '@id' in node:
+            output['@id'] = compact_iri(node['@id'])
+        if '@type' in node:
+            types = [compact_iri(t, vocab=True) for t in node['@type']]
+            output['@type'] = types[0] if len(types) == 1 else types
+        for prop, values in node.items():
+            if prop[0] == '@':
+                continue
+            self._compact_property(output, prop, values)
+        return output
+
+    def _compact_property(self, output: dict, prop: str, values: list):
+        term, coerce_id, as_set = REPORT_TERMS.get(prop, (None, False, False))
+        for value in values:
+            is_node = not ('@value' in value or '@list' in value)
+            if term and (is_node or not coerce_id) and '@list' not in value:
+                key, compacted, container = term, self._compact_value(value, coerce_id), as_set
+            else:
+                key, compacted, container = compact_iri(prop, vocab=True), self._compact_value(value, False), False
+            if key in output:
+                if not isinstance(output[key], list):
+                    output[key] = [output[key]]
+                output[key].append(compacted)
+            else:
+                output[key] = [compacted] if container else compacted
+
+    def _compact_value(self, value: dict, coerce_id: bool):
+        if '@value' in value:
+            if len(value) == 1:
+                return value['@value']
+            if '@type' in value:
+                return {'@type': compact_iri(value['@type'], vocab=True), '@value': value['@value']}
+            return dict(value)
+        if '@list' in value:
+            return {'@list': [self._compact_value(item, False) for item in value['@list']]}
+        if coerce_id and len(value) == 1 and '@id' in value:
+            return compact_iri(value['@id'])
+        return self._compact_node(value)
+
+    def _aggregate(self, result_ids: Iterable[str]) -> dict[str, dict[str, int]]:
+        severities, shapes, focus_types = Counter(), Counter(), Counter()
+        for result_id in result_ids:
+            result = self._nodes.get(result_id, {})
+            for severity in result.get(SH + 'resultSeverity', ()):
+                severities[local_name(severity.get('@id', ''))] += 1
+            for shape in result.get(SH + 'sourceShape', ()):
+                if '@id' in shape:
+                    shapes[compact_iri(self._label(shape['@id']))] += 1
+            for focus_node in result.get(SH + 'focusNode', ()):
+                focus_type = self.focus_node_types.get(focus_node.get('@id'))
+                focus_types[local_name(focus_type) if focus_type else 'Unknown'] += 1
+        return {
+            'resultSeverity': dict(severities),
+            'sourceShape': dict(shapes),
+            'focusNodeType': dict(focus_types),
+        }
+
+    def build(self) -> dict[str, Any]:
+        reports = sorted(node_id for node_id, node in self._nodes.items()
+                         if SH + 'ValidationReport' in node.get('@type', ()))
+        if not reports:
+            return {'@context': SHACL_RESULT_FRAME['@context'], '@graph': []}
+
+        report_id = reports[0]
+        report = self._nodes[report_id]
+        result_ids = [self._label(r['@id']) for r in report.get(SH + 'result', ()) if '@id' in r]
+        if self.max_results and len(result_ids) > self.max_results:
+            report[SH + 'result'] = report[SH + 'result'][:self.max_results]
+
+        framed = self._frame_node(report_id, [])
+        self._prune()
+
+        output = {'@context': SHACL_RESULT_FRAME['@context']}
+        output.update(self._compact_node(framed))
+        if self.max_results and len(result_ids) > self.max_results:
+            output['truncated'] = True
+            output['totalResults'] = len(result_ids)
+        if self.aggregate:
+            output['aggregates'] = self._aggregate(result_ids)
+        return output
+
+
+@functools.cache
+def _init_pyshacl():
+    # pyshacl (and rdflib's SPARQL engine) are only imported when shapes are first compiled,
+    # to keep the application startup fast
+    from pyshacl.monkey import apply_patches
+    from pyshacl.validate import assign_baked_in
+    apply_patches()
+    assign_baked_in()
+
+
+class CompiledShapes:
+
+    def __init__(self, shacl_graph: 'Graph', warnings: list[dict[str, str]]):
+        from pyshacl.shapes_graph import ShapesGraph
+        from app.spatial import uses_spatial_functions
+        _init_pyshacl()
+        self.graph = shacl_graph
+        self.warnings = warnings
+        self.uses_spatial = any(uses_spatial_functions(str(o)) for o in shacl_graph.objects())
+        self.shapes_graph = ShapesGraph(shacl_graph)
+        # Harvest shapes now, instead of on the first validation
+        self.has_shapes = bool(self.shapes_graph.shapes)
+
+    def validate(self, data_graph: 'Graph', processes: int = 1) -> tuple[bool, 'Graph']:
+        from pyshacl import Validator
+        from app import parallel
+        if processes > 1 and len(self.shapes_graph.shapes) > 1 and parallel.can_fork():
+            conforms, results = parallel.validate_shapes(self.shapes_graph, data_graph, processes)
+            report_graph, _ = Validator.create_validation_report(self.shapes_graph, conforms, results)
+            return conforms, report_graph
+        validator = Validator(data_graph, shacl_graph=self.graph, options={'inplace': True})
+        validator.shacl_graph = self.shapes_graph
+        conforms, report_graph, _ = validator.run()
+        return conforms, report_graph
+
+
+def profile_artifacts(profile: 'Profile', profiles_by_uri: Mapping[str, 'Profile']) -> list[str]:
+    # SHACL artifacts of a profile and of those it is a profile of (see load_shapes())
+    artifacts = []
+    seen = set()
+    pending = deque([profile])
+    while pending:
+        profile = pending.popleft()
+        if profile.uri in seen:
+            continue
+        seen.add(profile.uri)
+        artifacts.extend(artifact for resource in profile.resources for artifact in resource.artifacts
+                         if artifact not in artifacts)
+        pending.extend(profiles_by_uri[uri] for uri in profile.profileOf if uri in profiles_by_uri)
+    return artifacts
+
+
+def artifact_fingerprint(artifact: str) -> str:
+    # Local files are identified by their modification time and size, remote ones by a hash of their content
+    if re.match(r'^https?://', artifact):
+        from urllib.request import urlopen
+        with urlopen(artifact, timeout=30) as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    stat = Path(unquote(urlparse(artifact).path)).stat()
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def load_shapes(profile: 'Profile', profiles_by_uri: Mapping[str, 'Profile']) -> CompiledShapes:
+    # Shapes of a profile and of those it is a profile of
+    from rdflib import Graph
+    loaded_profile_uris = set()
+    pending_profiles = deque([profile])
+    shacl_graph = Graph()
+    warnings = []
+    while pending_profiles:
+        profile = pending_profiles.popleft()
+        if profile.uri in loaded_profile_uris:
+            continue
+        for resource in profile.resources:
+            for artifact in resource.artifacts:
+                public_id = 'urn:check:shacl/doc' if not re.match(r'^https?://', artifact) else artifact
+                shacl_graph.parse(artifact, publicID=public_id)
+        for profile_of_uri in profile.profileOf:
+            if profile_of_uri in loaded_profile_uris or profile_of_uri in ('urn:chek:profiles/chek',
+                                                                           'chekp:chek'):
+                continue
+            profile_of = profiles_by_uri.get(profile_of_uri)
+            if profile_of:
+                pending_profiles.append(profile_of)
+            elif not any(w.get('uri') == profile_of_uri for w in warnings):
+                warnings.append({
+                    'type': 'ProfileNotFound',
+                    'uri': profile_of_uri,
+                    'message': f"Profile {profile_of_uri} not found",
+                })
+        loaded_profile_uris.add(profile.uri)
+    return CompiledShapes(shacl_graph, warnings)
+
+
+class ShapesCache:
+    # Compiled shapes graphs and SPARQL queries for a single version of the profile catalogue and of
+    # its SHACL artifacts (see artifact_fingerprint()). Shapes can be restored from a snapshot (see dump()),
+    # which avoids fetching and merging the SHACL artifacts of each profile and of those it is a profile of,
+    # as long as none of those artifacts has changed
+
+    def __init__(self, version: str, profiles_by_uri: Mapping[str, 'Profile'],
+                 snapshot: Mapping[str, dict[str, Any]] | None = None, snapshot_dir: Path | None = None,
+                 fingerprints: Mapping[str, str] | None = None):
+        self.version = version
+        self.profiles_by_uri = profiles_by_uri
+        self.fingerprints = fingerprints or {}
+        self.queries: dict[str, 'Query'] = {}
+        self._shapes: dict[str, CompiledShapes] = {}
+        self._snapshot = snapshot or {}
+        self._snapshot_dir = snapshot_dir
+        self._lock = threading.Lock()
+
+    def _load(self, profile: 'Profile') -> CompiledShapes:
+        stored = self._snapshot.get(profile.uri)
+        if stored is None or stored['artifacts'] != self._artifact_fingerprints(profile):
+            return load_shapes(profile, self.profiles_by_uri)
+        from rdflib import Graph
+        shacl_graph = Graph().parse(self._snapshot_dir / stored['file'], format='nt')
+        return CompiledShapes(shacl_graph, stored['warnings'])
+
+    def _artifact_fingerprints(self, profile: 'Profile') -> dict[str, str | None]:
+        return {artifact: self.fingerprints.get(artifact)
+                for artifact in profile_artifacts(profile, self.profiles_by_uri)}
+
+    def get(self, profile: 'Profile') -> CompiledShapes:
+        with self._lock:
+            shapes = self._shapes.get(profile.uri)
+            if shapes is None:
+                shapes = self._shapes[profile.uri] = self._load(profile)
+            return shapes
+
+    def dump(self, directory: Path) -> dict[str, dict[str, Any]]:
+        # Writes the merged shapes graph of every profile as N-Triples, returning the snapshot index
+        directory.mkdir(parents=True, exist_ok=True)
+        snapshot = {}
+        for profile in self.profiles_by_uri.values():
+            shapes = self.get(profile)
+            fn = f"{hashlib.sha256(profile.uri.encode()).hexdigest()[:32]}.nt"
+            shapes.graph.serialize(directory / fn, format='nt', encoding='utf-8')
+            snapshot[profile.uri] = {'file': fn, 'warnings': shapes.warnings,
+                                     'artifacts': self._artifact_fingerprints(profile)}
+        return snapshot
+
+    def data_graph(self, backend: 'MemoryBackend | OxigraphBackend | None' = None) -> 'Graph':
+        from app.rdfstore import get_backend
+        return (backend or get_backend()).graph(self.queries)
@@ -0,0 +1,289 @@
+import contextlib
+import functools
+import math
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+
+from app import cityjson
+from app.delta import object_vertex_indices
+
+SPATIAL = 'urn:chek:vocab/spatial#'
+CITY = 'http://example.com/vocab/city/'
+
+# Maximum number of children of an index node
+NODE_CAPACITY = 16
+# Cells per side of the grid used to compute coverage
+COVERAGE_GRID = 256
+
+_active = threading.local()
+
+
+def _convex_hull(points: np.ndarray) -> np.ndarray:
+    # Andrew's monotone chain, on unique 2D points
+    points = np.unique(points, axis=0)
+    if len(points) < 3:
+        return points
+
+    def half(pts):
+        hull = []
+        for p in pts:
+            while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0]) * (p[1] - hull[-2][1])
+                                      - (hull[-1][1] - hull[-2][1]) * (p[0] - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append(p)
+        return hull[:-1]
+
+    return np.array(half(points) + half(points[::-1]))
+
+
+def _polygon_area(polygon: np.ndarray) -> float:
+    if len(polygon) < 3:
+        return 0.0
+    x, y = polygon[:, 0], polygon[:, 1]
+    return float(abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2)
+
+
+class SpatialIndex:
+    # Packed (Sort-Tile-Recursive) R-tree over the 2D bounding boxes of city objects, with their
+    # 3D bounding boxes and convex hull footprints, in real-world coordinates
+
+    def __init__(self, iris: np.ndarray, types: np.ndarray, boxes: np.ndarray,
+                 footprints: np.ndarray, footprint_offsets: np.ndarray):
+        self.iris = iris
+        self.types = types
+        # minx, miny, minz, maxx, maxy, maxz
+        self.boxes = boxes
+        self.footprints = footprints
+        self.footprint_offsets = footprint_offsets
+        self.rows = {iri: i for i, iri in enumerate(iris.tolist())}
+        self._build_tree()
+
+    def _build_tree(self):
+        boxes2d = self.boxes[:, [0, 1, 3, 4]]
+        n = len(boxes2d)
+        centers = (boxes2d[:, :2] + boxes2d[:, 2:]) / 2
+        slices = max(1, math.ceil(math.sqrt(math.ceil(n / NODE_CAPACITY))))
+        slice_size = slices * NODE_CAPACITY
+        order = np.argsort(centers[:, 0], kind='stable')
+        for start in range(0, n, slice_size):
+            part = order[start:start + slice_size]
+            order[start:start + slice_size] = part[np.argsort(centers[part, 1], kind='stable')]
+        self.order = order
+        self.levels = [boxes2d[order]]
+        while len(self.levels[-1]) > NODE_CAPACITY:
+            children = self.levels[-1]
+            groups = np.arange(0, len(children), NODE_CAPACITY)
+            self.levels.append(np.hstack((np.minimum.reduceat(children[:, :2], groups),
+                                          np.maximum.reduceat(children[:, 2:], groups))))
+
+    def __len__(self):
+        return len(self.iris)
+
+    def query(self, box: tuple[float, float, float, float]) -> np.ndarray:
+        # Rows of the objects whose 2D bounding box intersects box (minx, miny, maxx, maxy)
+        if not len(self):
+            return np.empty(0, dtype=int)
+        minx, miny, maxx, maxy = box
+        nodes = np.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            level = self.levels[depth][nodes]
+            nodes = nodes[(level[:, 0] <= maxx) & (level[:, 2] >= minx)
+                          & (level[:, 1] <= maxy) & (level[:, 3] >= miny)]
+            if depth:
+                nodes = (nodes[:, None] * NODE_CAPACITY + np.arange(NODE_CAPACITY)).ravel()
+                nodes = nodes[nodes < len(self.levels[depth - 1])]
+        return self.order[nodes]
+
+    def row(self, iri: str) -> int | None:
+        return self.rows.get(iri)
+
+    def filter_type(self, rows: np.ndarray, object_type: str | None) -> np.ndarray:
+        if not object_type:
+            return rows
+        return rows[self.types[rows] == object_type]
+
+    def distances(self, row: int, rows: np.ndarray) -> np.ndarray:
+        # 2D distances between bounding boxes
+        a = self.boxes[row]
+        b = self.boxes[rows]
+        dx = np.maximum(0, np.maximum(b[:, 0] - a[3], a[0] - b[:, 3]))
+        dy = np.maximum(0, np.maximum(b[:, 1] - a[4], a[1] - b[:, 4]))
+        return np.hypot(dx, dy)
+
+    def within_distance(self, row: int, distance: float) -> np.ndarray:
+        box = self.boxes[row]
+        candidates = self.query((box[0] - distance, box[1] - distance, box[3] + distance, box[4] + distance))
+        candidates = candidates[candidates != row]
+        return candidates[self.distances(row, candidates) <= distance]
+
+    def footprint(self, row: int) -> np.ndarray:
+        return self.footprints[self.footprint_offsets[row]:self.footprint_offsets[row + 1]]
+
+    def coverage(self, box: tuple[float, float, float, float]) -> float:
+        # Fraction of box covered by the bounding boxes of the objects, on a grid
+        minx, miny, maxx, maxy = box
+        if maxx <= minx or maxy <= miny:
+            return 0.0
+        grid = np.zeros((COVERAGE_GRID, COVERAGE_GRID), dtype=bool)
+        cell_x, cell_y = (maxx - minx) / COVERAGE_GRID, (maxy - miny) / COVERAGE_GRID
+        for row in self.query(box):
+            b = self.boxes[row]
+            x0, x1 = (np.clip([(b[0] - minx) / cell_x, (b[3] - minx) / cell_x], 0, COVERAGE_GRID)).astype(int)
+            y0, y1 = (np.clip([(b[1] - miny) / cell_y, (b[4] - miny) / cell_y], 0, COVERAGE_GRID)).astype(int)
+            grid[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)] = True
+        return float(grid.mean())
+
+    def save(self, path: Path):
+        tmp_path = path.with_name(path.stem + '.tmp.npz')
+        np.savez(tmp_path, iris=self.iris, types=self.types, boxes=self.boxes,
+                 footprints=self.footprints, footprint_offsets=self.footprint_offsets)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'SpatialIndex':
+        with np.load(path) as data:
+            return cls(data['iris'], data['types'], data['boxes'], data['footprints'], data['footprint_offsets'])
+
+    @classmethod
+    def build(cls, docs: Iterable[tuple[int, dict[str, Any]]]) -> 'SpatialIndex':
+        iris, types, boxes, footprints, footprint_offsets = [], [], [], [], [0]
+        for file_idx, doc in docs:
+            vertices = np.asarray(doc.get('vertices') or np.empty((0, 3)), dtype=float).reshape(-1, 3)
+            transform = doc.get('transform')
+            if transform:
+                vertices = vertices * transform.get('scale', (1, 1, 1)) + transform.get('translate', (0, 0, 0))
+            for object_id, city_object in (doc.get('CityObjects') or {}).items():
+                indices = object_vertex_indices(city_object)
+                if not indices:
+                    continue
+                points = vertices[np.unique(indices)]
+                iris.append(cityjson.city_object_iri(file_idx, object_id))
+                types.append(city_object.get('type') or '')
+                boxes.append(np.concatenate((points.min(axis=0), points.max(axis=0))))
+                hull = _convex_hull(points[:, :2])
+                footprints.append(hull)
+                footprint_offsets.append(footprint_offsets[-1] + len(hull))
+        return cls(np.array(iris, dtype=str), np.array(types, dtype=str),
+                   np.array(boxes, dtype=float).reshape(-1, 6),
+                   np.concatenate(footprints) if footprints else np.empty((0, 2)),
+                   np.array(footprint_offsets, dtype=int))
+
+
+def load_or_build(path: Path, city_files: Iterable[tuple[int, Path]]) -> SpatialIndex:
+    # The index is stored next to the data, so that it is only built once for a dataset
+    if path.is_file():
+        return SpatialIndex.load(path)
+    index = SpatialIndex.build((file_idx, cityjson.load(city_path)) for file_idx, city_path in city_files)
+    index.save(path)
+    return index
+
+
+@contextlib.contextmanager
+def activate(index: SpatialIndex) -> Iterator[SpatialIndex]:
+    # Makes the index available to the spatial SPARQL functions evaluated in this thread
+    previous = getattr(_active, 'index', None)
+    _active.index = index
+    try:
+        yield index
+    finally:
+        _active.index = previous
+
+
+def uses_spatial_functions(text: str) -> bool:
+    return SPATIAL in text
+
+
+# SPARQL functions
+
+def _index() -> SpatialIndex:
+    from rdflib.plugins.sparql.sparql import SPARQLError
+    index = getattr(_active, 'index', None)
+    if index is None:
+        raise SPARQLError('No spatial index available')
+    return index
+
+
+def _row(index: SpatialIndex, term) -> int:
+    from rdflib.plugins.sparql.sparql import SPARQLError
+    row = index.row(str(term))
+    if row is None:
+        raise SPARQLError(f'{term} has no geometry')
+    return row
+
+
+def _box(args) -> tuple[float, float, float, float]:
+    # 4 numbers, or a single "minx,miny,maxx,maxy" string (e.g., a parameter value)
+    from rdflib.plugins.sparql.sparql import SPARQLError
+    if len(args) == 1:
+        args = re.split(r'[\s,]+', str(args[0]).strip())
+    if len(args) != 4:
+        raise SPARQLError('A bounding box needs minx, miny, maxx and maxy')
+    return tuple(float(a) for a in args)
+
+
+def _object_type(term) -> str | None:
+    if term is None:
+        return None
+    term = str(term)
+    return term[len(CITY):] if term.startswith(CITY) else term
+
+
+def _literal(value):
+    from rdflib import Literal
+    return Literal(value)
+
+
+def intersects(obj, *box):
+    index = _index()
+    b = index.boxes[_row(index, obj)]
+    minx, miny, maxx, maxy = _box(box)
+    return _literal(bool(b[0] <= maxx and b[3] >= minx and b[1] <= maxy and b[4] >= miny))
+
+
+def count_in_box(*args):
+    box_args, object_type = (args[:-1], args[-1]) if len(args) in (2, 5) else (args, None)
+    index = _index()
+    return _literal(int(len(index.filter_type(index.query(_box(box_args)), _object_type(object_type)))))
+
+
+def count_within(obj, distance, object_type=None):
+    index = _index()
+    rows = index.within_distance(_row(index, obj), float(distance))
+    return _literal(int(len(index.filter_type(rows, _object_type(object_type)))))
+
+
+def distance(a, b):
+    index = _index()
+    return _literal(float(index.distances(_row(index, a), np.array([_row(index, b)]))[0]))
+
+
+def footprint_area(obj):
+    index = _index()
+    return _literal(_polygon_area(index.footprint(_row(index, obj))))
+
+
+def coverage(*box):
+    return _literal(_index().coverage(_box(box)))
+
+
+FUNCTIONS = {
+    'intersects': intersects,
+    'countInBox': count_in_box,
+    'countWithin': count_within,
+    'distance': distance,
+    'footprintArea': footprint_area,
+    'coverage': coverage,
+}
+
+
+@functools.cache
+def register_functions():
+    from rdflib import URIRef
+    from rdflib.plugins.sparql.operators import register_custom_function
+    for name, fn in FUNCTIONS.items():
+        register_custom_function(URIRef(SPATIAL + name), fn, override=True)
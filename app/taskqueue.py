@@ -0,0 +1,330 @@
+import dataclasses
+import hmac
+import socket
+import socketserver
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlparse
+
+import orjson
+
+# Frame header: lengths of the JSON message and of the binary payload that follows it
+FRAME_HEADER = struct.Struct('>II')
+# Operations that can be sent again when their response is lost, since repeating them has no further effect
+IDEMPOTENT_OPS = frozenset(('put', 'heartbeat', 'complete', 'release', 'states', 'result', 'delete'))
+
+
+class TaskState:
+    queued = 'queued'
+    leased = 'leased'
+    done = 'done'
+    failed = 'failed'
+
+
+@dataclasses.dataclass(slots=True)
+class Task:
+    task_id: str
+    attempt: int
+    payload: bytes
+
+
+@dataclasses.dataclass(slots=True)
+class TaskStatus:
+    state: str
+    attempts: int
+    error: str | None = None
+
+
+class SqliteQueue:
+    # Tasks are leased to a worker for a limited time, which the worker extends with heartbeats while it
+    # works on them. Tasks with an expired lease (i.e., whose worker was lost) are queued again, until
+    # they run out of attempts. Several processes on the same host can share the database file
+
+    def __init__(self, path: str | Path):
+        self.path = str(path)
+        self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    payload BLOB,
+                    result BLOB,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    created REAL NOT NULL
+                )
+            ''')
+
+    def _transaction(self, fn, *args):
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                value = fn(self._connection, *args)
+                self._connection.execute('COMMIT')
+                return value
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+
+    @staticmethod
+    def _expire(db: sqlite3.Connection):
+        now = time.time()
+        db.execute("UPDATE tasks SET state = ?, worker = NULL, payload = NULL, "
+                   "error = 'Worker lost after ' || attempts || ' attempt(s)' "
+                   "WHERE state = ? AND lease_expires < ? AND attempts >= max_attempts",
+                   (TaskState.failed, TaskState.leased, now))
+        db.execute("UPDATE tasks SET state = ?, worker = NULL WHERE state = ? AND lease_expires < ?",
+                   (TaskState.queued, TaskState.leased, now))
+
+    def put(self, task_id: str, payload: bytes, max_attempts: int = 1):
+        # Putting the same task again has no effect
+        def put(db: sqlite3.Connection):
+            if db.execute('INSERT OR IGNORE INTO tasks (task_id, state, payload, max_attempts, created) '
+                          'VALUES (?, ?, ?, ?, ?)',
+                          (task_id, TaskState.queued, payload, max(1, max_attempts), time.time())).rowcount:
+                return
+            row = db.execute('SELECT payload FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            # The payload is dropped once the task is done or failed
+            if row[0] is not None and row[0] != payload:
+                raise ValueError(f"Task {task_id} already exists with a different payload")
+        self._transaction(put)
+
+    def lease(self, worker: str, lease_time: float) -> Task | None:
+        def lease(db: sqlite3.Connection):
+            self._expire(db)
+            row = db.execute('SELECT task_id, attempts, payload FROM tasks WHERE state = ? ORDER BY created LIMIT 1',
+                             (TaskState.queued,)).fetchone()
+            if not row:
+                return None
+            db.execute('UPDATE tasks SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 '
+                       'WHERE task_id = ?', (TaskState.leased, worker, time.time() + lease_time, row[0]))
+            return Task(row[0], row[1] + 1, row[2])
+        return self._transaction(lease)
+
+    def heartbeat(self, task_id: str, worker: str, lease_time: float) -> bool:
+        # False if the lease was lost (e.g., it expired and the task was given to another worker)
+        return self._transaction(lambda db: db.execute(
+            'UPDATE tasks SET lease_expires = ? WHERE task_id = ? AND worker = ? AND state = ?',
+            (time.time() + lease_time, task_id, worker, TaskState.leased)).rowcount > 0)
+
+    def complete(self, task_id: str, worker: str, result: bytes) -> bool:
+        # The worker is kept, so that completing the task again (with the same result) returns True
+        return self._transaction(lambda db: db.execute(
+            'UPDATE tasks SET state = ?, result = ?, payload = NULL '
+            'WHERE task_id = ? AND worker = ? AND (state = ? OR state = ? AND result = ?)',
+            (TaskState.done, result, task_id, worker, TaskState.leased, TaskState.done, result)).rowcount > 0)
+
+    def release(self, task_id: str, worker: str, error: str):
+        # Gives up a task because of a worker error, retrying it if it has attempts left
+        self._transaction(lambda db: db.execute(
+            'UPDATE tasks SET worker = NULL, error = ?, '
+            'state = CASE WHEN attempts < max_attempts THEN ? ELSE ? END '
+            'WHERE task_id = ? AND worker = ? AND state = ?',
+            (error, TaskState.queued, TaskState.failed, task_id, worker, TaskState.leased)))
+
+    def states(self, task_ids: list[str]) -> dict[str, TaskStatus]:
+        def states(db: sqlite3.Connection):
+            self._expire(db)
+            statuses = {}
+            for start in range(0, len(task_ids), 500):
+                chunk = task_ids[start:start + 500]
+                for task_id, state, attempts, error in db.execute(
+                        f"SELECT task_id, state, attempts, error FROM tasks "
+                        f"WHERE task_id IN ({','.join('?' * len(chunk))})", chunk):
+                    statuses[task_id] = TaskStatus(state, attempts, error)
+            return statuses
+        return self._transaction(states)
+
+    def result(self, task_id: str) -> bytes | None:
+        with self._lock:
+            row = self._connection.execute('SELECT result FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, task_id: str):
+        self._transaction(lambda db: db.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,)))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _send(sock: socket.socket, message: dict[str, Any], blob: bytes | None = None):
+    data = orjson.dumps(message)
+    blob = blob or b''
+    sock.sendall(FRAME_HEADER.pack(len(data), len(blob)) + data + blob)
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> bytes:
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError('Connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock: socket.socket) -> tuple[dict[str, Any], bytes]:
+    data_len, blob_len = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))
+    message = orjson.loads(_recv_exactly(sock, data_len))
+    return message, _recv_exactly(sock, blob_len) if blob_len else b''
+
+
+class TcpQueue:
+    # Client for a queue served by a broker (see serve()), for workers on other hosts
+
+    def __init__(self, host: str, port: int, token: str):
+        self.address = (host, port)
+        self.token = token
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        # Connections start by authenticating with the token shared with the broker
+        sock = socket.create_connection(self.address, timeout=60)
+        try:
+            _send(sock, {'op': 'auth', 'token': self.token})
+            response, _ = _recv(sock)
+        except BaseException:
+            sock.close()
+            raise
+        if 'error' in response:
+            sock.close()
+            raise RuntimeError(f"Queue broker error: {response['error']}")
+        return sock
+
+    def _call(self, op: str, blob: bytes | None = None, **kwargs) -> tuple[Any, bytes]:
+        # Calls are retried once on a new connection (the broker may have closed a kept-alive one), but
+        # only idempotent ones if the request may have reached the broker
+        for retry in (True, False):
+            sock = getattr(self._local, 'sock', None)
+            sent = False
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                _send(sock, {'op': op, **kwargs}, blob)
+                sent = True
+                response, response_blob = _recv(sock)
+                break
+            except OSError:
+                self._local.sock = None
+                if sock:
+                    sock.close()
+                if not retry or (sent and op not in IDEMPOTENT_OPS):
+                    raise
+        if 'error' in response:
+            raise RuntimeError(f"Queue broker error: {response['error']}")
+        return response.get('value'), response_blob
+
+    def put(self, task_id: str, payload: bytes, max_attempts: int = 1):
+        self._call('put', payload, task_id=task_id, max_attempts=max_attempts)
+
+    def lease(self, worker: str, lease_time: float) -> Task | None:
+        value, payload = self._call('lease', worker=worker, lease_time=lease_time)
+        return Task(value['task_id'], value['attempt'], payload) if value else None
+
+    def heartbeat(self, task_id: str, worker: str, lease_time: float) -> bool:
+        return self._call('heartbeat', task_id=task_id, worker=worker, lease_time=lease_time)[0]
+
+    def complete(self, task_id: str, worker: str, result: bytes) -> bool:
+        return self._call('complete', result, task_id=task_id, worker=worker)[0]
+
+    def release(self, task_id: str, worker: str, error: str):
+        self._call('release', task_id=task_id, worker=worker, error=error)
+
+    def states(self, task_ids: list[str]) -> dict[str, TaskStatus]:
+        value, _ = self._call('states', task_ids=task_ids)
+        return {task_id: TaskStatus(**status) for task_id, status in value.items()}
+
+    def result(self, task_id: str) -> bytes | None:
+        value, result = self._call('result', task_id=task_id)
+        return result if value else None
+
+    def delete(self, task_id: str):
+        self._call('delete', task_id=task_id)
+
+    def close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock:
+            sock.close()
+            self._local.sock = None
+
+
+class _BrokerHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        queue: SqliteQueue = self.server.queue
+        try:
+            message, _ = _recv(self.request)
+        except (ConnectionError, OSError):
+            return
+        if message.get('op') != 'auth' or not hmac.compare_digest(str(message.get('token')).encode(),
+                                                                   self.server.token.encode()):
+            _send(self.request, {'error': 'Unauthorized'})
+            return
+        _send(self.request, {'value': True})
+        while True:
+            try:
+                message, blob = _recv(self.request)
+            except (ConnectionError, OSError):
+                return
+            op = message.pop('op', None)
+            response_blob = None
+            try:
+                if op == 'put':
+                    value = queue.put(payload=blob, **message)
+                elif op == 'lease':
+                    task = queue.lease(**message)
+                    value = {'task_id': task.task_id, 'attempt': task.attempt} if task else None
+                    response_blob = task.payload if task else None
+                elif op == 'complete':
+                    value = queue.complete(result=blob, **message)
+                elif op == 'states':
+                    value = {task_id: dataclasses.asdict(status)
+                             for task_id, status in queue.states(**message).items()}
+                elif op == 'result':
+                    response_blob = queue.result(**message)
+                    value = response_blob is not None
+                elif op in ('heartbeat', 'release', 'delete'):
+                    value = getattr(queue, op)(**message)
+                else:
+                    raise ValueError(f"Unknown operation {op}")
+                response = {'value': value}
+            except Exception as e:
+                response = {'error': str(e)}
+            _send(self.request, response, response_blob)
+
+
+class _BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(queue: SqliteQueue, host: str, port: int, token: str):
+    # Clients need to authenticate with the token
+    if not token:
+        raise ValueError('A token is required to serve a job queue')
+    with _BrokerServer((host, port), _BrokerHandler) as server:
+        server.queue = queue
+        server.token = token
+        server.serve_forever()
+
+
+def open_queue(url: str, token: str = '') -> SqliteQueue | TcpQueue:
+    # sqlite:///path/to/queue.db or tcp://host:port (with the token of the broker)
+    if url.startswith('sqlite://'):
+        return SqliteQueue(url[len('sqlite://'):])
+    parsed = urlparse(url)
+    if parsed.scheme == 'tcp' and parsed.hostname and parsed.port:
+        return TcpQueue(parsed.hostname, parsed.port, token)
+    raise ValueError(f"Unsupported job queue {url}, must be sqlite://<path> or tcp://<host>:<port>")
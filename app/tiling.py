@@ -0,0 +1,129 @@
+import dataclasses
+import math
+from pathlib import Path
+from typing import Any
+
+from app.cityjson import file_base_iri
+from app.delta import object_vertex_indices
+
+# Top-level members that are only uplifted once, from the skeleton document
+UPLIFT_TILE_MEMBERS = ('type', 'version')
+
+
+@dataclasses.dataclass(slots=True)
+class Tile:
+    object_ids: list[str]
+    # Global index of each vertex in the tile, by tile vertex index
+    vertices: list[int]
+
+    def to_cityjson(self, doc: dict[str, Any], members: tuple[str, ...] | None = None) -> dict[str, Any]:
+        global_vertices = doc.get('vertices') or []
+        local = {v: i for i, v in enumerate(self.vertices)}
+        city_objects = doc.get('CityObjects') or {}
+        tile_objects = {}
+        for object_id in self.object_ids:
+            city_object = city_objects[object_id]
+            if city_object.get('geometry'):
+                city_object = {
+                    **city_object,
+                    'geometry': [{**geometry, 'boundaries': _remap(geometry.get('boundaries'), local)}
+                                 for geometry in city_object['geometry']],
+                }
+            tile_objects[object_id] = city_object
+        tile_doc = {k: v for k, v in doc.items() if members is None or k in members}
+        tile_doc['CityObjects'] = tile_objects
+        tile_doc['vertices'] = [global_vertices[v] for v in self.vertices]
+        return tile_doc
+
+
+def _remap(boundaries, vertex_map: dict[int, int]):
+    if isinstance(boundaries, list):
+        return [_remap(b, vertex_map) for b in boundaries]
+    return vertex_map.get(boundaries, boundaries)
+
+
+def objects_tile(doc: dict[str, Any], object_ids: list[str]) -> Tile:
+    # Tile with the given objects and the vertices they reference
+    city_objects = doc.get('CityObjects') or {}
+    return Tile(object_ids=object_ids,
+                vertices=sorted(set(v for object_id in object_ids
+                                    for v in object_vertex_indices(city_objects[object_id]))))
+
+
+def skeleton(doc: dict[str, Any], tiles: list[Tile]) -> Tile:
+    # "Tile" with the vertices that are not in any of the tiles
+    referenced = set(v for tile in tiles for v in tile.vertices)
+    return Tile(object_ids=[], vertices=[v for v in range(len(doc.get('vertices') or ())) if v not in referenced])
+
+
+def _root(object_id: str, city_objects: dict[str, Any]) -> str:
+    seen = {object_id}
+    while True:
+        parents = city_objects[object_id].get('parents')
+        if not parents or parents[0] not in city_objects or parents[0] in seen:
+            return object_id
+        object_id = parents[0]
+        seen.add(object_id)
+
+
+def split(doc: dict[str, Any], tile_count: int) -> tuple[list[Tile], Tile]:
+    # Objects are grouped with their ancestors/descendants (val3dity validates them together), and groups
+    # are split into strips by the x of their bounding box center and then each strip by y, so that
+    # tiles have a similar number of groups. Returns the tiles and a skeleton "tile" with the
+    # vertices that are not referenced by any object.
+    city_objects = doc.get('CityObjects') or {}
+    vertices = doc.get('vertices') or []
+
+    groups: dict[str, list[str]] = {}
+    for object_id in city_objects:
+        groups.setdefault(_root(object_id, city_objects), []).append(object_id)
+
+    centers = []
+    for root, object_ids in groups.items():
+        min_x = min_y = math.inf
+        max_x = max_y = -math.inf
+        for object_id in object_ids:
+            for v in object_vertex_indices(city_objects[object_id]):
+                x, y = vertices[v][0], vertices[v][1]
+                min_x, max_x = min(min_x, x), max(max_x, x)
+                min_y, max_y = min(min_y, y), max(max_y, y)
+        if min_x == math.inf:
+            centers.append((0, 0, root))
+        else:
+            centers.append(((min_x + max_x) / 2, (min_y + max_y) / 2, root))
+
+    tile_count = max(1, min(tile_count, len(centers)))
+    cols = math.ceil(math.sqrt(tile_count))
+    centers.sort()
+    tiles = []
+    # Strips get a number of groups proportional to their number of tiles, for exactly tile_count tiles
+    strip_tiles = [tile_count // cols + (1 if col < tile_count % cols else 0) for col in range(cols)]
+    strip_start = 0
+    for col, rows in enumerate(strip_tiles):
+        strip_end = round(len(centers) * sum(strip_tiles[:col + 1]) / tile_count)
+        strip = sorted(centers[strip_start:strip_end], key=lambda c: (c[1], c[0]))
+        strip_start = strip_end
+        for row in range(rows):
+            cell = strip[round(len(strip) * row / rows):round(len(strip) * (row + 1) / rows)]
+            if cell:
+                tiles.append(objects_tile(doc, [object_id for _, _, root in cell for object_id in groups[root]]))
+
+    return tiles, skeleton(doc, tiles)
+
+
+def remap_uplift(ttl_file: Path, vertex_map: list[int], file_idx: int, output_file: Path):
+    # Rewrites tile vertex IRIs to the IRIs of the same vertices in the full document, for tiles that were
+    # not uplifted natively (which writes the remapped IRIs directly, see app.uplift.convert())
+    from rdflib import Graph, URIRef
+    prefix = f"{file_base_iri(file_idx)}#vertices-"
+
+    def remap(term):
+        if isinstance(term, URIRef) and term.startswith(prefix) and term[len(prefix):].isdigit():
+            return URIRef(f"{prefix}{vertex_map[int(term[len(prefix):])]}")
+        return term
+
+    graph = Graph().parse(ttl_file, format='turtle')
+    remapped = Graph()
+    for s, p, o in graph:
+        remapped.add((remap(s), p, remap(o)))
+    remapped.serialize(output_file, format='nt', encoding='utf-8')
@@ -0,0 +1,467 @@
+import math
+import re
+import subprocess
+import sys
+import tempfile
+import uuid
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Sequence, TYPE_CHECKING
+
+from app import cityjson, limits
+
+if TYPE_CHECKING:
+    from rdflib import Graph
+
+UPLIFT_DEFINITION = './data/cityjson-uplift.yml'
+
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+CITY = 'http://example.com/vocab/city/'
+ATTR = 'http://example.com/vocab/city/attr#'
+DCT = 'http://purl.org/dc/terms/'
+GML = 'http://www.opengis.net/ont/gml#'
+
+CITY_OBJECT_TYPES = {
+    **{name: f"{CITY}{name}" for name in (
+        'Bridge', 'BridgeConstructiveElement', 'BridgeFurniture', 'BridgeInstallation', 'BridgePart', 'BridgeRoom',
+        'Building', 'BuildingConstructiveElement', 'BuildingFurniture', 'BuildingInstallation', 'BuildingPart',
+        'BuildingRoom', 'BuildingStorey', 'BuildingUnit', 'CityFurniture', 'CityObjectGroup', 'ExtensionObject',
+        'LandUse', 'OtherConstruction', 'PlantCover', 'Railway', 'Road', 'SolitaryVegetationObject', 'TINRelief',
+        'TransportSquare', 'Tunnel', 'TunnelConstructiveElement', 'TunnelFurniture', 'TunnelHollowSpace',
+        'TunnelInstallation', 'TunnelPart', 'WaterBody', 'Waterway', '_AbstractBuilding', '_AbstractCityObject',
+        '_AbstractTransportationComplex',
+    )},
+    '+GenericCityObject': 'https://www.cityjson.org/extensions/download/generic.ext.json#GenericCityObject',
+}
+GEOMETRY_TYPES = {
+    'GeometryInstance': f"{CITY}GeometryInstance",
+    **{name: f"{GML}{name}" for name in (
+        'CompositeSolid', 'CompositeSurface', 'MultiLineString', 'MultiPoint', 'MultiSolid', 'MultiSurface', 'Solid',
+    )},
+}
+SURFACE_TYPES = {name: f"{CITY}{name}" for name in (
+    'RoofSurface', 'GroundSurface', 'WallSurface', 'ClosureSurface', 'OuterCeilingSurface', 'OuterFloorSurface',
+    'Window', 'Door', 'InteriorWallSurface', 'CeilingSurface', 'FloorSurface', 'WaterSurface', 'WaterGroundSurface',
+    'WaterClosureSurface', 'TrafficArea', 'AuxiliaryTrafficArea', 'TransportationHole', 'TransportationMarking',
+)}
+
+# Terms of the JSON-LD context in data/cityjson-uplift.yml, at each level of the document. Keys matching a term
+# that is not explicitly mapped below (or that look like IRIs) are not supported by the native uplift
+DOCUMENT_TERMS = {
+    'city', 'attr', 'dct', 'xsd', 'gml', 'CityJSON', 'type', 'id', 'version', 'attributes', 'CityObjects',
+    'city:x', 'city:y', 'city:z', 'transform', 'metadata', 'geographicalExtent', 'vertices', 'extensions',
+}
+CITY_OBJECT_TERMS = DOCUMENT_TERMS | CITY_OBJECT_TYPES.keys() | {'function', 'usage', 'geometry', 'parents',
+                                                                 'children'}
+SURFACE_TERMS = CITY_OBJECT_TERMS | GEOMETRY_TYPES.keys() | SURFACE_TYPES.keys() | {
+    'Semantics', 'Material', 'Texture', 'lod', 'surfaces', 'boundaries',
+}
+
+# Characters that cannot appear in IRIs written as-is by the uplift
+IRI_UNSAFE = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+# Values resolved as relative IRI paths against the file base IRI
+RELATIVE_PATH = re.compile(r'[^\x00-\x20<>"{}|^`\\:/?#]+')
+ATTRIBUTE_NAME = re.compile(r'[\w\-.~]+')
+
+A = f"<{RDF}type>"
+RDF_FIRST = f"<{RDF}first>"
+RDF_REST = f"<{RDF}rest>"
+RDF_NIL = f"<{RDF}nil>"
+XSD_BOOLEAN = f"<{XSD}boolean>"
+XSD_INTEGER = f"<{XSD}integer>"
+XSD_DOUBLE = f"<{XSD}double>"
+XSD_DECIMAL = f"<{XSD}decimal>"
+DCT_IDENTIFIER = f"<{DCT}identifier>"
+CITY_X, CITY_Y, CITY_Z = f"<{CITY}x>", f"<{CITY}y>", f"<{CITY}z>"
+
+
+class UnsupportedCityJSON(Exception):
+    pass
+
+
+def _string(value: str) -> str:
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r') + '"'
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _double(value: float) -> str:
+    # Canonical xsd:double, as generated by JSON-LD to RDF conversion
+    return re.sub(r'(\d)0*E\+?(-)?0*(\d)', r'\1E\2\3', f'{value:1.15E}')
+
+
+def _decimal(value: Any) -> str:
+    # Coordinates, which are typed as xsd:decimal
+    if not _is_number(value) or not math.isfinite(value):
+        raise UnsupportedCityJSON(f"Unsupported coordinate {value!r}")
+    if isinstance(value, int) or value.is_integer():
+        return f'"{int(value)}"^^{XSD_DECIMAL}'
+    return f'"{format(Decimal(repr(value)), "f")}"^^{XSD_DECIMAL}'
+
+
+def _literal(value: Any) -> str:
+    # Native JSON values, as converted by JSON-LD: numbers with a fractional part (or too large for xsd:integer)
+    # are doubles, other numbers are integers
+    if isinstance(value, bool):
+        return f'"{"true" if value else "false"}"^^{XSD_BOOLEAN}'
+    if isinstance(value, str):
+        return _string(value)
+    if _is_number(value) and math.isfinite(value):
+        if float(value).is_integer() and abs(value) < 1e21:
+            return f'"{int(value)}"^^{XSD_INTEGER}'
+        return f'"{_double(value)}"^^{XSD_DOUBLE}'
+    raise UnsupportedCityJSON(f"Unsupported value {value!r}")
+
+
+def _values(value: Any) -> list[Any]:
+    # Arrays are sets of values; nested arrays and objects are not supported
+    values = value if isinstance(value, list) else [value]
+    for v in values:
+        if isinstance(v, (list, dict)):
+            raise UnsupportedCityJSON(f"Unsupported value {v!r}")
+    return [v for v in values if v is not None]
+
+
+def _check_keys(obj: dict[str, Any], handled: set[str], terms: set[str], where: str):
+    for key in obj.keys() - handled:
+        if key in terms or key.startswith('@') or ':' in key:
+            raise UnsupportedCityJSON(f"Unsupported property {key!r} in {where}")
+
+
+class _TripleWriter:
+    # Native implementation of data/cityjson-uplift.yml: walks the CityJSON document once, writing the triples
+    # that the JSON-LD uplift generates for it as N-Triples (which can be read as Turtle)
+
+    def __init__(self, f, file_idx: int, vertex_map: Sequence[int] | None = None):
+        self.f = f
+        self.base = cityjson.file_base_iri(file_idx)
+        self.file_idx = file_idx
+        # Index in the full document of each vertex, for the tiles of a sharded file (see app.tiling)
+        self.vertex_map = vertex_map
+        self.city = f"<{self.base}#city>"
+        self.lines: list[str] = []
+        self._bnode_prefix = f"_:u{uuid.uuid4().hex[:12]}b"
+        self._bnode_count = 0
+
+    def bnode(self) -> str:
+        self._bnode_count += 1
+        return f"{self._bnode_prefix}{self._bnode_count}"
+
+    def add(self, s: str, p: str, o: str):
+        self.lines.append(f"{s} {p} {o} .\n")
+
+    def flush(self):
+        self.f.write(''.join(self.lines))
+        self.lines.clear()
+
+    def iri(self, iri: str) -> str:
+        if IRI_UNSAFE.search(iri):
+            raise UnsupportedCityJSON(f"Unsupported IRI {iri!r}")
+        return f"<{iri}>"
+
+    def relative_iri(self, value: Any) -> str:
+        if not isinstance(value, str) or not RELATIVE_PATH.fullmatch(value) or value in ('.', '..'):
+            raise UnsupportedCityJSON(f"Unsupported reference {value!r}")
+        return self.iri(f"{self.base}{value}")
+
+    def vertex(self, idx: Any) -> str:
+        if not isinstance(idx, int) or isinstance(idx, bool):
+            raise UnsupportedCityJSON(f"Unsupported vertex index {idx!r}")
+        if self.vertex_map is not None:
+            idx = self.vertex_map[idx]
+        return f"<{self.base}#vertices-{idx}>"
+
+    def rdf_list(self, items: list[str]) -> str:
+        if not items:
+            return RDF_NIL
+        nodes = [self.bnode() for _ in items]
+        for i, (node, item) in enumerate(zip(nodes, items)):
+            self.add(node, RDF_FIRST, item)
+            self.add(node, RDF_REST, nodes[i + 1] if i + 1 < len(nodes) else RDF_NIL)
+        return nodes[0]
+
+    def boundaries(self, boundaries: Any) -> str:
+        if isinstance(boundaries, list):
+            return self.rdf_list([self.boundaries(b) for b in boundaries])
+        return self.vertex(boundaries)
+
+    def coords(self, subject: str, coords: Any):
+        if not isinstance(coords, list):
+            raise UnsupportedCityJSON(f"Unsupported coordinates {coords!r}")
+        for p, value in zip((CITY_X, CITY_Y, CITY_Z), coords):
+            if value is not None:
+                self.add(subject, p, _decimal(value))
+
+    def document(self, doc: dict[str, Any]):
+        if doc.get('type') != 'CityJSON':
+            raise UnsupportedCityJSON(f"Unsupported document type {doc.get('type')!r}")
+        _check_keys(doc, {'type', 'version', 'transform', 'metadata', 'CityObjects', 'vertices'},
+                    DOCUMENT_TERMS, 'document')
+        city = self.city
+        self.add(city, A, f"<{CITY}City>")
+        if doc.get('version') is not None:
+            if not isinstance(doc['version'], str):
+                raise UnsupportedCityJSON(f"Unsupported version {doc['version']!r}")
+            self.add(city, f"<{CITY}version>", _string(doc['version']))
+
+        transform = doc.get('transform')
+        if transform is not None:
+            if not isinstance(transform, dict) or 'scale' not in transform or 'translate' not in transform:
+                raise UnsupportedCityJSON('Unsupported transform')
+            _check_keys(transform, {'scale', 'translate'}, DOCUMENT_TERMS | {'scale', 'translate'}, 'transform')
+            node = self.bnode()
+            self.add(city, f"<{CITY}hasTransform>", node)
+            for key in ('scale', 'translate'):
+                coords_node = self.bnode()
+                self.add(node, f"<{CITY}{key}>", coords_node)
+                self.coords(coords_node, transform[key])
+
+        metadata = doc.get('metadata')
+        if metadata is not None:
+            if not isinstance(metadata, dict):
+                raise UnsupportedCityJSON('Unsupported metadata')
+            _check_keys(metadata, {'identifier', 'geographicalExtent'}, DOCUMENT_TERMS, 'metadata')
+            for identifier in _values(metadata.get('identifier')):
+                self.add(city, DCT_IDENTIFIER, _literal(identifier))
+            extent = metadata.get('geographicalExtent')
+            if extent:
+                if not isinstance(extent, list) or len(extent) != 6:
+                    raise UnsupportedCityJSON(f"Unsupported geographical extent {extent!r}")
+                node = self.bnode()
+                self.add(city, f"<{CITY}geographicalExtent>", node)
+                for key, coords in (('min', extent[0:3]), ('max', extent[3:6])):
+                    coords_node = self.bnode()
+                    self.add(node, f"<{CITY}{key}>", coords_node)
+                    self.coords(coords_node, coords)
+
+        city_objects = doc.get('CityObjects') or {}
+        if not isinstance(city_objects, dict):
+            raise UnsupportedCityJSON('Unsupported CityObjects')
+        for object_id, city_object in city_objects.items():
+            self.city_object(object_id, city_object)
+            if len(self.lines) > 100000:
+                self.flush()
+
+        for i, coords in enumerate(doc.get('vertices') or ()):
+            vertex = self.vertex(i)
+            self.add(city, f"<{CITY}hasVertex>", vertex)
+            self.coords(vertex, coords)
+            if len(self.lines) > 100000:
+                self.flush()
+        self.flush()
+
+    def city_object(self, object_id: str, city_object: Any):
+        if not isinstance(city_object, dict):
+            raise UnsupportedCityJSON(f"Unsupported city object {object_id}")
+        _check_keys(city_object, {'type', 'attributes', 'geometry', 'parents', 'children', 'geographicalExtent'},
+                    CITY_OBJECT_TERMS, f"city object {object_id}")
+        node = self.iri(cityjson.city_object_iri(self.file_idx, object_id))
+        self.add(self.city, f"<{CITY}hasObject>", node)
+        self.add(node, DCT_IDENTIFIER, _string(object_id))
+
+        object_type = city_object.get('type')
+        if object_type in CITY_OBJECT_TYPES:
+            self.add(node, A, f"<{CITY_OBJECT_TYPES[object_type]}>")
+        elif object_type is not None:
+            # Types not in the context are relative to the file base IRI
+            self.add(node, A, self.relative_iri(object_type))
+
+        attributes = city_object.get('attributes')
+        if attributes is not None:
+            if not isinstance(attributes, dict):
+                raise UnsupportedCityJSON(f"Unsupported attributes in city object {object_id}")
+            # Only the attributes defined in the context are uplifted
+            _check_keys(attributes, {'function', 'usage'}, CITY_OBJECT_TERMS, f"attributes of {object_id}")
+            for key, p in (('function', f"<{CITY}hasFunction>"), ('usage', f"<{CITY}hasUsage>")):
+                for value in _values(attributes.get(key)):
+                    self.add(node, p, _literal(value))
+
+        for parent in _values(city_object.get('parents')):
+            if not isinstance(parent, str):
+                raise UnsupportedCityJSON(f"Unsupported parent {parent!r} in city object {object_id}")
+            self.add(node, f"<{CITY}hasParent>", self.iri(f"{self.base}#:city-objects-{parent}"))
+        for child in _values(city_object.get('children')):
+            self.add(node, f"<{CITY}hasChild>", self.relative_iri(child))
+        for value in _values(city_object.get('geographicalExtent')):
+            self.add(node, f"<{CITY}geographicalExtent>", _literal(value))
+
+        geometries = city_object.get('geometry')
+        if geometries is not None:
+            if not isinstance(geometries, list):
+                raise UnsupportedCityJSON(f"Unsupported geometry in city object {object_id}")
+            for geometry in geometries:
+                self.geometry(node, geometry, object_id)
+
+    def geometry(self, city_object: str, geometry: Any, object_id: str):
+        if not isinstance(geometry, dict) or geometry.get('type') not in GEOMETRY_TYPES:
+            raise UnsupportedCityJSON(f"Unsupported geometry in city object {object_id}")
+        node = self.bnode()
+        self.add(city_object, f"<{CITY}hasGeometry>", node)
+
+        lod = geometry.get('lod')
+        if lod is None or isinstance(lod, str) or (isinstance(lod, int) and not isinstance(lod, bool)):
+            self.add(node, f"<{CITY}lod>", _string('null' if lod is None else str(lod)))
+        else:
+            raise UnsupportedCityJSON(f"Unsupported LoD {lod!r} in city object {object_id}")
+
+        geometry_type = GEOMETRY_TYPES[geometry['type']]
+        boundaries = geometry.get('boundaries')
+        semantics = geometry.get('semantics')
+        if semantics is not None and not isinstance(semantics, dict):
+            raise UnsupportedCityJSON(f"Unsupported semantics in city object {object_id}")
+        surfaces = semantics.get('surfaces') if semantics else None
+        if surfaces is None or surfaces is False:
+            surface = self.bnode()
+            self.add(node, f"<{CITY}hasSurface>", surface)
+            self.add(surface, A, f"<{geometry_type}>")
+            self.add(surface, f"<{CITY}boundaries>", self.boundaries(boundaries if boundaries is not None else []))
+            return
+
+        values = semantics.get('values')
+        if not isinstance(surfaces, list) or not isinstance(values, (list, type(None))) \
+                or not isinstance(boundaries, list):
+            raise UnsupportedCityJSON(f"Unsupported semantics in city object {object_id}")
+        for idx, surface_def in enumerate(surfaces):
+            if not isinstance(surface_def, dict):
+                raise UnsupportedCityJSON(f"Unsupported semantic surface in city object {object_id}")
+            # Only the top-level boundaries with this semantic surface
+            selected = [i for i, value in enumerate(values or ()) if _is_number(value) and value == idx]
+            if any(i >= len(boundaries) for i in selected):
+                raise UnsupportedCityJSON(f"Unsupported semantics in city object {object_id}")
+            surface = self.bnode()
+            self.add(node, f"<{CITY}hasSurface>", surface)
+            self.add(surface, A, f"<{geometry_type}>")
+            self.add(surface, f"<{CITY}boundaries>", self.rdf_list([self.boundaries(boundaries[i]) for i in selected]))
+            self.semantic_surface(surface, surface_def, object_id)
+
+    def semantic_surface(self, surface: str, surface_def: dict[str, Any], object_id: str):
+        _check_keys(surface_def, {'type', 'children', 'parents'}, SURFACE_TERMS,
+                    f"semantic surface of {object_id}")
+        surface_type = surface_def.get('type')
+        if surface_type:
+            if surface_type not in SURFACE_TYPES:
+                raise UnsupportedCityJSON(f"Unsupported semantic surface type {surface_type!r}")
+            self.add(surface, A, f"<{SURFACE_TYPES[surface_type]}>")
+        for key, p in (('children', f"<{CITY}hasChild>"), ('parents', f"<{CITY}hasParent>")):
+            for value in _values(surface_def.get(key)):
+                self.add(surface, p, self.relative_iri(value) if isinstance(value, str) else _literal(value))
+        # Other properties of semantic surfaces use the attr: vocabulary
+        for key, value in surface_def.items():
+            if key in ('type', 'children', 'parents'):
+                continue
+            if not ATTRIBUTE_NAME.fullmatch(key):
+                raise UnsupportedCityJSON(f"Unsupported property {key!r} in semantic surface of {object_id}")
+            for v in _values(value):
+                self.add(surface, f"<{ATTR}{key}>", _literal(v))
+
+
+def convert(path: Path, ttl_file: Path, file_idx: int, vertex_map: Sequence[int] | None = None):
+    # Raises UnsupportedCityJSON for documents that the native uplift does not convert exactly as the
+    # JSON-LD uplift would, which should be uplifted with uplift_with_ogc_na() instead. Vertex IRIs are
+    # those of vertex_map[i] instead of i, if given
+    doc = cityjson.load(path)
+    if not isinstance(doc, dict):
+        raise UnsupportedCityJSON('Not a CityJSON document')
+    try:
+        with open(ttl_file, 'w', encoding='utf-8') as f:
+            _TripleWriter(f, file_idx, vertex_map).document(doc)
+    except BaseException:
+        ttl_file.unlink(missing_ok=True)
+        raise
+
+
+def uplift_with_ogc_na(path: Path, ttl_file: Path, file_idx: int):
+    subprocess_result = limits.run(
+        'Uplift',
+        [
+            'python3',
+            '-m',
+            'ogc.na.ingest_json',
+            '--transform-arg',
+            f'file_idx={file_idx}',
+            '--no-provenance',
+            '--ttl',
+            '--ttl-file',
+            str(ttl_file),
+            '--context',
+            UPLIFT_DEFINITION,
+            str(path),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    if subprocess_result.returncode:
+        print(subprocess_result.stdout, file=sys.stderr)
+        raise Exception(f"Error converting input file {file_idx} to RDF")
+
+
+def _normalized(graph: 'Graph') -> 'Graph':
+    # Numeric literals are compared by value, since their lexical form depends on how the JSON-LD
+    # uplift converts JSON numbers
+    from rdflib import Graph, Literal, URIRef
+    decimal, double = URIRef(f"{XSD}decimal"), URIRef(f"{XSD}double")
+    normalized = Graph()
+    for s, p, o in graph:
+        if isinstance(o, Literal) and o.datatype == decimal:
+            o = Literal(format(Decimal(str(o)).normalize(), 'f'), datatype=decimal, normalize=False)
+        elif isinstance(o, Literal) and o.datatype == double:
+            o = Literal(repr(float(str(o))), datatype=double, normalize=False)
+        normalized.add((s, p, o))
+    return normalized
+
+
+def compare(native: 'Graph', reference: 'Graph') -> list[str]:
+    from rdflib.compare import graph_diff, to_isomorphic
+    native_iso, reference_iso = to_isomorphic(_normalized(native)), to_isomorphic(_normalized(reference))
+    if native_iso == reference_iso:
+        return []
+    _, only_native, only_reference = graph_diff(native_iso, reference_iso)
+    differences = [f"only in native output: {' '.join(term.n3() for term in triple)}"
+                   for triple in sorted(only_native)]
+    differences.extend(f"only in reference output: {' '.join(term.n3() for term in triple)}"
+                       for triple in sorted(only_reference))
+    return differences or ['graphs are not isomorphic']
+
+
+def _main():
+    import argparse
+    from rdflib import Graph
+    parser = argparse.ArgumentParser(description='Uplift CityJSON to RDF, optionally comparing the output '
+                                                 'with that of the JSON-LD uplift (ogc-na)')
+    parser.add_argument('input', nargs='+', help='CityJSON input files')
+    parser.add_argument('--compare', action='store_true', help='Compare with ogc-na output')
+    parser.add_argument('--file-idx', type=int, default=0, help='Input file index used in IRIs')
+    args = parser.parse_args()
+
+    failed = False
+    for input_fn in args.input:
+        input_path = Path(input_fn)
+        if not args.compare:
+            convert(input_path, input_path.with_name(input_path.stem + '-uplift.ttl'), args.file_idx)
+            continue
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            native_path, reference_path = Path(tmp_dir, 'native.ttl'), Path(tmp_dir, 'reference.ttl')
+            try:
+                convert(input_path, native_path, args.file_idx)
+            except UnsupportedCityJSON as e:
+                print(f"{input_fn}: not supported by the native uplift ({e})")
+                continue
+            uplift_with_ogc_na(input_path, reference_path, args.file_idx)
+            differences = compare(Graph().parse(native_path, format='turtle'),
+                                  Graph().parse(reference_path, format='turtle'))
+        for difference in differences[:50]:
+            print(f"{input_fn}: {difference}")
+        if len(differences) > 50:
+            print(f"{input_fn}: ... {len(differences) - 50} more differences")
+        if not differences:
+            print(f"{input_fn}: OK")
+        failed = failed or bool(differences)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    _main()
@@ -1,7 +1,13 @@
+import dataclasses
+import hashlib
+import os
 import re
+import shutil
 from pathlib import Path
 from typing import Any
 
+from pydantic import BaseModel
+
 
 def is_xml(s: str) -> bool:
     return re.match(r'\s*<', s) is not None
@@ -15,6 +21,25 @@ def concat_files(input_files: list[str | Path], output_file: str | Path):
                     o.write(chunk)
 
 
+def link_or_copy(src: str | Path, dst: str | Path) -> Path:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return Path(dst)
+
+
+def dir_size(path: str | Path) -> int:
+    total = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                total += dir_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
 def match_media_type(a: list[str], b: list[str]):
     return (a[0] == '*' or b[0] == '*' or a[0] == b[0]) and (a[1] == '*' or b[1] == '*' or a[1] == b[1])
 
@@ -50,3 +75,31 @@ def match_accept_header(header: str, options: list[str], def_value=None) -> str:
                 return '/'.join(option)
 
     return def_value
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedContent:
+    content: bytes
+    etag: str
+
+    @classmethod
+    def from_bytes(cls, content: bytes) -> 'CachedContent':
+        return cls(content=content, etag=make_etag(content))
+
+    @classmethod
+    def from_model(cls, m: BaseModel) -> 'CachedContent':
+        return cls.from_bytes(m.model_dump_json(by_alias=True, exclude_unset=True).encode('utf-8'))
+
+
+def make_etag(content: bytes) -> str:
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*' or candidate.removeprefix('W/') == etag:
+            return True
+    return False
@@ -0,0 +1,48 @@
+from collections import Counter
+from typing import Any, Iterable
+
+import orjson
+
+
+def _collect_error_codes(value, codes: set):
+    if isinstance(value, dict):
+        if isinstance(value.get('code'), int):
+            codes.add(value['code'])
+        for v in value.values():
+            _collect_error_codes(v, codes)
+    elif isinstance(value, list):
+        for v in value:
+            _collect_error_codes(v, codes)
+
+
+def merge_reports(reports: list[dict[str, Any]], features: Iterable[dict[str, Any]] = (),
+                  object_order: dict[str, int] | None = None) -> dict[str, Any]:
+    # Combines reports for disjoint sets of city objects (plus, optionally, already known features)
+    # into a single report, recomputing the overall validity and overviews
+    features = list(features)
+    dataset_errors = {}
+    for report in reports:
+        features.extend(report.get('features') or ())
+        for error in report.get('dataset_errors') or ():
+            dataset_errors.setdefault(orjson.dumps(error, option=orjson.OPT_SORT_KEYS), error)
+    if object_order:
+        features.sort(key=lambda f: object_order.get(f.get('id'), len(object_order)))
+
+    totals, valid = Counter(), Counter()
+    for feature in features:
+        totals[feature.get('type')] += 1
+        if feature.get('validity', True):
+            valid[feature.get('type')] += 1
+
+    merged = dict(reports[0])
+    merged['features'] = features
+    merged['features_overview'] = [{'type': t, 'total': n, 'valid': valid[t]} for t, n in totals.items()]
+    merged['validity'] = all(f.get('validity', True) for f in features) and not dataset_errors
+    if 'dataset_errors' in merged:
+        merged['dataset_errors'] = list(dataset_errors.values())
+    if 'all_errors' in merged:
+        codes = set()
+        _collect_error_codes(features, codes)
+        _collect_error_codes(merged.get('dataset_errors'), codes)
+        merged['all_errors'] = sorted(codes)
+    return merged
@@ -0,0 +1,231 @@
+import dataclasses
+import heapq
+import http.client
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from app import model
+from app.config import settings
+from app.jobs import Job, JobSummary, job_executor, status_info
+
+logger = logging.getLogger('uvicorn.error')
+
+RESULTS_REL = 'http://www.opengis.net/def/rel/ogc/1.0/results'
+# Responses after which a delivery is retried; other errors are not expected to go away
+RETRY_STATUSES = (408, 425, 429)
+
+
+@dataclasses.dataclass(slots=True)
+class Subscription:
+    subscriber: model.Subscriber
+    job_url: str
+    results_url: str
+
+
+@dataclasses.dataclass(slots=True)
+class Notification:
+    job_id: str
+    url: str
+    body: bytes
+    final: bool
+    attempts: int = 0
+
+
+@dataclasses.dataclass(slots=True)
+class Host:
+    # Notifications due for delivery to a (scheme, host, port), sent in order by one pool thread at a time
+    key: tuple[str, str, int | None]
+    pending: deque[Notification] = dataclasses.field(default_factory=deque)
+    active: bool = False
+    connection: http.client.HTTPConnection | None = None
+    last_used: float = 0
+
+
+class WebhookDispatcher:
+    # Delivers the status of jobs to the callback URIs of their subscriber (inProgressUri when they start,
+    # successUri or failedUri when they finish) in the background, so that clients do not need to poll for it.
+    # Notifications wait in a bounded outbox (the oldest are dropped when it is full), and failed deliveries
+    # are retried with exponential backoff. Due notifications are delivered by a small pool of threads, one
+    # host at a time per thread, so that a slow host does not hold back the notifications to other hosts.
+    # Connections are kept open and reused for following notifications to the same host until they are idle
+    # for webhook_idle_timeout seconds
+
+    def __init__(self):
+        self.subscriptions: dict[str, Subscription] = {}
+        # (due time, sequence, notification)
+        self._outbox: list[tuple[float, int, Notification]] = []
+        self._seq = itertools.count()
+        self._hosts: dict[tuple[str, str, int | None], Host] = {}
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread: threading.Thread | None = None
+        self._executor: ThreadPoolExecutor | None = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop = False
+        self._executor = ThreadPoolExecutor(max_workers=max(1, settings.webhook_workers),
+                                            thread_name_prefix='webhooks')
+        self._thread = threading.Thread(target=self._run, name='webhooks', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            with self._cond:
+                self._stop = True
+                self._cond.notify()
+            self._thread.join()
+            self._thread = None
+            self._executor.shutdown()
+            self._executor = None
+        for host in self._hosts.values():
+            if host.connection:
+                host.connection.close()
+        self._hosts.clear()
+
+    def subscribe(self, job_id: str, subscriber: model.Subscriber, job_url: str, results_url: str):
+        if subscriber.successUri or subscriber.inProgressUri or subscriber.failedUri:
+            with self._cond:
+                self.subscriptions[job_id] = Subscription(subscriber, job_url, results_url)
+
+    def job_updated(self, job: Job | JobSummary):
+        with self._cond:
+            subscription = self.subscriptions.get(job.job_id)
+            if not subscription:
+                return
+            final = job.status not in (model.StatusCode.accepted, model.StatusCode.running)
+            if final:
+                del self.subscriptions[job.job_id]
+        if job.status == model.StatusCode.running:
+            url = subscription.subscriber.inProgressUri
+        elif job.status == model.StatusCode.successful:
+            url = subscription.subscriber.successUri
+        elif final:
+            url = subscription.subscriber.failedUri
+        else:
+            url = None
+        if not url:
+            return
+
+        info = status_info(job)
+        info.links = [model.Link(href=subscription.job_url, rel='self', type='application/json')]
+        if job.status == model.StatusCode.successful:
+            info.links.append(model.Link(href=subscription.results_url, rel=RESULTS_REL, type='application/json'))
+        self.enqueue(Notification(job.job_id, str(url), info.model_dump_json(exclude_none=True).encode(), final))
+
+    def enqueue(self, notification: Notification, delay: float = 0):
+        with self._cond:
+            if notification.final and not notification.attempts:
+                # Pending (e.g., retried) in-progress notifications would arrive after the final one
+                self._outbox = [item for item in self._outbox
+                                if item[2].job_id != notification.job_id or item[2].final]
+                heapq.heapify(self._outbox)
+                for host in self._hosts.values():
+                    host.pending = deque(n for n in host.pending if n.job_id != notification.job_id or n.final)
+            if len(self._outbox) >= max(1, settings.webhook_outbox_size):
+                dropped = min(self._outbox, key=lambda item: item[1])
+                self._outbox.remove(dropped)
+                heapq.heapify(self._outbox)
+                logger.warning(f'Webhook outbox full, dropping notification of job {dropped[2].job_id} '
+                               f'to {dropped[2].url}')
+            heapq.heappush(self._outbox, (time.monotonic() + delay, next(self._seq), notification))
+            self._cond.notify()
+
+    def _run(self):
+        # Hands due notifications over to the pool and closes idle connections
+        while True:
+            with self._cond:
+                while not self._stop and (not self._outbox or self._outbox[0][0] > time.monotonic()):
+                    self._close_idle()
+                    timeout = settings.webhook_idle_timeout
+                    if self._outbox:
+                        timeout = min(timeout, self._outbox[0][0] - time.monotonic())
+                    self._cond.wait(max(0.0, timeout))
+                if self._stop:
+                    return
+                _, _, notification = heapq.heappop(self._outbox)
+                parts = urlsplit(notification.url)
+                key = (parts.scheme, parts.hostname, parts.port)
+                host = self._hosts.get(key)
+                if host is None:
+                    host = self._hosts[key] = Host(key)
+                host.pending.append(notification)
+                if not host.active:
+                    host.active = True
+                    self._executor.submit(self._deliver_host, host)
+
+    def _close_idle(self):
+        # Called with the lock held
+        now = time.monotonic()
+        for key, host in list(self._hosts.items()):
+            if not host.active and not host.pending and now - host.last_used >= settings.webhook_idle_timeout:
+                if host.connection:
+                    host.connection.close()
+                del self._hosts[key]
+
+    def _deliver_host(self, host: Host):
+        while True:
+            with self._cond:
+                if self._stop or not host.pending:
+                    host.active = False
+                    host.last_used = time.monotonic()
+                    return
+                notification = host.pending.popleft()
+            try:
+                self._deliver(host, notification)
+            except Exception as e:
+                logger.error(f'Error delivering webhook for job {notification.job_id} to {notification.url}: {e}')
+
+    @staticmethod
+    def _connection(host: Host) -> http.client.HTTPConnection:
+        if host.connection is None:
+            scheme, hostname, port = host.key
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            host.connection = connection_class(hostname, port, timeout=settings.webhook_timeout)
+        return host.connection
+
+    def _deliver(self, host: Host, notification: Notification):
+        notification.attempts += 1
+        parts = urlsplit(notification.url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        connection = self._connection(host)
+        error = None
+        for retry in (True, False):
+            try:
+                connection.request('POST', path, body=notification.body,
+                                   headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.will_close:
+                    connection.close()
+                if response.status < 300:
+                    return
+                error = f'HTTP {response.status}'
+                if response.status < 500 and response.status not in RETRY_STATUSES:
+                    logger.warning(f'Webhook for job {notification.job_id} to {notification.url} rejected: {error}')
+                    return
+                break
+            except (OSError, http.client.HTTPException) as e:
+                # A kept-alive connection may have been closed by the server, try once more on a new one
+                connection.close()
+                error = str(e) or e.__class__.__name__
+                if not retry:
+                    break
+
+        if notification.attempts >= settings.webhook_max_attempts:
+            logger.warning(f'Giving up webhook for job {notification.job_id} to {notification.url} '
+                           f'after {notification.attempts} attempt(s): {error}')
+            return
+        self.enqueue(notification, settings.webhook_retry_delay * 2 ** (notification.attempts - 1))
+
+
+dispatcher = WebhookDispatcher()
+job_executor.add_listener(dispatcher.job_updated)
@@ -0,0 +1,154 @@
+import argparse
+import logging
+import os
+import shutil
+import socket
+import threading
+import uuid
+from pathlib import Path
+
+import orjson
+
+from app import model
+from app.config import settings
+from app.distributed import pack_result
+from app.jobs import Job
+from app.profiles import ProfileLoader
+from app.taskqueue import SqliteQueue, Task, TcpQueue, open_queue, serve
+
+logger = logging.getLogger('uvicorn.error')
+
+
+class Worker:
+    # Runs jobs leased from the job queue, extending the lease with heartbeats while a job runs. If the worker
+    # dies, the lease expires and the job is given to another worker
+
+    def __init__(self, queue: SqliteQueue | TcpQueue, profile_loader: ProfileLoader, worker_id: str | None = None):
+        self.queue = queue
+        self.profile_loader = profile_loader
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def run(self, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                task = self.queue.lease(self.worker_id, settings.job_lease_time)
+            except Exception as e:
+                logger.error(f'Error leasing a job: {e}')
+                task = None
+            if task:
+                self.process(task)
+            else:
+                stop.wait(settings.job_queue_poll_interval)
+
+    def _heartbeat(self, task: Task, done: threading.Event):
+        while not done.wait(settings.job_heartbeat_interval):
+            try:
+                if not self.queue.heartbeat(task.task_id, self.worker_id, settings.job_lease_time):
+                    logger.warning(f'Lost the lease of job {task.task_id}')
+                    return
+            except Exception as e:
+                logger.warning(f'Error sending heartbeat for job {task.task_id}: {e}')
+
+    def _run_job(self, task: Task, wd: Path) -> Job:
+        payload = orjson.loads(task.payload)
+        profiles = [self.profile_loader.profiles.get(profile_id) for profile_id in payload['profiles']]
+        missing = [profile_id for profile_id, profile in zip(payload['profiles'], profiles) if not profile]
+        if missing:
+            # Other workers may have a more recent version of the profile catalogue
+            raise ValueError(f"Profile(s) not found: {', '.join(missing)}")
+        shutil.rmtree(wd, ignore_errors=True)
+        job = Job(payload['jobId'], profiles,
+                  city_files=[model.InputFile(**city_file) for city_file in payload['cityFiles']],
+                  parameters=payload['parameters'],
+                  profile_loader=self.profile_loader,
+                  wd=wd,
+                  profiling=payload.get('profiling', False),
+                  fail_fast=payload.get('failFast', False))
+        job.execute_sync()
+        return job
+
+    def process(self, task: Task):
+        logger.info(f'Running job {task.task_id} (attempt {task.attempt})')
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task, done), daemon=True)
+        heartbeat.start()
+        wd = Path(settings.temp_dir, 'worker', f"{task.task_id}-{task.attempt}")
+        result = error = None
+        try:
+            result = pack_result(self._run_job(task, wd))
+        except Exception as e:
+            logger.exception(f'Error running job {task.task_id}')
+            error = str(e)
+        finally:
+            done.set()
+            heartbeat.join()
+            shutil.rmtree(wd, ignore_errors=True)
+
+        if result is None:
+            self.queue.release(task.task_id, self.worker_id, error)
+        elif not self.queue.complete(task.task_id, self.worker_id, result):
+            logger.warning(f'Discarding the results of job {task.task_id}, whose lease was lost')
+
+
+def run_workers(queue_url: str, threads: int):
+    queue = open_queue(queue_url, settings.job_queue_token)
+    profile_loader = ProfileLoader(settings.data_source,
+                                   Path(settings.temp_dir, 'catalogue') if settings.catalogue_snapshot else None)
+    stop = threading.Event()
+    workers = [threading.Thread(target=Worker(queue, profile_loader).run, args=(stop,), daemon=True)
+               for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(1)
+    except KeyboardInterrupt:
+        # Running jobs are abandoned, and will be retried by other workers when their leases expire
+        stop.set()
+    profile_loader.close()
+    queue.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m app.worker',
+                                     description='Runs validation jobs from a job queue, '
+                                                 'or serves a job queue to workers on other hosts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    worker_parser = subparsers.add_parser('run', help='Run jobs from the job queue')
+    worker_parser.add_argument('--queue', default=settings.job_queue,
+                               help='Job queue (sqlite://<path> or tcp://<host>:<port>), '
+                                    'defaults to the JOB_QUEUE setting')
+    worker_parser.add_argument('--threads', type=int, default=1, help='Number of jobs to run concurrently')
+
+    broker_parser = subparsers.add_parser('broker', help='Serve a job queue over TCP')
+    broker_parser.add_argument('--db', default=str(Path(settings.temp_dir, 'queue.db')),
+                               help='Path to the SQLite queue database')
+    broker_parser.add_argument('--host', default='127.0.0.1',
+                               help='Address to listen on (use 0.0.0.0 for workers on other hosts)')
+    broker_parser.add_argument('--port', type=int, default=7070)
+    broker_parser.add_argument('--token', default=settings.job_queue_token,
+                               help='Token that workers and the API authenticate with, '
+                                    'defaults to the JOB_QUEUE_TOKEN setting')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.command == 'broker':
+        if not args.token:
+            parser.error('A token is required (--token or JOB_QUEUE_TOKEN)')
+        Path(args.db).parent.mkdir(parents=True, exist_ok=True)
+        logger.info(f'Serving job queue {args.db} on {args.host}:{args.port}')
+        try:
+            serve(SqliteQueue(args.db), args.host, args.port, args.token)
+        except KeyboardInterrupt:
+            pass
+    else:
+        if not args.queue:
+            parser.error('A job queue is required (--queue or JOB_QUEUE)')
+        run_workers(args.queue, args.threads)
+
+
+if __name__ == '__main__':
+    main()
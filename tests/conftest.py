@@ -0,0 +1,63 @@
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import settings
+from app.loadtest.standins import write_standins
+from app.main import app
+from app.profiles import ProfileLoader
+
+ROOT_DIR = Path(__file__).parent.parent
+
+# Test profile catalogue, relative to the root of the repository
+PROFILES = 'tests/data/profiles/*.ttl'
+
+
+@pytest.fixture(autouse=True)
+def temp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'temp_dir', str(tmp_path / 'tmp'))
+    return tmp_path / 'tmp'
+
+
+@pytest.fixture
+def standins(tmp_path, monkeypatch):
+    # val3dity and citygml-tools stand-ins (see app.loadtest)
+    paths = write_standins(tmp_path / 'standins')
+    for setting, path in paths.items():
+        monkeypatch.setattr(settings, setting, str(path))
+    return paths
+
+
+@pytest.fixture(scope='session')
+def profile_loader():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(ROOT_DIR)
+        loader = ProfileLoader(PROFILES)
+    yield loader
+    loader.close()
+
+
+@pytest.fixture
+def client(profile_loader, monkeypatch):
+    monkeypatch.setattr(app, 'profile_loader', profile_loader)
+    return TestClient(app)
+
+
+@pytest.fixture
+def execute(client, standins):
+    # Runs a validation job and waits for it to finish
+    def execute(process_id: str, *data: str, query: str = '', **inputs) -> str:
+        if data:
+            inputs['cityFiles'] = [{'name': f"file{i}.json", 'data_str': d} for i, d in enumerate(data)]
+        response = client.post(f"/processes/{process_id}/execution{query}", json={'inputs': inputs})
+        assert response.status_code == 201, response.text
+        job_id = response.json()['jobID']
+        deadline = time.monotonic() + 60
+        while client.get(f"/jobs/{job_id}").json()['status'] in ('accepted', 'running'):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        return job_id
+
+    return execute
@@ -0,0 +1,50 @@
+<?xml version="1.0" encoding="UTF-8"?>
+<core:CityModel xmlns:core="http://www.opengis.net/citygml/2.0" xmlns:bldg="http://www.opengis.net/citygml/building/2.0"
+  xmlns:tran="http://www.opengis.net/citygml/transportation/2.0" xmlns:luse="http://www.opengis.net/citygml/landuse/2.0"
+  xmlns:gen="http://www.opengis.net/citygml/generics/2.0" xmlns:gml="http://www.opengis.net/gml" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <gml:boundedBy><gml:Envelope srsName="urn:ogc:def:crs,crs:EPSG::25833,crs:EPSG::5783" srsDimension="3">
+    <gml:lowerCorner>100 200 0</gml:lowerCorner><gml:upperCorner>110 210 10</gml:upperCorner></gml:Envelope></gml:boundedBy>
+  <core:cityObjectMember>
+    <bldg:Building gml:id="B1">
+      <gml:name>House</gml:name>
+      <gen:stringAttribute name="owner"><gen:value>Ann</gen:value></gen:stringAttribute>
+      <gen:doubleAttribute name="area"><gen:value>12.5</gen:value></gen:doubleAttribute>
+      <bldg:function>1000</bldg:function>
+      <bldg:measuredHeight uom="m">3.0</bldg:measuredHeight>
+      <bldg:storeysAboveGround>1</bldg:storeysAboveGround>
+      <bldg:lod2Solid><gml:Solid><gml:exterior><gml:CompositeSurface>
+        <gml:surfaceMember xlink:href="#g"/><gml:surfaceMember xlink:href="#r"/>
+        <gml:surfaceMember xlink:href="#w1"/><gml:surfaceMember xlink:href="#w2"/>
+        <gml:surfaceMember xlink:href="#w3"/><gml:surfaceMember xlink:href="#w4"/>
+      </gml:CompositeSurface></gml:exterior></gml:Solid></bldg:lod2Solid>
+      <bldg:boundedBy><bldg:GroundSurface><bldg:lod2MultiSurface><gml:MultiSurface><gml:surfaceMember>
+        <gml:Polygon gml:id="g"><gml:exterior><gml:LinearRing><gml:posList srsDimension="3">100 200 0 100 210 0 110 210 0 110 200 0 100 200 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon>
+      </gml:surfaceMember></gml:MultiSurface></bldg:lod2MultiSurface></bldg:GroundSurface></bldg:boundedBy>
+      <bldg:boundedBy><bldg:RoofSurface><bldg:lod2MultiSurface><gml:MultiSurface><gml:surfaceMember>
+        <gml:Polygon gml:id="r"><gml:exterior><gml:LinearRing><gml:posList>100 200 3 110 200 3 110 210 3 100 210 3 100 200 3</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon>
+      </gml:surfaceMember></gml:MultiSurface></bldg:lod2MultiSurface></bldg:RoofSurface></bldg:boundedBy>
+      <bldg:boundedBy><bldg:WallSurface><bldg:lod2MultiSurface><gml:MultiSurface>
+        <gml:surfaceMember><gml:Polygon gml:id="w1"><gml:exterior><gml:LinearRing><gml:posList>100 200 0 110 200 0 110 200 3 100 200 3 100 200 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember>
+        <gml:surfaceMember><gml:Polygon gml:id="w2"><gml:exterior><gml:LinearRing><gml:posList>110 200 0 110 210 0 110 210 3 110 200 3 110 200 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember>
+        <gml:surfaceMember><gml:Polygon gml:id="w3"><gml:exterior><gml:LinearRing><gml:posList>110 210 0 100 210 0 100 210 3 110 210 3 110 210 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember>
+        <gml:surfaceMember><gml:Polygon gml:id="w4"><gml:exterior><gml:LinearRing><gml:posList>100 210 0 100 200 0 100 200 3 100 210 3 100 210 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember>
+      </gml:MultiSurface></bldg:lod2MultiSurface></bldg:WallSurface></bldg:boundedBy>
+      <bldg:consistsOfBuildingPart><bldg:BuildingPart gml:id="B1P1">
+        <bldg:lod1Solid><gml:Solid><gml:exterior><gml:CompositeSurface>
+          <gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing><gml:pos>100 200 0</gml:pos><gml:pos>100 210 0</gml:pos><gml:pos>110 210 0</gml:pos><gml:pos>100 200 0</gml:pos></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember>
+        </gml:CompositeSurface></gml:exterior></gml:Solid></bldg:lod1Solid>
+      </bldg:BuildingPart></bldg:consistsOfBuildingPart>
+    </bldg:Building>
+  </core:cityObjectMember>
+  <core:cityObjectMember>
+    <tran:Road gml:id="R1"><tran:function>1</tran:function>
+      <tran:lod1MultiSurface><gml:MultiSurface><gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing><gml:posList>90 190 0 95 190 0 95 199 0 90 190 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember></gml:MultiSurface></tran:lod1MultiSurface>
+      <tran:trafficArea><tran:TrafficArea><tran:lod2MultiSurface><gml:MultiSurface><gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing><gml:posList>90 190 0 95 190 0 95 199 0 90 190 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember></gml:MultiSurface></tran:lod2MultiSurface></tran:TrafficArea></tran:trafficArea>
+    </tran:Road>
+  </core:cityObjectMember>
+  <core:cityObjectMember>
+    <luse:LandUse gml:id="L1"><luse:class>1010</luse:class>
+      <luse:lod1MultiSurface><gml:MultiSurface><gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing><gml:posList>80 180 0 85 180 0 85 189 0 80 180 0</gml:posList></gml:LinearRing></gml:exterior><gml:interior><gml:LinearRing><gml:posList>81 181 0 82 181 0 82 182 0 81 181 0</gml:posList></gml:LinearRing></gml:interior></gml:Polygon></gml:surfaceMember></gml:MultiSurface></luse:lod1MultiSurface>
+    </luse:LandUse>
+  </core:cityObjectMember>
+</core:CityModel>
@@ -0,0 +1,13 @@
+<?xml version="1.0" encoding="UTF-8"?>
+<CityModel xmlns="http://www.opengis.net/citygml/3.0" xmlns:bldg="http://www.opengis.net/citygml/building/3.0"
+  xmlns:con="http://www.opengis.net/citygml/construction/3.0" xmlns:gen="http://www.opengis.net/citygml/generics/3.0"
+  xmlns:gml="http://www.opengis.net/gml/3.2">
+  <cityObjectMember>
+    <bldg:Building gml:id="B3">
+      <genericAttribute><gen:IntAttribute><gen:name>floors</gen:name><gen:value>2</gen:value></gen:IntAttribute></genericAttribute>
+      <boundary><con:WallSurface gml:id="ws"><lod2MultiSurface><gml:MultiSurface><gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing><gml:posList>0 0 0 1 0 0 1 0 1 0 0 0</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember></gml:MultiSurface></lod2MultiSurface></con:WallSurface></boundary>
+      <boundary><con:RoofSurface><lod2MultiSurface><gml:MultiSurface><gml:surfaceMember><gml:Polygon><gml:exterior><gml:LinearRing><gml:posList>0 0 1 1 0 1 1 1 1 0 0 1</gml:posList></gml:LinearRing></gml:exterior></gml:Polygon></gml:surfaceMember></gml:MultiSurface></lod2MultiSurface></con:RoofSurface></boundary>
+      <bldg:roofType>1000</bldg:roofType>
+    </bldg:Building>
+  </cityObjectMember>
+</CityModel>
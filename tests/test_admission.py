@@ -0,0 +1,89 @@
+import threading
+from pathlib import Path
+
+import orjson
+
+from app import admission, main
+from app.admission import AdmissionController, JobCost
+from app.config import settings
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+def test_scan():
+    data = (DATA_DIR / 'cityjson-buildings.json').read_text()
+    doc = orjson.loads(data)
+    assert admission.scan(data) == JobCost(len(data), len(doc['CityObjects']), len(doc['vertices']))
+    assert admission.scan('{"type": "CityJSON", "CityObjects": {}, "vertices": []}').vertices == 0
+
+    data = (DATA_DIR / 'citygml2.gml').read_text()
+    cost = admission.scan(data)
+    assert cost.bytes == len(data)
+    assert cost.city_objects == data.count('<core:cityObjectMember')
+    assert cost.vertices > 0
+
+
+def test_exceeds():
+    cost = JobCost(100, 10, 1000)
+    assert cost.exceeds(JobCost()) == []
+    assert cost.exceeds(JobCost(bytes=50, vertices=1000)) == ['bytes']
+    assert cost.exceeds(JobCost(city_objects=5, vertices=10)) == ['city_objects', 'vertices']
+    assert cost + cost - cost == cost
+
+
+def test_controller(monkeypatch):
+    monkeypatch.setattr(settings, 'admission_budget_bytes', 10)
+    monkeypatch.setattr(settings, 'admission_max_queued', 2)
+    controller = AdmissionController()
+    started = {name: threading.Event() for name in 'abcd'}
+    finish = {name: threading.Event() for name in 'abcd'}
+
+    def work(name):
+        def fn():
+            started[name].set()
+            assert finish[name].wait(10)
+        return fn
+
+    # Work that does not fit in the budget waits, in order, for running work to finish
+    controller.submit(JobCost(bytes=6), work('a'))
+    controller.submit(JobCost(bytes=6), work('b'))
+    controller.submit(JobCost(bytes=2), work('c'))
+    assert started['a'].wait(5)
+    assert not started['b'].is_set() and not started['c'].is_set()
+    assert controller.is_full
+
+    finish['a'].set()
+    assert started['b'].wait(5) and started['c'].wait(5)
+    assert not controller.is_full
+
+    # Work above the budget on its own runs once nothing else does
+    controller.submit(JobCost(bytes=20), work('d'))
+    assert not started['d'].wait(0.1)
+    finish['b'].set()
+    finish['c'].set()
+    assert started['d'].wait(5)
+    finish['d'].set()
+
+
+def test_input_too_large(client, monkeypatch):
+    data = (DATA_DIR / 'cityjson-buildings.json').read_text()
+    monkeypatch.setattr(settings, 'max_job_city_objects', 5)
+    response = client.post('/processes/test-roads-present/execution',
+                           json={'inputs': {'cityFiles': [{'name': 'file.json', 'data_str': data}]}})
+    assert response.status_code == 413
+    assert response.json()['detail']['type'] == 'InputTooLarge'
+    assert 'city objects' in response.json()['detail']['detail']
+
+
+def test_server_busy(client, monkeypatch):
+    data = (DATA_DIR / 'cityjson-buildings.json').read_text()
+    controller = AdmissionController()
+    controller.queue.append((JobCost(), lambda: None))
+    monkeypatch.setattr(main, 'admission_controller', controller)
+    monkeypatch.setattr(settings, 'admission_max_queued', 1)
+    for path, body in (('/processes/test-roads-present/execution',
+                        {'inputs': {'cityFiles': [{'name': 'file.json', 'data_str': data}]}}),
+                       ('/datasets', {'cityFiles': [{'name': 'file.json', 'data_str': data}]})):
+        response = client.post(path, json=body)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(main.ADMISSION_RETRY_AFTER)
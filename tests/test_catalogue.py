@@ -0,0 +1,37 @@
+import pytest
+
+from app import util
+
+
+@pytest.mark.parametrize('path', ['/processes', '/processes/test-building-function', '/profiles'])
+def test_not_modified(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert not response.content
+
+    response = client.get(path, headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag
+
+
+def test_processes(client, profile_loader):
+    response = client.get('/processes')
+    assert response.content == profile_loader.process_list_content.content
+    assert [p['id'] for p in response.json()['processes']] == list(profile_loader.profiles)
+    assert client.get('/processes/test-missing').status_code == 404
+
+
+def test_etag_matches():
+    etag = util.make_etag(b'content')
+    assert util.etag_matches(etag, etag)
+    assert util.etag_matches(f'"other", W/{etag}', etag)
+    assert util.etag_matches('*', etag)
+    assert not util.etag_matches('"other"', etag)
+    assert not util.etag_matches(None, etag)
+    assert etag != util.make_etag(b'other content')
@@ -0,0 +1,65 @@
+import shutil
+from pathlib import Path
+
+import orjson
+import pytest
+
+from app import citygml
+from app.config import settings
+
+DATA_DIR = Path(__file__).parent / 'data'
+SAMPLES = sorted(DATA_DIR.glob('*.gml'))
+
+BUILDING = '''<?xml version="1.0" encoding="UTF-8"?>
+<core:CityModel xmlns:core="http://www.opengis.net/citygml/2.0" xmlns:bldg="http://www.opengis.net/citygml/building/2.0"
+  xmlns:gml="http://www.opengis.net/gml">
+  <core:cityObjectMember>
+    <bldg:Building gml:id="B1">{}</bldg:Building>
+  </core:cityObjectMember>
+</core:CityModel>
+'''
+
+
+def convert_building(tmp_path: Path, properties: str) -> dict:
+    input_path = tmp_path / 'input.gml'
+    input_path.write_text(BUILDING.format(properties))
+    citygml.convert(input_path, tmp_path / 'output.json')
+    return orjson.loads((tmp_path / 'output.json').read_bytes())['CityObjects']['B1']
+
+
+def test_attributes(tmp_path):
+    city_object = convert_building(tmp_path, '<bldg:function>1000</bldg:function>'
+                                             '<bldg:storeysAboveGround>2</bldg:storeysAboveGround>')
+    assert city_object['attributes'] == {'function': '1000', 'storeysAboveGround': 2}
+
+
+@pytest.mark.parametrize('properties', [
+    '<bldg:storeysAboveGround/>',
+    '<bldg:measuredHeight>high</bldg:measuredHeight>',
+    '<bldg:function>1000</bldg:function><bldg:function>2000</bldg:function>',
+    '<gml:name>A</gml:name><gml:name>B</gml:name>',
+    '<bldg:function>1000',
+])
+def test_unsupported(tmp_path, properties):
+    # Left to citygml-tools instead of failing or losing data
+    with pytest.raises(citygml.UnsupportedCityGML):
+        convert_building(tmp_path, properties)
+
+
+@pytest.mark.parametrize('sample', SAMPLES, ids=lambda path: path.name)
+def test_samples(tmp_path, sample):
+    citygml.convert(sample, tmp_path / 'output.json')
+    doc = orjson.loads((tmp_path / 'output.json').read_bytes())
+    assert doc['type'] == 'CityJSON'
+    assert doc['CityObjects']
+
+
+@pytest.mark.skipif(not shutil.which(settings.citygml_tools), reason='citygml-tools is not available')
+@pytest.mark.parametrize('sample', SAMPLES, ids=lambda path: path.name)
+def test_compare_with_citygml_tools(tmp_path, sample):
+    input_path = tmp_path / sample.name
+    shutil.copy(sample, input_path)
+    native_path = tmp_path / 'native.json'
+    citygml.convert(input_path, native_path)
+    reference_path = citygml.convert_with_citygml_tools(input_path)
+    assert citygml.compare(orjson.loads(native_path.read_bytes()), orjson.loads(reference_path.read_bytes())) == []
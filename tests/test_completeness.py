@@ -0,0 +1,66 @@
+import math
+
+from app import completeness
+from app.profiles import CompletenessCheck
+
+
+def table(*docs: dict) -> completeness.AttributeTable:
+    table = completeness.AttributeTable()
+    for doc in docs:
+        table.add(doc)
+    return table
+
+
+def city_objects(*objects: tuple[str, dict | None]) -> dict:
+    return {'CityObjects': {f"id{i}": {'type': object_type, **({'attributes': attributes} if attributes else {})}
+                            for i, (object_type, attributes) in enumerate(objects)}}
+
+
+def test_metrics():
+    attributes = table(city_objects(('Building', {'height': 10}), ('Building', {'height': 20.5}),
+                                    ('Building', {'height': None}), ('Road', {'height': 3})),
+                       city_objects(('Building', {'height': 'high'}), ('Building', None)))
+    result = completeness.evaluate(CompletenessCheck(cityObjectType='Building', attribute='height',
+                                                     minCompleteness=0.5), attributes)
+    assert result['objectCount'] == 5
+    assert result['presentCount'] == 3
+    assert result['nullCount'] == 2
+    assert math.isclose(result['completeness'], 0.6)
+    assert result['numericCount'] == 2
+    assert (result['min'], result['max'], result['mean']) == (10, 20.5, 15.25)
+    assert result['conforms']
+
+
+def test_range():
+    # Values that are not numbers are out of range too
+    attributes = table(city_objects(('Building', {'storeys': 1}), ('Building', {'storeys': 40}),
+                                    ('Building', {'storeys': True}), ('Building', {'storeys': 3})))
+    result = completeness.evaluate(CompletenessCheck(cityObjectType='Building', attribute='storeys',
+                                                     minValue=1, maxValue=30), attributes)
+    assert result['outOfRangeCount'] == 2
+    assert not result['conforms']
+
+
+def test_min_completeness():
+    attributes = table(city_objects(('Building', {'name': 'A'}), ('Building', {})))
+    result = completeness.evaluate(CompletenessCheck(cityObjectType='Building', attribute='name',
+                                                     minCompleteness=0.9), attributes)
+    assert result['completeness'] == 0.5
+    assert not result['conforms']
+
+
+def test_nested_attributes():
+    attributes = table(city_objects(('Building', {'address': {'street': 'Main St', 'number': 1}}),
+                                    ('Building', {'address': {'number': 2}}),
+                                    ('Building', {'address.street': 'Side St', 'address': {'street': 'Other St'}})))
+    street = attributes.column('Building', 'address.street')
+    assert street.present.tolist() == [True, False, True]
+    number = attributes.column('Building', 'address.number')
+    assert number.numbers[:2].tolist() == [1, 2]
+    assert attributes.column('Building', 'address').present.all()
+
+
+def test_missing_type():
+    result = completeness.evaluate(CompletenessCheck(cityObjectType='Bridge', attribute='name', minCompleteness=1),
+                                   table(city_objects(('Building', {'name': 'A'}))))
+    assert (result['objectCount'], result['completeness'], result['conforms']) == (0, None, True)
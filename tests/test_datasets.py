@@ -0,0 +1,75 @@
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+from app import datasets, model
+from app.config import settings
+from app.datasets import dataset_store
+from app.janitor import Janitor
+from app.main import app
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+client = TestClient(app)
+
+
+def create_dataset(*data: str) -> dict:
+    response = client.post('/datasets', json={
+        'cityFiles': [{'name': f"file{i}.json", 'data_str': d} for i, d in enumerate(data)],
+    })
+    assert response.status_code == 201
+    dataset = dataset_store.get_dataset(response.json()['datasetID'])
+    assert dataset.ready.wait(30)
+    return client.get(f"/datasets/{dataset.dataset_id}").json()
+
+
+def test_dataset(standins):
+    info = create_dataset((DATA_DIR / 'cityjson-buildings.json').read_text())
+    assert info['status'] == 'successful'
+    assert info['files'][0]['valid'] is True
+
+
+def test_failed_dataset(standins):
+    # The second file is not validated, since val3dity fails on the malformed one
+    info = create_dataset((DATA_DIR / 'cityjson-buildings.json').read_text(), '{"type": "CityJSON",')
+    assert info['status'] == 'failed'
+    assert info['message']
+    assert [f['valid'] for f in info['files']] == [True, None]
+
+
+def test_dataset_job(standins, execute):
+    data = (DATA_DIR / 'cityjson-buildings.json').read_text()
+    info = create_dataset(data)
+    # Jobs on the dataset give the same results as jobs on the same input files
+    results = [client.get(f"/jobs/{job_id}/results").json()
+               for job_id in (execute('test-building-function', dataset=info['datasetID']),
+                              execute('test-building-function', data))]
+    for result in results:
+        del result['links']
+        for file_result in result['fileValidation']:
+            del file_result['href']
+    assert results[0] == results[1]
+    assert results[0]['shaclSummary']['totalResults'] == 5
+    assert dataset_store.get_dataset(info['datasetID']).pins == 0
+
+
+def test_missing_dataset(client):
+    response = client.post('/processes/test-building-function/execution', json={'inputs': {'dataset': 'missing'}})
+    assert response.status_code == 400
+
+
+def test_pinned_dataset(standins, monkeypatch):
+    monkeypatch.setattr(datasets, 'janitor', Janitor())
+    store = datasets.DatasetStore()
+    city_files = [model.InputFile(name='file0.json', data_str=(DATA_DIR / 'cityjson-buildings.json').read_text())]
+    dataset = store.create_dataset(city_files)
+    store.run_dataset(dataset)
+    monkeypatch.setattr(settings, 'dataset_ttl', -1)
+
+    # Datasets are not evicted while jobs use them
+    dataset.pin()
+    store.evict()
+    assert store.get_dataset(dataset.dataset_id) is dataset
+    dataset.unpin()
+    store.evict()
+    assert store.get_dataset(dataset.dataset_id) is None
@@ -0,0 +1,72 @@
+import copy
+from pathlib import Path
+
+import orjson
+import pytest
+from rdflib import Graph
+
+from app import delta, model, uplift
+from app.datasets import Dataset
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+def shift(boundaries, removed: range):
+    if isinstance(boundaries, list):
+        return [shift(b, removed) for b in boundaries]
+    return boundaries - len(removed) if boundaries >= removed.stop else boundaries
+
+
+@pytest.fixture
+def docs() -> tuple[dict, dict]:
+    # The new version removes b1 and its vertices (shifting those of the following objects), changes b3 and
+    # adds a vertex that no object references
+    base_doc = orjson.loads((DATA_DIR / 'cityjson-buildings.json').read_bytes())
+    doc = copy.deepcopy(base_doc)
+    removed = range(8, 16)
+    del doc['CityObjects']['b1']
+    del doc['vertices'][removed.start:removed.stop]
+    for city_object in doc['CityObjects'].values():
+        for geometry in city_object.get('geometry') or ():
+            geometry['boundaries'] = shift(geometry['boundaries'], removed)
+    doc['CityObjects']['b3']['attributes']['roofType'] = 'gabled'
+    doc['vertices'].append([1, 2, 3])
+    return base_doc, doc
+
+
+def create_dataset(dataset_id: str, doc: dict, base: Dataset | None = None) -> Dataset:
+    dataset = Dataset(dataset_id, [model.InputFile(name='file.json', data_str=orjson.dumps(doc).decode())],
+                      base=base)
+    dataset.prepare_sync()
+    assert dataset.status == model.StatusCode.successful, dataset.errors
+    return dataset
+
+
+def test_object_hashes(docs):
+    # Hashes do not depend on the position of the vertices
+    base_doc, doc = docs
+    base_hashes, hashes = delta.object_hashes(base_doc), delta.object_hashes(doc)
+    assert [object_id for object_id in hashes if hashes[object_id] != base_hashes[object_id]] == ['b3']
+
+
+def test_delta(standins, docs, tmp_path):
+    base_doc, doc = docs
+    dataset = create_dataset('delta', doc, base=create_dataset('base', base_doc))
+    city_file = dataset.city_files[0]
+    assert city_file.delta == {'baseDataset': 'base', 'recheckedObjects': ['b3'], 'removedObjects': ['b1'],
+                               'reusedObjects': 4}
+
+    # Only the vertices of the changed objects are uplifted again
+    delta_doc = orjson.loads(city_file.path.with_name(city_file.path.stem + '-delta-rdf.json').read_bytes())
+    assert list(delta_doc['CityObjects']) == ['b3']
+    assert len(delta_doc['vertices']) == 8
+
+    # The result is the same as uplifting the whole file
+    full_path = tmp_path / 'full.json'
+    full_path.write_bytes(orjson.dumps(doc))
+    uplift.convert(full_path, tmp_path / 'full.ttl', 0)
+    assert uplift.compare(Graph().parse(city_file.uplift_path, format='turtle'),
+                          Graph().parse(tmp_path / 'full.ttl', format='turtle')) == []
+
+    report = orjson.loads(city_file.val3dity_report_path.read_bytes())
+    assert [feature['id'] for feature in report['features']] == list(doc['CityObjects'])
@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+from app import model
+from app.config import settings
+from app.distributed import RemoteJobRunner
+
+
+def test_accepts():
+    runner = RemoteJobRunner()
+    assert not runner.accepts(None, None)
+    runner.queue = object()
+    assert runner.accepts(None, None)
+    # Datasets are only available on the API node
+    assert not runner.accepts(SimpleNamespace(), None)
+    assert not runner.accepts(None, SimpleNamespace())
+
+
+def test_is_full(monkeypatch):
+    # Only jobs waiting for a worker count against admission_max_queued
+    runner = RemoteJobRunner()
+    runner.pending = {
+        'job1': SimpleNamespace(status=model.StatusCode.accepted),
+        'job2': SimpleNamespace(status=model.StatusCode.running),
+    }
+    assert not runner.is_full
+    monkeypatch.setattr(settings, 'admission_max_queued', 2)
+    assert not runner.is_full
+    runner.pending['job3'] = SimpleNamespace(status=model.StatusCode.accepted)
+    assert runner.is_full
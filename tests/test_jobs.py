@@ -0,0 +1,85 @@
+import datetime
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from app import jobs, model
+from app.config import settings
+from app.janitor import Janitor
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+@pytest.fixture
+def janitor(monkeypatch):
+    janitor = Janitor(interval=0.05)
+    monkeypatch.setattr(jobs, 'janitor', janitor)
+    janitor.start()
+    yield janitor
+    janitor.stop()
+
+
+def run_job(executor: jobs.JobExecutor, profile_loader) -> jobs.JobSummary:
+    city_files = [model.InputFile(name='file0.json', data_str=(DATA_DIR / 'cityjson-buildings.json').read_text())]
+    job = executor.create_job(profiles=[profile_loader.profiles['test-completeness']], city_files=city_files,
+                              profile_loader=profile_loader)
+    executor.run_job(job)
+    return executor.get_job(job.job_id)
+
+
+def wait_removed(path: Path):
+    deadline = time.monotonic() + 5
+    while path.exists():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_summary(janitor, profile_loader):
+    executor = jobs.JobExecutor()
+    summary = run_job(executor, profile_loader)
+    assert isinstance(summary, jobs.JobSummary)
+    assert summary.status == model.StatusCode.successful
+    assert summary.completeness_result is False
+    assert summary.size > 0
+    assert summary.wd.is_dir()
+
+
+def test_evict_size(janitor, profile_loader, monkeypatch):
+    executor = jobs.JobExecutor()
+    summaries = [run_job(executor, profile_loader) for _ in range(3)]
+    monkeypatch.setattr(settings, 'job_retention_bytes', summaries[1].size + summaries[2].size)
+    executor.evict()
+    # The oldest job is evicted first, until the retained data fits in the budget
+    assert [executor.get_job(s.job_id) for s in summaries] == [None, summaries[1], summaries[2]]
+    wait_removed(summaries[0].wd)
+    assert summaries[1].wd.is_dir()
+
+
+def test_evict_ttl(janitor, profile_loader, monkeypatch):
+    executor = jobs.JobExecutor()
+    expired, summary = run_job(executor, profile_loader), run_job(executor, profile_loader)
+    expired.finished -= datetime.timedelta(seconds=settings.job_ttl + 1)
+    # Eviction is run by the janitor periodically
+    wait_removed(expired.wd)
+    assert executor.get_job(expired.job_id) is None
+    assert executor.get_job(summary.job_id) is summary
+
+
+def test_janitor_sweep_errors():
+    janitor = Janitor(interval=0.01)
+    swept = threading.Event()
+
+    def failing_sweep():
+        raise Exception('failed')
+
+    janitor.add_sweep(failing_sweep)
+    janitor.add_sweep(swept.set)
+    janitor.start()
+    try:
+        assert swept.wait(5)
+        swept.clear()
+        assert swept.wait(5)
+    finally:
+        janitor.stop()
@@ -0,0 +1,43 @@
+import sys
+
+import pytest
+
+from app import limits
+from app.config import settings
+
+pytestmark = pytest.mark.skipif(not hasattr(limits.resource, 'prlimit'), reason='prlimit() is not available')
+
+SHOW_LIMITS = 'import os, sys; sys.stdout.write(open("/proc/self/limits").read())'
+
+
+def limit_value(output: str, name: str) -> str:
+    return next(line[26:].split()[0] for line in output.splitlines() if line.startswith(name))
+
+
+def test_limits(monkeypatch):
+    monkeypatch.setattr(settings, 'subprocess_memory_limit', 1024 ** 3)
+    monkeypatch.setattr(settings, 'subprocess_open_files_limit', 100)
+    result = limits.run('test', [sys.executable, '-c', SHOW_LIMITS], capture_output=True, text=True)
+    assert limit_value(result.stdout, 'Max address space') == str(1024 ** 3)
+    assert limit_value(result.stdout, 'Max open files') == '100'
+
+
+def test_jvm_heap(monkeypatch):
+    # The address space of Java programs is not limited, only their heap
+    monkeypatch.setattr(settings, 'subprocess_memory_limit', 1024 ** 3)
+    result = limits.run('test', [sys.executable, '-c', SHOW_LIMITS + '; print(os.environ["JAVA_TOOL_OPTIONS"])'],
+                        jvm=True, capture_output=True, text=True)
+    assert limit_value(result.stdout, 'Max address space') == 'unlimited'
+    assert result.stdout.splitlines()[-1] == '-Xmx1024m'
+
+
+def test_cpu_limit_exceeded(monkeypatch):
+    monkeypatch.setattr(settings, 'subprocess_cpu_limit', 1)
+    with pytest.raises(limits.ResourceLimitExceeded):
+        limits.run('test', [sys.executable, '-c', 'while True: pass'])
+
+
+def test_memory_limit_exceeded(monkeypatch):
+    monkeypatch.setattr(settings, 'subprocess_memory_limit', 256 * 1024 ** 2)
+    with pytest.raises(limits.ResourceLimitExceeded):
+        limits.run('test', [sys.executable, '-c', 'bytearray(1024 ** 3)'], capture_output=True)
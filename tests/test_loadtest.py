@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import orjson
+import pytest
+
+from app.loadtest.__main__ import percentile, summarize
+
+DATA_DIR = Path(__file__).parent / 'data'
+ROOT_DIR = Path(__file__).parent.parent
+
+
+def test_percentile():
+    values = [float(v) for v in range(100, 0, -1)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) is None
+    assert summarize([1.0, 3.0]) == {'count': 2, 'mean': 2.0, 'p50': 1.0, 'p90': 3.0, 'p99': 3.0, 'max': 3.0}
+
+
+def test_val3dity_standin(standins, tmp_path):
+    report_path = tmp_path / 'report.json'
+    env = {**os.environ, 'LOADTEST_VAL3DITY_INVALID': '1'}
+    subprocess.run([standins['val3dity'], '--report', report_path, DATA_DIR / 'cityjson-buildings.json'],
+                   env=env, check=True)
+    report = orjson.loads(report_path.read_bytes())
+    assert report['validity'] is False
+    assert [f['id'] for f in report['features']] == ['b0', 'b1', 'b2', 'b3', 'b4', 'r1']
+    assert all(not f['validity'] and f['errors'] for f in report['features'])
+    assert report['features_overview'] == [{'type': 'Building', 'total': 5, 'valid': 0},
+                                           {'type': 'Road', 'total': 1, 'valid': 0}]
+
+
+def test_citygml_tools_standin(standins, tmp_path):
+    input_path = tmp_path / 'input.gml'
+    input_path.write_bytes((DATA_DIR / 'citygml2.gml').read_bytes())
+    subprocess.run([standins['citygml_tools'], 'to-cityjson', input_path], check=True)
+    assert orjson.loads(input_path.with_suffix('.json').read_bytes())['type'] == 'CityJSON'
+
+
+@pytest.mark.parametrize('mode', ['closed', 'open'])
+def test_run(tmp_path, mode):
+    report_path = tmp_path / 'report.json'
+    subprocess.run([sys.executable, '-m', 'app.loadtest', DATA_DIR / 'cityjson-buildings.json',
+                    '--profile', 'chek-roads-present', '--mode', mode, '--rate', '20', '--jobs', '3',
+                    '--val3dity-latency', '0', '--poll-interval', '0.05', '--json', report_path],
+                   cwd=ROOT_DIR, check=True, capture_output=True, timeout=120)
+    report = orjson.loads(report_path.read_bytes())
+    assert report['jobs']['byStatus'] == {'successful': 3}
+    assert report['jobs']['failedSessions'] == 0
+    assert report['jobs']['latency']['count'] == 3
+    assert report['requests']['execution']['errors'] == 0
+    assert report['memory']['serverHwmKb'] > 0
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from rdflib import Graph
+
+from app import parallel, profiling
+from app.shacl import CompiledShapes, ShaclReportBuilder
+
+pytestmark = pytest.mark.skipif(not parallel.can_fork(), reason='Processes cannot be forked')
+
+SHAPES = '''
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix city: <http://example.com/vocab/city/> .
+@prefix xsd: <http://www.w3.org/2001/XMLSchema#> .
+@prefix : <urn:test#> .
+
+:Function a sh:NodeShape ;
+  sh:targetClass city:Building ;
+  sh:property [ sh:path city:hasFunction ; sh:minCount 1 ] .
+
+:Height a sh:NodeShape ;
+  sh:targetClass city:Building ;
+  sh:property [ sh:path city:height ; sh:datatype xsd:integer ; sh:severity sh:Warning ] .
+
+:Tall a sh:NodeShape ;
+  sh:targetClass city:Building ;
+  sh:sparql [
+    sh:select """
+      PREFIX city: <http://example.com/vocab/city/>
+      SELECT $this ?value WHERE { $this city:height ?value FILTER(?value > 100) }
+    """ ;
+    sh:message "Building is too tall" ;
+  ] .
+
+:Road a sh:NodeShape ;
+  sh:targetClass city:Road ;
+  sh:property [ sh:path ( city:hasGeometry city:lod ) ; sh:minCount 1 ; sh:message "Road without LoD" ] .
+'''
+
+
+def data_graph() -> Graph:
+    data = ['@prefix city: <http://example.com/vocab/city/> .', '@prefix : <urn:test#> .']
+    for i in range(20):
+        height = '150' if i % 3 else '"high"'
+        data.append(f':b{i} a city:Building ; city:height {height} .')
+        data.append(f':r{i} a city:Road ; city:hasGeometry [ city:lod "1" ] .' if i % 2 else f':r{i} a city:Road .')
+    return Graph().parse(data='\n'.join(data), format='turtle')
+
+
+def build_report(report_graph: Graph) -> dict:
+    return ShaclReportBuilder(json.loads(report_graph.serialize(format='json-ld'))).build()
+
+
+@pytest.mark.parametrize('processes', [2, 3, 8])
+def test_same_report(processes):
+    shapes = CompiledShapes(Graph().parse(data=SHAPES, format='turtle'), [])
+    conforms, report_graph = shapes.validate(data_graph())
+    expected = build_report(report_graph)
+    assert not conforms
+    assert len(expected['result']) == 57
+
+    parallel_conforms, parallel_report_graph = shapes.validate(data_graph(), processes)
+    assert parallel_conforms == conforms
+    assert build_report(parallel_report_graph) == expected
+
+
+def test_profiled():
+    # Timings recorded in the worker processes are added to those of the job
+    shapes = CompiledShapes(Graph().parse(data=SHAPES, format='turtle'), [])
+    profiler = profiling.JobProfiler()
+    with profiling.activate(profiler):
+        shapes.validate(data_graph(), 2)
+    profile = profiler.to_json()
+    assert {s['shape'] for s in profile['shapes']} >= {'urn:test#Function', 'urn:test#Height', 'urn:test#Tall',
+                                                        'urn:test#Road'}
+    assert profile['sparqlConstraints'][0]['focusNodes'] == 20
+
+
+def test_conforms():
+    shapes = CompiledShapes(Graph().parse(data=SHAPES, format='turtle'), [])
+    conforms, report_graph = shapes.validate(Graph(), 2)
+    assert conforms
+    assert build_report(report_graph)['conforms'] is True
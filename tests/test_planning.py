@@ -0,0 +1,93 @@
+from pathlib import Path
+
+import pytest
+
+from app import planning
+from app.jobs import job_executor
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+@pytest.fixture(scope='module')
+def data() -> str:
+    return (DATA_DIR / 'cityjson-buildings.json').read_text()
+
+
+def plan(profile_loader, *profile_ids: str, fail_fast: bool = False) -> planning.ExecutionPlan:
+    profiles = [profile_loader.profiles[profile_id] for profile_id in profile_ids]
+    shapes = {profile.get_id(): profile_loader.shapes_cache.get(profile) for profile in profiles}
+    return planning.plan(profiles, shapes, profile_loader.profiles_by_uri, fail_fast)
+
+
+def test_plan(profile_loader):
+    execution_plan = plan(profile_loader, 'test-completeness')
+    assert not execution_plan.geometry and not execution_plan.uplift
+    assert list(execution_plan.completeness) == ['test-completeness']
+    assert execution_plan.skipped == [{'stage': planning.GEOMETRY, 'reason': planning.NOT_REQUIRED}]
+
+    execution_plan = plan(profile_loader, 'test-geometry')
+    assert execution_plan.geometry and not execution_plan.uplift
+    assert not execution_plan.completeness and not execution_plan.skipped
+
+    # Profiles that do not declare any stage need all of them
+    execution_plan = plan(profile_loader, 'test-all-stages')
+    assert execution_plan.geometry and execution_plan.shacl == {'test-all-stages'}
+    assert list(execution_plan.completeness) == ['test-all-stages']
+
+    execution_plan = plan(profile_loader, 'test-completeness', 'test-roads-present')
+    assert execution_plan.geometry and execution_plan.shacl == {'test-roads-present'}
+    assert not execution_plan.skipped
+
+
+def test_profile_stages(profile_loader):
+    profiles = profile_loader.profiles
+    assert planning.profile_stages(profiles['test-completeness'], profile_loader.profiles_by_uri) == {
+        planning.COMPLETENESS}
+    assert planning.profile_stages(profiles['test-all-stages'], profile_loader.profiles_by_uri) is None
+
+
+def test_skipped_stages(client, execute, data):
+    job_id = execute('test-completeness', data)
+    results = client.get(f"/jobs/{job_id}/results").json()
+    assert results['skippedStages'] == [{'stage': planning.GEOMETRY, 'reason': planning.NOT_REQUIRED}]
+    assert results['val3dityResult'] is None
+    assert results['completenessResult'] is False
+    city_file = job_executor.get_job(job_id).city_files[0]
+    assert city_file.val3dity_report_path is None and city_file.uplift_path is None
+
+    job_id = execute('test-geometry', data)
+    results = client.get(f"/jobs/{job_id}/results").json()
+    assert results['valid'] is True and 'skippedStages' not in results
+    assert job_executor.get_job(job_id).city_files[0].uplift_path is None
+
+
+def test_fail_fast_completeness(client, execute, data):
+    results = client.get(f"/jobs/{execute('test-all-stages', data)}/results").json()
+    assert 'skippedStages' not in results
+    assert results['val3dityResult'] is True and results['shaclResult'] is False
+
+    results = client.get(f"/jobs/{execute('test-all-stages', data, query='?failFast=true')}/results").json()
+    assert results['skippedStages'] == [
+        {'stage': planning.GEOMETRY, 'reason': planning.FAIL_FAST},
+        {'stage': planning.SHACL, 'reason': planning.FAIL_FAST, 'profile': 'test-all-stages'},
+    ]
+    assert results['valid'] is False and results['completenessResult'] is False
+    assert results['val3dityResult'] is None and results['shaclSummary']['conforms'] is None
+
+
+def test_fail_fast_shacl(client, execute, data):
+    job_id = execute('test-building-function,test-roads-present', data, query='?failFast=true')
+    results = client.get(f"/jobs/{job_id}/results").json()
+    assert results['skippedStages'] == [
+        {'stage': planning.SHACL, 'reason': planning.FAIL_FAST, 'profile': 'test-roads-present'}]
+    assert [r['shaclResult'] for r in results['profileResults']] == [False, None]
+
+
+def test_fail_fast_geometry(client, execute, data, monkeypatch):
+    monkeypatch.setenv('LOADTEST_VAL3DITY_INVALID', '1')
+    job_id = execute('test-roads-present', data, query='?failFast=true')
+    results = client.get(f"/jobs/{job_id}/results").json()
+    assert results['val3dityResult'] is False
+    assert results['skippedStages'] == [
+        {'stage': planning.SHACL, 'reason': planning.FAIL_FAST, 'profile': 'test-roads-present'}]
+    assert job_executor.get_job(job_id).city_files[0].uplift_path is None
@@ -0,0 +1,85 @@
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from app import profiles, shacl
+from app.profiles import ProfileLoader
+
+DATA_DIR = Path(__file__).parent / 'data'
+ROOT_DIR = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def catalogue(tmp_path, monkeypatch):
+    # Copy of the test catalogue, whose artifacts can be changed
+    shutil.copytree(DATA_DIR / 'profiles', tmp_path / 'profiles')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / 'profiles'
+
+
+def load(snapshot_dir: Path) -> ProfileLoader:
+    loader = ProfileLoader('profiles/*.ttl', snapshot_dir=snapshot_dir)
+    loader.close()
+    return loader
+
+
+def wait_snapshot(snapshot_dir: Path, version: str):
+    deadline = time.monotonic() + 10
+    while not (snapshot_dir / version.strip('"')).is_dir() or not (snapshot_dir / profiles.SNAPSHOT_FILE).is_file():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_profiles(profile_loader):
+    profile = profile_loader.profiles['test-completeness']
+    assert profile.stages == ['CompletenessValidation']
+    assert [check.attribute for check in profile.completeness] == ['measuredHeight']
+    assert profile_loader.profiles['test-parameter'].parameters[0].identifier == 'building'
+    assert set(profile_loader.profiles_by_uri) == {p.uri for p in profile_loader.profiles.values()}
+
+
+def test_snapshot(catalogue, tmp_path, monkeypatch):
+    snapshot_dir = tmp_path / 'snapshot'
+    loader = load(snapshot_dir)
+    for profile in loader.profiles.values():
+        loader.shapes_cache.get(profile)
+    wait_snapshot(snapshot_dir, loader.shapes_cache.version)
+
+    # Shapes are read from the snapshot, instead of being loaded from their artifacts
+    def load_shapes(*args):
+        raise AssertionError('Shapes loaded from the artifacts')
+
+    monkeypatch.setattr(shacl, 'load_shapes', load_shapes)
+    restored = load(snapshot_dir)
+    assert restored.shapes_cache.version == loader.shapes_cache.version
+    assert list(restored.profiles) == list(loader.profiles)
+    assert restored.profile_list_content.etag == loader.profile_list_content.etag
+    for profile in restored.profiles.values():
+        shapes = restored.shapes_cache.get(profile)
+        assert shapes.has_shapes == loader.shapes_cache.get(loader.profiles[profile.get_id()]).has_shapes
+
+
+def test_snapshot_changed_artifact(catalogue, tmp_path):
+    snapshot_dir = tmp_path / 'snapshot'
+    loader = load(snapshot_dir)
+    wait_snapshot(snapshot_dir, loader.shapes_cache.version)
+
+    artifact = catalogue / 'shapes' / 'building-function.shacl'
+    artifact.write_text(artifact.read_text().replace('sh:minCount 1', 'sh:minCount 2'))
+    restored = load(snapshot_dir)
+    assert restored.shapes_cache.version != loader.shapes_cache.version
+    # Profiles that use the changed artifact are loaded again
+    for profile_id in ('test-building-function', 'test-all-stages'):
+        shapes = restored.shapes_cache.get(restored.profiles[profile_id])
+        assert '"2"' in shapes.graph.serialize(format='nt')
+
+
+def test_lazy_imports():
+    # The app starts without importing the RDF, JSON-LD and SHACL libraries
+    code = "import sys, app.main; print(' '.join(m for m in ('rdflib', 'pyld', 'pyshacl') if m in sys.modules))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == ''
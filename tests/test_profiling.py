@@ -0,0 +1,65 @@
+import time
+from pathlib import Path
+
+from app import profiling
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+def test_profiler(tmp_path):
+    profiler = profiling.JobProfiler(interval=0.001)
+    assert profiling.current() is None
+    with profiling.activate(profiler):
+        assert profiling.current() is profiler
+        with profiling.stage('sleep', file=0):
+            time.sleep(0.05)
+    assert profiling.current() is None
+    # Stages outside of an active profiler are not recorded
+    with profiling.stage('other'):
+        pass
+
+    profile = profiler.to_json()
+    assert [(s['stage'], s['file']) for s in profile['stages']] == [('sleep', 0)]
+    assert profile['stages'][0]['duration'] >= 0.05
+    assert profile['samples'] > 0
+
+    profiler.write(tmp_path)
+    stacks = (tmp_path / profiling.STACKS_FILE).read_text().splitlines()
+    assert any('test_profiler (test_profiling.py' in line for line in stacks)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in stacks)
+
+
+def test_merge():
+    profiler = profiling.JobProfiler()
+    profiler.record(profiler.shapes, ('a',), {'shape': 'a'}, 1.0)
+    profiler.merge({('a',): {'shape': 'a', 'evaluations': 2, 'duration': 0.5},
+                    ('b',): {'shape': 'b', 'evaluations': 1, 'duration': 3.0}}, {})
+    assert profiler.to_json()['shapes'] == [{'shape': 'b', 'evaluations': 1, 'duration': 3.0},
+                                            {'shape': 'a', 'evaluations': 3, 'duration': 1.5}]
+
+
+def test_job_profile(client, execute):
+    data = (DATA_DIR / 'cityjson-buildings.json').read_text()
+    job_id = execute('test-building-function,test-roads-present', data, query='?profiling=true')
+    profile = client.get(f"/jobs/{job_id}/profile").json()
+    stages = [s['stage'] for s in profile['stages']]
+    for stage in ('shapes', 'val3dity', 'uplift', 'dataset', 'load', 'shacl', 'report'):
+        assert stage in stages
+    assert [s['profile'] for s in profile['stages'] if s['stage'] == 'shacl'] == [
+        'test-building-function', 'test-roads-present']
+    shapes = {s['shape'] for s in profile['shapes']}
+    assert 'urn:chek:profiles/test-building-function#BuildingFunction' in shapes
+    # The constraint of roads-present is in a (blank node) shape in sh:not
+    assert len(profile['sparqlConstraints']) == 1
+    assert '?s a city:Road' in profile['sparqlConstraints'][0]['select']
+    assert profile['sparqlConstraints'][0]['focusNodes'] == 1
+
+    response = client.get(f"/jobs/{job_id}/profile", params={'format': 'folded'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert client.get(f"/jobs/{job_id}/profile", params={'format': 'other'}).status_code == 400
+
+
+def test_job_not_profiled(client, execute):
+    job_id = execute('test-roads-present', (DATA_DIR / 'cityjson-buildings.json').read_text())
+    assert client.get(f"/jobs/{job_id}/profile").status_code == 404
@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+
+import pytest
+from rdflib import BNode, DCTERMS, Literal, RDF, URIRef
+
+from app import rdfstore, uplift
+from app.profiles import ProfileLoader
+from app.shacl import ShaclReportBuilder
+
+pytest.importorskip('pyoxigraph')
+
+DATA_DIR = Path(__file__).parent / 'data'
+ROOT_DIR = Path(__file__).parent.parent
+SD = 'https://w3id.org/okn/o/sd#'
+
+
+@pytest.fixture(scope='module')
+def chek_profiles():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(ROOT_DIR)
+        loader = ProfileLoader('data/chek-profiles.ttl')
+    yield loader
+    loader.close()
+
+
+@pytest.fixture(scope='module')
+def data_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('rdfstore') / 'data.ttl'
+    uplift.convert(DATA_DIR / 'cityjson-buildings.json', path, 0)
+    return path
+
+
+def validate(profile_loader, profile_id: str, backend, data_file: Path) -> list[str]:
+    cache = profile_loader.shapes_cache
+    shapes = cache.get(profile_loader.profiles[profile_id])
+    data_graph = backend.load(cache.data_graph(backend), data_file)
+    param = BNode()
+    data_graph.add((param, RDF.type, URIRef(f'{SD}Parameter')))
+    data_graph.add((param, DCTERMS.identifier, Literal('buildingOfInterest')))
+    data_graph.add((param, URIRef(f'{SD}hasFixedValue'), Literal('b0')))
+    conforms, report_graph = shapes.validate(data_graph)
+    report = ShaclReportBuilder(json.loads(report_graph.serialize(format='json-ld'))).build()
+    # Results are in no particular order, and blank nodes are relabeled
+    return sorted(json.dumps({k: v for k, v in result.items() if k != 'sourceShape'}, sort_keys=True)
+                  for result in report.get('result', ()))
+
+
+@pytest.mark.parametrize('profile_id', ['chek-roads-present', 'chek-green-public-spaces-present',
+                                        'chek-ascoli-piceno'])
+def test_same_results(chek_profiles, data_file, profile_id):
+    memory = validate(chek_profiles, profile_id, rdfstore.get_backend('memory'), data_file)
+    oxigraph = validate(chek_profiles, profile_id, rdfstore.get_backend('oxigraph'), data_file)
+    assert memory == oxigraph
+
+
+def test_job(client, execute, monkeypatch):
+    data = (DATA_DIR / 'cityjson-buildings.json').read_text()
+    results = []
+    for store in ('memory', 'oxigraph'):
+        monkeypatch.setattr(rdfstore.settings, 'rdf_store', store)
+        job_id = execute('test-building-function,test-roads-present', data)
+        results.append(client.get(f"/jobs/{job_id}/results").json()['profileResults'])
+    for profile_results in results:
+        for profile_result in profile_results:
+            del profile_result['href']
+    assert results[0] == results[1]
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        rdfstore.get_backend('other')
@@ -0,0 +1,76 @@
+from pathlib import Path
+
+import orjson
+
+from app.results import ShaclReportStore, iter_array, iter_object_with
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+REPORT = {
+    '@context': {'sh': 'http://www.w3.org/ns/shacl#'},
+    'type': 'ValidationReport',
+    'conforms': False,
+    'result': [{'focusNode': f"urn:test#{i}",
+                'resultSeverity': 'sh:Warning' if i % 3 == 0 else 'sh:Violation'} for i in range(10)],
+}
+
+
+def test_store(tmp_path):
+    store = ShaclReportStore(tmp_path / 'report')
+    assert not store.exists()
+    summary = store.write(REPORT)
+    assert store.exists()
+    assert summary == {'conforms': False, 'totalResults': 10, 'resultsBySeverity': {'Warning': 4, 'Violation': 6}}
+
+    assert orjson.loads(b''.join(store.iter_json())) == REPORT
+
+    page = orjson.loads(b''.join(store.iter_json(offset=8, limit=5, paged=True)))
+    assert [r['focusNode'] for r in page['result']] == ['urn:test#8', 'urn:test#9']
+    assert page['numberReturned'] == 2
+    assert page['conforms'] is False
+
+    page = orjson.loads(b''.join(store.iter_json(offset=1, limit=2, severity='sh:Warning', paged=True)))
+    assert [r['focusNode'] for r in page['result']] == ['urn:test#3', 'urn:test#6']
+
+
+def test_iter_object_with():
+    streamed = iter_object_with({'a': 1}, [('b', iter_array([[b'1'], [b'2']])), ('c', [b'{}'])])
+    assert orjson.loads(b''.join(streamed)) == {'a': 1, 'b': [1, 2], 'c': {}}
+    assert orjson.loads(b''.join(iter_object_with({}, [('b', [b'null'])]))) == {'b': None}
+
+
+def test_results(client, execute):
+    job_id = execute('test-building-function', (DATA_DIR / 'cityjson-buildings.json').read_text())
+
+    results = client.get(f"/jobs/{job_id}/results").json()
+    assert results['shaclSummary'] == {'conforms': False, 'totalResults': 5, 'resultsBySeverity': {'Violation': 5}}
+    assert 'shaclReport' not in results
+    assert 'val3dityReport' not in results['fileValidation'][0]
+
+    results = client.get(f"/jobs/{job_id}/results", params={'fields': 'shaclReport,val3dityReport'}).json()
+    assert len(results['shaclReport']['result']) == 5
+    assert results['fileValidation'][0]['val3dityReport']
+    assert client.get(f"/jobs/{job_id}/results", params={'fields': 'other'}).status_code == 400
+
+    page = client.get(f"/jobs/{job_id}/results/shacl", params={'offset': 3, 'limit': 10}).json()
+    assert page['numberReturned'] == 2
+    assert [r['focusNode'] for r in page['result']] == [r['focusNode'] for r in results['shaclReport']['result'][3:]]
+    assert client.get(f"/jobs/{job_id}/results/shacl", params={'limit': 0}).status_code == 422
+
+    file_results = client.get(f"/jobs/{job_id}/results/files/0").json()
+    assert file_results['val3dityReport'] == results['fileValidation'][0]['val3dityReport']
+    assert client.get(f"/jobs/{job_id}/results/files/1").status_code == 404
+
+
+def test_profile_results(client, execute):
+    job_id = execute('test-building-function,test-roads-present', (DATA_DIR / 'cityjson-buildings.json').read_text())
+
+    results = client.get(f"/jobs/{job_id}/results").json()
+    assert results['shaclResult'] is False
+    assert [(r['profile'], r['shaclResult']) for r in results['profileResults']] == [
+        ('test-building-function', False), ('test-roads-present', True)]
+    assert client.get(f"/jobs/{job_id}/results/shacl").status_code == 400
+
+    page = client.get(f"/jobs/{job_id}/results/shacl", params={'profile': 'test-roads-present'}).json()
+    assert page['conforms'] is True
+    assert page['numberReturned'] == 0
@@ -0,0 +1,137 @@
+import json
+from pathlib import Path
+
+import pytest
+from pyld import jsonld
+from rdflib import Graph
+from rdflib.plugins.sparql import prepareQuery
+
+from app import rdfstore, shacl
+from app.shacl import SHACL_RESULT_FRAME, ShaclReportBuilder, CompiledShapes, ShapesCache
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+SHAPES = '''
+@prefix sh: <http://www.w3.org/ns/shacl#> .
+@prefix city: <http://example.com/vocab/city/> .
+@prefix : <urn:test#> .
+
+:BuildingShape a sh:NodeShape ;
+  sh:targetClass city:Building ;
+  sh:property [
+    sh:path city:hasFunction ;
+    sh:minCount 1 ;
+  ], [
+    sh:path ( city:hasAttribute city:value ) ;
+    sh:datatype <http://www.w3.org/2001/XMLSchema#integer> ;
+    sh:severity sh:Warning ;
+  ] ;
+  sh:sparql [
+    sh:select """
+      PREFIX city: <http://example.com/vocab/city/>
+      SELECT $this ?value WHERE { $this city:height ?value FILTER(?value > 100) }
+    """ ;
+    sh:message "Building is too tall" ;
+  ] .
+'''
+
+DATA = '''
+@prefix city: <http://example.com/vocab/city/> .
+@prefix : <urn:test#> .
+
+:b0 a city:Building ; city:hasFunction "residential" .
+:b1 a city:Building ; city:height 150 ; city:hasAttribute [ city:value "high" ] .
+:b2 a city:Building ; city:hasAttribute [ city:value 3 ], [ city:value "3" ] .
+'''
+
+
+@pytest.fixture(scope='module')
+def report_graph():
+    shapes = CompiledShapes(Graph().parse(data=SHAPES, format='turtle'), [])
+    conforms, report_graph = shapes.validate(Graph().parse(data=DATA, format='turtle'))
+    assert not conforms
+    return json.loads(report_graph.serialize(format='json-ld'))
+
+
+def test_same_as_framing(report_graph):
+    report = ShaclReportBuilder(report_graph).build()
+    assert report == jsonld.frame(report_graph, SHACL_RESULT_FRAME)
+    assert len(report['result']) == 5
+
+
+def test_conforms():
+    shapes = CompiledShapes(Graph().parse(data=SHAPES, format='turtle'), [])
+    data = '<urn:test#b0> a <http://example.com/vocab/city/Building> ; <http://example.com/vocab/city/hasFunction> 1 .'
+    conforms, report_graph = shapes.validate(Graph().parse(data=data, format='turtle'))
+    assert conforms
+    report_graph = json.loads(report_graph.serialize(format='json-ld'))
+    assert ShaclReportBuilder(report_graph).build() == jsonld.frame(report_graph, SHACL_RESULT_FRAME)
+
+
+def test_max_results(report_graph):
+    report = ShaclReportBuilder(report_graph, max_results=2).build()
+    assert len(report['result']) == 2
+    assert report['truncated'] is True
+    assert report['totalResults'] == 5
+
+
+def test_aggregate(report_graph):
+    focus_node_types = {'urn:test#b1': 'http://example.com/vocab/city/Building'}
+    report = ShaclReportBuilder(report_graph, aggregate=True, focus_node_types=focus_node_types).build()
+    aggregates = report['aggregates']
+    assert aggregates['resultSeverity'] == {'Violation': 3, 'Warning': 2}
+    assert sum(aggregates['sourceShape'].values()) == 5
+    assert aggregates['focusNodeType'] == {'Building': 3, 'Unknown': 2}
+
+
+def test_shapes_cache(profile_loader, monkeypatch):
+    loaded = []
+    load_shapes = shacl.load_shapes
+
+    def counting_load_shapes(profile, profiles_by_uri):
+        loaded.append(profile.uri)
+        return load_shapes(profile, profiles_by_uri)
+
+    monkeypatch.setattr(shacl, 'load_shapes', counting_load_shapes)
+    cache = ShapesCache(profile_loader.shapes_cache.version, profile_loader.profiles_by_uri)
+    profile = profile_loader.profiles['test-building-function']
+    shapes = cache.get(profile)
+    assert cache.get(profile) is shapes
+    assert loaded == [profile.uri]
+
+
+def test_prepared_queries(monkeypatch):
+    prepared = []
+
+    def counting_prepare_query(*args, **kwargs):
+        prepared.append(args[0])
+        return prepareQuery(*args, **kwargs)
+
+    monkeypatch.setattr(rdfstore, 'prepareQuery', counting_prepare_query)
+    shapes = CompiledShapes(Graph().parse(data=SHAPES, format='turtle'), [])
+    cache = ShapesCache('version', {})
+
+    # Queries are prepared on the first validation, and reused by every data graph of the same version
+    reports = []
+    for _ in range(2):
+        data_graph = cache.data_graph(rdfstore.MemoryBackend()).parse(data=DATA, format='turtle')
+        conforms, report_graph = shapes.validate(data_graph)
+        reports.append(ShaclReportBuilder(json.loads(report_graph.serialize(format='json-ld'))).build())
+    assert len(prepared) == 1
+    assert list(cache.queries) == prepared
+
+    conforms, report_graph = shapes.validate(Graph().parse(data=DATA, format='turtle'))
+    expected = ShaclReportBuilder(json.loads(report_graph.serialize(format='json-ld'))).build()
+    assert reports == [expected, expected]
+
+
+def test_parameters(client, execute, profile_loader):
+    data = (DATA_DIR / 'cityjson-buildings.json').read_text()
+    # Parameters are bound as data, so that jobs with different values share the prepared queries
+    totals, queries = [], []
+    for building in ('b0', 'b9'):
+        job_id = execute('test-parameter', data, building=building)
+        totals.append(client.get(f"/jobs/{job_id}/results").json()['shaclSummary']['totalResults'])
+        queries.append(set(profile_loader.shapes_cache.queries))
+    assert totals == [0, 1]
+    assert queries[0] == queries[1]
@@ -0,0 +1,96 @@
+from pathlib import Path
+
+import numpy as np
+import orjson
+import pytest
+from rdflib import Literal, URIRef
+from rdflib.plugins.sparql.sparql import SPARQLError
+
+from app import cityjson, spatial
+from app.spatial import SpatialIndex
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+@pytest.fixture(scope='module')
+def index() -> SpatialIndex:
+    return SpatialIndex.build([(0, orjson.loads((DATA_DIR / 'cityjson-buildings.json').read_bytes()))])
+
+
+def iri(object_id: str) -> URIRef:
+    return URIRef(cityjson.city_object_iri(0, object_id))
+
+
+def random_doc(count: int) -> dict:
+    rnd = np.random.default_rng(0)
+    corners = rnd.uniform(0, 1000, (count, 2))
+    sizes = rnd.uniform(1, 20, (count, 2))
+    vertices, city_objects = [], {}
+    for i, ((x, y), (w, h)) in enumerate(zip(corners, sizes)):
+        city_objects[f"o{i}"] = {'type': 'Building', 'geometry': [{
+            'type': 'MultiPoint', 'lod': '1', 'boundaries': list(range(len(vertices), len(vertices) + 3))}]}
+        vertices += [[x, y, 0], [x + w, y, 0], [x, y + h, 5]]
+    return {'type': 'CityJSON', 'CityObjects': city_objects, 'vertices': vertices}
+
+
+def test_build(index):
+    # Coordinates are transformed, and objects without geometry are not indexed
+    assert len(index) == 6
+    row = index.row(str(iri('b3')))
+    np.testing.assert_allclose(index.boxes[row], [1099.74, 2058.915, 0, 1100.74, 2059.915, 3])
+    assert index.types[row] == 'Building'
+    assert index.row('urn:test#missing') is None
+
+
+def test_query():
+    doc = random_doc(500)
+    index = SpatialIndex.build([(0, doc)])
+    rnd = np.random.default_rng(1)
+    for minx, miny in rnd.uniform(-50, 1000, (20, 2)):
+        box = (minx, miny, minx + 100, miny + 50)
+        b = index.boxes
+        expected = np.flatnonzero((b[:, 0] <= box[2]) & (b[:, 3] >= box[0])
+                                  & (b[:, 1] <= box[3]) & (b[:, 4] >= box[1]))
+        assert sorted(index.query(box)) == expected.tolist()
+
+
+def test_save(index, tmp_path):
+    index.save(tmp_path / 'index.npz')
+    loaded = SpatialIndex.load(tmp_path / 'index.npz')
+    assert loaded.iris.tolist() == index.iris.tolist()
+    np.testing.assert_array_equal(loaded.footprints, index.footprints)
+
+    # The index of a dataset is only built once
+    path = tmp_path / 'dataset-index.npz'
+    spatial.load_or_build(path, [(0, DATA_DIR / 'cityjson-buildings.json')])
+    assert path.is_file()
+    assert len(spatial.load_or_build(path, [])) == len(index)
+
+
+def test_functions(index):
+    with spatial.activate(index):
+        assert spatial.intersects(iri('b1'), Literal('1000,2000,1050,2080')) == Literal(True)
+        box = [Literal(1000), Literal(2000), Literal(1050), Literal(2080)]
+        assert spatial.intersects(iri('b3'), *box) == Literal(False)
+        assert spatial.count_in_box(Literal('1000 2000 1050 2080')) == Literal(4)
+        assert spatial.count_in_box(Literal('1000,2000,1050,2080'), URIRef(spatial.CITY + 'Road')) == Literal(1)
+        assert spatial.count_within(iri('b0'), Literal(0), URIRef(spatial.CITY + 'Road')) == Literal(1)
+        assert spatial.count_within(iri('b0'), Literal(10), URIRef(spatial.CITY + 'Building')) == Literal(1)
+        assert spatial.footprint_area(iri('b0')).toPython() == pytest.approx(1)
+        assert spatial.distance(iri('b0'), iri('b2')).toPython() == pytest.approx(np.hypot(1.156, 8.669))
+        # Coverage is computed on a grid
+        coverage = spatial.coverage(Literal('1017.611,2074.606,1019.611,2075.606')).toPython()
+        assert coverage == pytest.approx(0.5, abs=2 / spatial.COVERAGE_GRID)
+        with pytest.raises(SPARQLError):
+            spatial.footprint_area(URIRef('urn:test#missing'))
+        with pytest.raises(SPARQLError):
+            spatial.intersects(iri('b0'), Literal('1000,2000'))
+    with pytest.raises(SPARQLError):
+        spatial.coverage(Literal('0,0,1,1'))
+
+
+def test_spatial_job(client, execute):
+    job_id = execute('test-spatial', (DATA_DIR / 'cityjson-buildings.json').read_text())
+    report = client.get(f"/jobs/{job_id}/results/shacl").json()
+    assert sorted(r['focusNode'] for r in report['result']) == [str(iri('b3')), str(iri('b4'))]
+    assert all(r['value'] == pytest.approx(1) for r in report['result'])
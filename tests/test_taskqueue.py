@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from app import taskqueue
+from app.taskqueue import SqliteQueue, TaskState, TcpQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SqliteQueue(tmp_path / 'queue.db')
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def tcp_queue(queue):
+    server = taskqueue._BrokerServer(('127.0.0.1', 0), taskqueue._BrokerHandler)
+    server.queue = queue
+    server.token = 'secret'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = TcpQueue(*server.server_address, 'secret')
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_lease(queue):
+    queue.put('task1', b'payload')
+    task = queue.lease('worker1', 60)
+    assert (task.task_id, task.attempt, task.payload) == ('task1', 1, b'payload')
+    assert queue.lease('worker2', 60) is None
+    assert queue.heartbeat('task1', 'worker1', 60)
+    assert not queue.heartbeat('task1', 'worker2', 60)
+    assert queue.complete('task1', 'worker1', b'result')
+    assert queue.states(['task1'])['task1'].state == TaskState.done
+    assert queue.result('task1') == b'result'
+
+
+def test_expired_lease(queue):
+    # Tasks whose worker is lost are given to another worker, until they run out of attempts
+    queue.put('task1', b'payload', max_attempts=2)
+    queue.lease('worker1', 0)
+    time.sleep(0.01)
+    task = queue.lease('worker2', 0)
+    assert (task.task_id, task.attempt) == ('task1', 2)
+    assert not queue.complete('task1', 'worker1', b'result')
+    time.sleep(0.01)
+    assert queue.lease('worker3', 60) is None
+    status = queue.states(['task1'])['task1']
+    assert (status.state, status.attempts) == (TaskState.failed, 2)
+
+
+def test_release(queue):
+    queue.put('task1', b'payload', max_attempts=2)
+    queue.lease('worker1', 60)
+    queue.release('task1', 'worker1', 'error')
+    assert queue.lease('worker2', 60).attempt == 2
+    queue.release('task1', 'worker2', 'error')
+    status = queue.states(['task1'])['task1']
+    assert (status.state, status.error) == (TaskState.failed, 'error')
+
+
+def test_idempotent(queue):
+    queue.put('task1', b'payload')
+    queue.put('task1', b'payload')
+    with pytest.raises(ValueError):
+        queue.put('task1', b'other payload')
+    queue.lease('worker1', 60)
+    assert queue.complete('task1', 'worker1', b'result')
+    assert queue.complete('task1', 'worker1', b'result')
+    assert not queue.complete('task1', 'worker2', b'result')
+
+
+def test_tcp_queue(tcp_queue):
+    tcp_queue.put('task1', b'payload')
+    task = tcp_queue.lease('worker1', 60)
+    assert (task.task_id, task.payload) == ('task1', b'payload')
+    assert tcp_queue.complete('task1', 'worker1', b'result')
+    assert tcp_queue.states(['task1', 'task2'])['task1'].state == TaskState.done
+    assert tcp_queue.result('task1') == b'result'
+    tcp_queue.delete('task1')
+    assert tcp_queue.result('task1') is None
+
+
+def test_tcp_queue_token(tcp_queue, queue):
+    client = TcpQueue(*tcp_queue.address, 'wrong')
+    with pytest.raises(RuntimeError, match='Unauthorized'):
+        client.put('task1', b'payload')
+    assert not queue.states(['task1'])
+
+
+def lose_response(tcp_queue: TcpQueue, monkeypatch):
+    # The broker handles the next request, but its response does not reach the client (in this thread)
+    tcp_queue.states([])
+    recv = taskqueue._recv
+    lost = threading.Event()
+
+    def _recv(sock):
+        if threading.current_thread() is threading.main_thread() and not lost.is_set():
+            lost.set()
+            sock.close()
+            raise ConnectionError('Connection reset')
+        return recv(sock)
+
+    monkeypatch.setattr(taskqueue, '_recv', _recv)
+
+
+def test_lost_put_response(tcp_queue, queue, monkeypatch):
+    lose_response(tcp_queue, monkeypatch)
+    tcp_queue.put('task1', b'payload')
+    assert queue.states(['task1'])['task1'].state == TaskState.queued
+
+
+def test_lost_lease_response(tcp_queue, queue, monkeypatch):
+    # A lease is not repeated, since it would lease another task
+    queue.put('task1', b'payload')
+    queue.put('task2', b'payload')
+    lose_response(tcp_queue, monkeypatch)
+    with pytest.raises(ConnectionError):
+        tcp_queue.lease('worker1', 60)
+    assert queue.states(['task2'])['task2'].state == TaskState.queued
@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import orjson
+import pytest
+from rdflib import Graph
+
+from app import model, tiling, uplift
+from app.config import settings
+from app.datasets import Dataset
+from app.delta import object_vertex_indices
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+
+@pytest.mark.parametrize('name', ['cityjson-buildings.json', 'cityjson-edge-cases-1.json'])
+def test_split(name):
+    doc = orjson.loads((DATA_DIR / name).read_bytes())
+    doc['vertices'].append([0, 0, 0])
+    city_objects = doc['CityObjects']
+    tiles, skeleton = tiling.split(doc, 3)
+    assert len(tiles) == 3
+
+    # Every object is in exactly one tile, along with its parents and the vertices it references
+    assert sorted(object_id for tile in tiles for object_id in tile.object_ids) == sorted(city_objects)
+    for tile in tiles:
+        for object_id in tile.object_ids:
+            assert set(city_objects[object_id].get('parents') or ()) <= set(tile.object_ids)
+            assert set(object_vertex_indices(city_objects[object_id])) <= set(tile.vertices)
+    assert skeleton.object_ids == []
+    assert len(doc['vertices']) - 1 in skeleton.vertices
+    # Vertices can be shared by objects in different tiles
+    assert set(v for tile in [*tiles, skeleton] for v in tile.vertices) == set(range(len(doc['vertices'])))
+    assert not set(skeleton.vertices) & set(v for tile in tiles for v in tile.vertices)
+
+
+def test_tile_to_cityjson():
+    doc = orjson.loads((DATA_DIR / 'cityjson-buildings.json').read_bytes())
+    tile = tiling.objects_tile(doc, ['b3'])
+    tile_doc = tile.to_cityjson(doc, tiling.UPLIFT_TILE_MEMBERS)
+    assert set(tile_doc) == {'type', 'version', 'CityObjects', 'vertices'}
+    assert list(tile_doc['CityObjects']) == ['b3']
+    assert tile_doc['vertices'] == [doc['vertices'][v] for v in tile.vertices]
+    # Boundaries reference the same coordinates as in the full document
+    assert ([tile_doc['vertices'][v] for v in object_vertex_indices(tile_doc['CityObjects']['b3'])]
+            == [doc['vertices'][v] for v in object_vertex_indices(doc['CityObjects']['b3'])])
+
+
+def test_remap_uplift(tmp_path):
+    prefix = 'urn:city-validator:input-files/2/#vertices-'
+    (tmp_path / 'tile.ttl').write_text(f"<{prefix}0> <urn:test#next> <{prefix}1> .\n")
+    tiling.remap_uplift(tmp_path / 'tile.ttl', [5, 7], 2, tmp_path / 'remapped.nt')
+    assert (tmp_path / 'remapped.nt').read_text().strip() == f"<{prefix}5> <urn:test#next> <{prefix}7> ."
+
+
+def test_sharded_dataset(standins, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'shard_min_bytes', 0)
+    monkeypatch.setattr(settings, 'shard_tiles', 3)
+    doc = orjson.loads((DATA_DIR / 'cityjson-buildings.json').read_bytes())
+    dataset = Dataset('sharded', [model.InputFile(name='file.json', data_str=orjson.dumps(doc).decode())])
+    dataset.prepare_sync()
+    assert dataset.status == model.StatusCode.successful, dataset.errors
+    city_file = dataset.city_files[0]
+
+    # The result is the same as uplifting the whole file
+    full_path = tmp_path / 'full.json'
+    full_path.write_bytes(orjson.dumps(doc))
+    uplift.convert(full_path, tmp_path / 'full.ttl', 0)
+    assert uplift.compare(Graph().parse(city_file.uplift_path, format='turtle'),
+                          Graph().parse(tmp_path / 'full.ttl', format='turtle')) == []
+
+    # The val3dity reports of the tiles are merged in the order of the input
+    report = orjson.loads(city_file.val3dity_report_path.read_bytes())
+    assert [feature['id'] for feature in report['features']] == list(doc['CityObjects'])
+    assert not list(city_file.path.parent.glob('*-tile-*'))
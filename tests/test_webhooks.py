@@ -0,0 +1,116 @@
+import http.server
+import threading
+import time
+
+import pytest
+
+from app.config import settings
+from app.webhooks import Notification, WebhookDispatcher
+
+
+class Receiver(http.server.ThreadingHTTPServer):
+    # Records the bodies of the requests it receives, after waiting for delay seconds
+
+    def __init__(self, delay: float = 0, status: int = 204):
+        self.delay = delay
+        self.status = status
+        self.received: list[bytes] = []
+        self.event = threading.Event()
+        super().__init__(('127.0.0.1', 0), ReceiverHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/callback"
+
+
+class ReceiverHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.server.delay)
+        self.server.received.append(body)
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        self.server.event.set()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    monkeypatch.setattr(settings, 'webhook_retry_delay', 0.05)
+    dispatcher = WebhookDispatcher()
+    dispatcher.start()
+    yield dispatcher
+    dispatcher.stop()
+
+
+@pytest.fixture
+def receivers():
+    receivers = []
+    yield lambda *args, **kwargs: receivers.append(Receiver(*args, **kwargs)) or receivers[-1]
+    for receiver in receivers:
+        receiver.shutdown()
+        receiver.server_close()
+
+
+def wait_received(receiver: Receiver, count: int):
+    deadline = time.monotonic() + 5
+    while len(receiver.received) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_delivery(dispatcher, receivers):
+    receiver = receivers()
+    dispatcher.enqueue(Notification('job1', receiver.url, b'started', final=False))
+    wait_received(receiver, 1)
+    dispatcher.enqueue(Notification('job1', receiver.url, b'finished', final=True))
+    wait_received(receiver, 2)
+    assert receiver.received == [b'started', b'finished']
+
+
+def test_superseded(dispatcher, receivers):
+    # Pending in-progress notifications are dropped once the job finishes
+    receiver = receivers()
+    dispatcher.enqueue(Notification('job1', receiver.url, b'started', final=False), delay=0.5)
+    dispatcher.enqueue(Notification('job1', receiver.url, b'finished', final=True))
+    wait_received(receiver, 1)
+    time.sleep(0.6)
+    assert receiver.received == [b'finished']
+
+
+def test_slow_host(dispatcher, receivers):
+    # A slow host does not delay the notifications to other hosts
+    slow, fast = receivers(delay=1), receivers()
+    dispatcher.enqueue(Notification('job1', slow.url, b'slow', final=True))
+    time.sleep(0.1)
+    dispatcher.enqueue(Notification('job2', fast.url, b'fast', final=True))
+    assert fast.event.wait(0.5)
+    assert not slow.received
+
+
+def test_retry(dispatcher, receivers, monkeypatch):
+    monkeypatch.setattr(settings, 'webhook_max_attempts', 3)
+    receiver = receivers(status=503)
+    dispatcher.enqueue(Notification('job1', receiver.url, b'finished', final=True))
+    wait_received(receiver, 3)
+    time.sleep(0.3)
+    assert receiver.received == [b'finished'] * 3
+
+
+def test_idle_connections(dispatcher, receivers, monkeypatch):
+    monkeypatch.setattr(settings, 'webhook_idle_timeout', 0.1)
+    receiver = receivers()
+    dispatcher.enqueue(Notification('job1', receiver.url, b'finished', final=True))
+    assert receiver.event.wait(5)
+    with dispatcher._cond:
+        # Wake up the dispatcher thread, which closes idle connections
+        dispatcher._cond.notify()
+    deadline = time.monotonic() + 5
+    while dispatcher._hosts and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not dispatcher._hosts